@@ -0,0 +1,67 @@
+# bandit.py
+# 变异算子的自适应选择 (多臂老虎机 / 概率匹配)：
+#   每个后代记下它用的算子和父母中较好的分数，下一代评估后得到它相对父母的提升，
+#   各算子的质量 q 按本代平均正向提升做指数滑动平均，
+#   选择概率 p = p_min + (1 - K·p_min) · q / Σq，没有效果的算子保底 p_min，不会被彻底淘汰。
+# 状态是纯 JSON (放在 stats['operators'] 里随断点保存)，断点恢复后的轨迹与不中断时一致。
+import numpy as np
+
+
+class OperatorBandit:
+    """
+    用法：
+        bandit = OperatorBandit(names, base_weights, rate=0.2, min_prob=0.02)
+        p = bandit.probabilities()          # 交给 mutate_batch(weights=p)
+        bandit.credit(ops, gains)           # ops: 每个后代的算子编号 (-1 未变异)，gains: 后代分 - 父母分
+        stats['operators'] = bandit.state()
+    """
+
+    def __init__(self, names, base_weights, rate=0.2, min_prob=0.02, state=None):
+        self.names = list(names)
+        self.base = np.asarray(base_weights, dtype=np.float64) / np.sum(base_weights)
+        self.rate = rate
+        self.min_prob = min(min_prob, 1.0 / len(self.names))
+        n = len(self.names)
+        if state is None:
+            state = {'quality': [None] * n, 'applied': [0] * n, 'improved': [0] * n, 'gain': [0.0] * n}
+        self.quality = list(state['quality'])   # None 表示还没有观测
+        self.applied = list(state['applied'])   # 累计使用次数
+        self.improved = list(state['improved']) # 累计超过父母的次数
+        self.gain = list(state['gain'])         # 累计正向提升
+
+    def probabilities(self):
+        """当前各算子的选择概率 (没有观测的算子按已有质量的均值，全部没有时用初始权重)"""
+        seen = [q for q in self.quality if q is not None]
+        if not seen:
+            return self.base.copy()
+        fill = sum(seen) / len(seen)
+        q = np.array([fill if v is None else v for v in self.quality])
+        if q.sum() <= 0:
+            return self.base.copy()
+        return self.min_prob + (1 - len(q) * self.min_prob) * q / q.sum()
+
+    def credit(self, ops, gains):
+        """按一代的结果更新：ops 为算子编号数组 (-1 跳过)，gains 为对应后代相对父母的分差"""
+        ops = np.asarray(ops)
+        gains = np.asarray(gains, dtype=np.float64)
+        for k in range(len(self.names)):
+            g = gains[ops == k]
+            if not len(g): continue
+            reward = float(np.maximum(g, 0).mean())
+            q = self.quality[k]
+            self.quality[k] = reward if q is None else q + self.rate * (reward - q)
+            self.applied[k] += len(g)
+            self.improved[k] += int((g > 0).sum())
+            self.gain[k] += float(np.maximum(g, 0).sum())
+
+    def state(self):
+        return {'quality': list(self.quality), 'applied': list(self.applied),
+                'improved': list(self.improved), 'gain': list(self.gain)}
+
+    def summary(self):
+        """每个算子的 {prob, quality, applied, improved, mean_gain}"""
+        p = self.probabilities()
+        return {name: {'prob': float(p[k]), 'quality': self.quality[k], 'applied': self.applied[k],
+                       'improved': self.improved[k],
+                       'mean_gain': self.gain[k] / self.applied[k] if self.applied[k] else 0.0}
+                for k, name in enumerate(self.names)}
@@ -0,0 +1,168 @@
+# beam_search.py
+# 第二种生成引擎：逐步的束搜索 (beam search) + 动态规划状态合并，不做随机采样。
+# 适应度几乎都是局部项，可以沿时间精确累加：
+#   旋律层  只看相邻 2~3 个 event   -> 状态里记住最后两个音高 + 最后一个音是否和弦音
+#   和声层  每个 event 单独查表      -> 当步即可加分
+#   节奏层  每个小节一个起奏掩码      -> 小节结束时查律动表；小节内用"补全后能达到的最高律动分"做乐观估计
+#   结构层  每个乐句第 2 小节结束音 / 动机重复 / 终止式 -> 在它们确定的那一步 (乐句第 2、3 小节末、最后一步) 加上
+# 所以每个候选的前缀分都是精确的，最终得分与 get_fitness 完全一致。
+# 未来得分只取决于上述状态的候选可以合并，只保留前缀分最高的一个 (动态规划)。
+#   python beam_search.py --width 256
+import argparse
+import sys
+import time
+import numpy as np
+import config
+import utils
+from fitness_function import FitnessModel, DEFAULT_MODEL, get_fitness
+
+
+def groove_bounds(groove, steps_per_bar):
+    """
+    bounds[L][m]：小节前 L 步的起奏掩码为 m 时，补全整个小节能得到的最高律动分。
+    掩码 = 高位 × 2^L + m，所以 reshape 之后按列取最大即可。
+    """
+    return [groove.reshape(1 << (steps_per_bar - L), 1 << L).max(axis=0)
+            for L in range(steps_per_bar + 1)]
+
+
+def motif_table(steps_per_bar):
+    """fitness_function._motif_score 按 (mask0 ^ mask2) 查表 (两小节等长时只取决于异或结果)"""
+    diff = np.arange(1 << steps_per_bar)
+    same = steps_per_bar - np.array([bin(m).count('1') for m in diff])
+    return np.where(diff == 0, 15, np.where(same >= steps_per_bar * 0.75, 10, 0))
+
+
+def beam_search(width=None, n_steps=None, cfg=config, model=None):
+    """
+    束宽为 width 的逐步搜索，返回 (最佳旋律列表, 分数, 统计)。
+    统计字段：expanded 打分的候选 (前缀 + 一步) 数；evaluations 折算成整条旋律的评估次数
+    (expanded / n_steps，用来与遗传算法的评估次数比较)；merged 被动态规划合并掉的候选数；elapsed 秒数。
+    """
+    if width is None: width = cfg.BEAM_WIDTH
+    if n_steps is None: n_steps = cfg.TOTAL_STEPS
+    if model is None: model = DEFAULT_MODEL if cfg is config else FitnessModel(cfg)
+    spb = model.steps_per_bar
+    if n_steps % spb:
+        raise ValueError(f"旋律长度 {n_steps} 不是小节长度 {spb} 的整数倍")
+    if spb > 16:
+        raise ValueError(f"每小节 {spb} 步超出状态编码范围 (最多 16)")
+    t0 = time.perf_counter()
+    w_melody, w_harmony, w_rhythm, w_structure = model.weights
+    bounds = groove_bounds(model.groove, spb)
+    motif = motif_table(spb)
+    interval = model.interval.astype(np.int64)
+    inertia = model.inertia.astype(np.int64)
+    cadence = model.cadence.astype(np.int64)
+    values = np.r_[0, np.arange(cfg.PITCH_MIN, cfg.PITCH_MAX + 1)]
+    n_values = len(values)
+    is_event = values > 0
+
+    # 束中每个状态 (长度 B 的数组)
+    score = np.zeros(1)                        # 精确的加权前缀分
+    p1 = np.zeros(1, dtype=np.int64)           # 最后一个 event 的音高 (0 表示还没有)
+    p2 = np.zeros(1, dtype=np.int64)           # 倒数第二个 event 的音高
+    c1 = np.zeros(1, dtype=bool)               # 最后一个 event 是否和弦音
+    rest = np.ones(1, dtype=bool)              # 上一步是否休止 (决定下一步是否起奏)
+    in_bar1 = np.zeros(1, dtype=bool)          # 最后一个 event 是否落在本乐句的第 2 小节
+    mask = np.zeros(1, dtype=np.int64)         # 当前小节的起奏掩码
+    mask0 = np.zeros(1, dtype=np.int64)        # 本乐句第 1 小节的起奏掩码 (动机重复用)
+    melodies = np.zeros((1, 0), dtype=np.uint8)
+    expanded = merged = 0
+
+    for i in range(n_steps):
+        # bar 是乐句内的小节号，结构项逐个乐句计分
+        row, j, bar = i % model.period, i % spb, i // spb % model.phrase_bars
+        if j == 0 and bar == 0:
+            in_bar1 = np.zeros_like(in_bar1)
+        member = model.member[row][values]
+
+        # 1. 展开：每个状态 × 每个取值 -> (B, K)
+        d = values[None, :] - p1[:, None]
+        has1, has2 = (p1 > 0)[:, None], (p2 > 0)[:, None]
+        melodic = np.where(has1, interval[np.abs(d)], 0) \
+                  + np.where(has2, inertia[(p1 - p2 + 127)[:, None], np.clip(d + 127, 0, 254)], 0) \
+                  + np.where(has1 & ~c1[:, None] & (np.abs(d) <= 2) & member[None, :], 30, 0)
+        delta = np.where(is_event[None, :],
+                         w_melody * melodic + w_harmony * model.harmony[row][values][None, :], 0.0)
+        onset = is_event[None, :] & ((j == 0) | rest[:, None] | (values[None, :] != p1[:, None]))
+        new_mask = mask[:, None] | (onset.astype(np.int64) << j)
+        new_p1 = np.where(is_event[None, :], values[None, :], p1[:, None])
+        new_p2 = np.where(is_event[None, :], p1[:, None], p2[:, None])
+        new_c1 = np.where(is_event[None, :], member[None, :], c1[:, None])
+        new_rest = np.broadcast_to(~is_event[None, :], delta.shape)
+        new_in_bar1 = np.where(is_event[None, :], bar == 1, in_bar1[:, None])
+        new_mask0 = np.broadcast_to(mask0[:, None], delta.shape)
+
+        # 2. 确定下来的小节级 / 结构项
+        if j == spb - 1:
+            delta = delta + w_rhythm * model.groove[new_mask]
+            if bar == 0:
+                new_mask0 = new_mask
+            if bar == 1:
+                delta = delta + w_structure * np.where(new_in_bar1 & model.half_cadence[new_p1], 15, 0)
+            if bar == 2:
+                delta = delta + w_structure * motif[new_mask0 ^ new_mask]
+        if i == n_steps - 1:
+            delta = delta + np.where(new_p1 > 0, w_structure * cadence[new_p1], -np.inf)
+        new_score = score[:, None] + delta
+        rank = new_score if j == spb - 1 else new_score + w_rhythm * bounds[j + 1][new_mask]
+        expanded += new_score.size
+
+        # 3. 动态规划合并：未来得分只取决于这些状态，同一状态只留前缀分最高的
+        bar_done = j == spb - 1
+        key = new_p1 | (new_p2 << 7) | (new_c1.astype(np.int64) << 14) | (new_rest.astype(np.int64) << 15)
+        if bar < 1 or (bar == 1 and not bar_done):
+            key = key | (new_in_bar1.astype(np.int64) << 16)
+        if not bar_done:
+            key = key | (new_mask << 17)
+        if bar < 2 or (bar == 2 and not bar_done):
+            key = key | (new_mask0 << (17 + spb))
+        key, rank, new_score = key.ravel(), rank.ravel(), new_score.ravel()
+        order = np.lexsort((-rank, key))
+        first = np.r_[True, key[order][1:] != key[order][:-1]]
+        keep = order[first]
+        merged += len(order) - len(keep)
+
+        # 4. 剪枝：按 (前缀分 + 乐观估计) 保留前 width 个
+        if len(keep) > width:
+            keep = keep[np.argpartition(-rank[keep], width - 1)[:width]]
+        src, val = np.divmod(keep, n_values)
+        score = new_score[keep]
+        p1, p2, c1 = new_p1.ravel()[keep], new_p2.ravel()[keep], new_c1.ravel()[keep]
+        rest, in_bar1 = new_rest.ravel()[keep], new_in_bar1.ravel()[keep]
+        mask = np.zeros_like(keep) if bar_done else new_mask.ravel()[keep]
+        mask0 = new_mask0.ravel()[keep]
+        melodies = np.concatenate([melodies[src], values[val].astype(np.uint8)[:, None]], axis=1)
+
+    best = int(np.argmax(score))
+    melody = melodies[best].tolist()
+    stats = {
+        'expanded': expanded,
+        'evaluations': expanded / n_steps,
+        'merged': merged,
+        'elapsed': time.perf_counter() - t0,
+    }
+    return melody, get_fitness(melody, model=model), stats
+
+
+def train_beam(width=None, cfg=None, **kwargs):
+    """与 main.train() 对应的入口：返回最佳旋律"""
+    if cfg is None: cfg = config
+    melody, score, stats = beam_search(width, cfg=cfg, **kwargs)
+    print(f"Beam search (width {width or cfg.BEAM_WIDTH}): Best {score:.2f} | "
+          f"{stats['evaluations']:.0f} evaluations | {stats['elapsed']:.2f}s")
+    return melody
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="束搜索旋律生成")
+    parser.add_argument('--width', type=int, help=f"束宽 (默认 config.BEAM_WIDTH={config.BEAM_WIDTH})")
+    parser.add_argument('-o', '--output', default="final_beam_music.mid", help="输出 MIDI 文件")
+    args = parser.parse_args(argv)
+    utils.save_melody_to_midi(train_beam(args.width), args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,518 @@
+# benchmark.py
+# 性能基准：覆盖适应度各层与繁殖热点，按种群规模 × 旋律长度参数化。
+#   python benchmark.py                       # 全部组合 (1k/10k/100k × 32/64/256/4096，内存放不下的组合记为 skipped)
+#   python benchmark.py --quick               # 只跑 1k × 32
+#   python benchmark.py -o bench.json         # 保存结果 (JSON)
+#   python benchmark.py --baseline bench.json # 与保存的基线比较，变慢超过阈值则标记回归并返回 1
+#   python benchmark.py --engines --target 2400  # 遗传算法 vs 束搜索：达到目标分所需的评估次数与耗时
+#   python benchmark.py --islands --target 2400  # 单种群 vs 岛屿模型：达到目标分的墙上耗时
+#   python benchmark.py --workers 1 2 4 --pop 1000 --steps 256  # 并行评估的进程数扩展
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+import numpy as np
+import config
+import utils
+import main
+import sparse
+import beam_search
+import islands
+from parallel import ParallelEvaluator
+from stopping import TargetScore
+from fitness_function import (get_fitness, get_fitness_batch, analyze_melody,
+                              fit_melodic_flow, fit_harmonic_quality, fit_rhythm_groove,
+                              fit_structure_coherence, score_components, rescore_delta,
+                              FitnessCache)
+
+POP_SIZES = (1000, 10000, 100000)
+STEP_COUNTS = (32, 64, 256, 4096)
+MEMORY_FRACTION = 0.8   # 预计峰值内存超过可用内存的这个比例时跳过该组合 (结果表里记为 skipped)
+
+
+def _best_of(fn, repeat):
+    """重复执行取最快的一次 (秒)"""
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+# ==========================================
+# 1. 基准用例
+# 每个用例接收一个准备好的上下文，返回 (待计时的函数, 处理的个体数)
+# ==========================================
+
+def _scalar(fn):
+    """逐个体调用的标量用例：只在样本上计时，按个体数折算"""
+    def case(ctx):
+        sample = ctx['sample']
+        return (lambda: [fn(m) for m in sample]), len(sample)
+    return case
+
+
+def _scalar_analyzed(fn):
+    """需要 analyze_melody 预处理结果的适应度层"""
+    def case(ctx):
+        analyzed = ctx['analyzed']
+        return (lambda: [fn(*a) for a in analyzed]), len(analyzed)
+    return case
+
+
+def _op(fn):
+    """标量变异算子：在副本上操作，不污染样本"""
+    def case(ctx):
+        sample = ctx['sample']
+        return (lambda: [fn(m[:]) for m in sample]), len(sample)
+    return case
+
+
+def _batch_op(fn):
+    """批量变异算子：作用于整个种群副本"""
+    def case(ctx):
+        pop, rng = ctx['pop'], ctx['rng']
+        rows = np.arange(len(pop))
+        return (lambda: fn(pop.copy(), rows, rng)), len(pop)
+    return case
+
+
+def _case_crossover(ctx):
+    sample = ctx['sample']
+    pairs = list(zip(sample[::2], sample[1::2]))
+    return (lambda: [main.crossover(a, b) for a, b in pairs]), len(pairs) * 2
+
+
+def _case_crossover_batch(ctx):
+    pop, rng = ctx['pop'], ctx['rng']
+    half = len(pop) // 2
+    return (lambda: main.crossover_batch(pop[:half], pop[half:2 * half], rng)), half * 2
+
+
+def _case_mutate_dispatcher(ctx):
+    sample = ctx['sample']
+    return (lambda: [main.mutate_dispatcher(m, 1.0) for m in sample]), len(sample)
+
+
+def _case_mutate_batch(ctx):
+    pop, rng = ctx['pop'], ctx['rng']
+    return (lambda: main.mutate_batch(pop.copy(), 1.0, rng)), len(pop)
+
+
+def _case_tournament(ctx):
+    scores, rng = ctx['scores'], ctx['rng']
+    n_pairs = len(scores) // 2
+    return (lambda: main.tournament_select(scores, n_pairs, rng)), n_pairs * 2
+
+
+def _case_top_k(ctx):
+    """精英选取 (部分排序)"""
+    scores = ctx['scores']
+    k = max(int(len(scores) * 0.05), 3)
+    return (lambda: main.top_k(scores, k)), len(scores)
+
+
+def _case_fitness_batch(ctx):
+    pop = ctx['pop']
+    return (lambda: get_fitness_batch(pop)), len(pop)
+
+
+def _case_delta(ctx):
+    """单基因变异后的增量重算 (与 get_fitness 用例对照)"""
+    sample = ctx['sample']
+    comps = [score_components(m) for m in sample]
+    children, positions = [], []
+    for m in sample:
+        child = m[:]
+        idx = random.randrange(len(m))
+        child[idx] = random.randint(config.PITCH_MIN, config.PITCH_MAX)
+        children.append(child)
+        positions.append(idx)
+    return (lambda: [rescore_delta(c, p, i, i + 1)
+                     for c, p, i in zip(children, comps, positions)]), len(sample)
+
+
+def _case_fitness_held(ctx):
+    """逐步基因的标量打分，输入与 get_fitness_notes 用例相同 (长音符、稀疏的旋律)"""
+    melodies = ctx['held']
+    return (lambda: [get_fitness(m) for m in melodies]), len(melodies)
+
+
+def _case_fitness_notes(ctx):
+    """稀疏音符表示的打分 (开销随音符数增长)"""
+    notes, steps = ctx['notes'], ctx['steps']
+    return (lambda: [sparse.get_fitness_notes(n, steps) for n in notes]), len(notes)
+
+
+def _case_mutate_notes(ctx):
+    notes, steps, rng = ctx['notes'], ctx['steps'], ctx['rng']
+    return (lambda: [sparse.mutate_notes(n, 1.0, steps, rng) for n in notes]), len(notes)
+
+
+def _case_crossover_notes(ctx):
+    notes, steps, rng = ctx['notes'], ctx['steps'], ctx['rng']
+    pairs = list(zip(notes[::2], notes[1::2]))
+    return (lambda: [sparse.crossover_notes(a, b, steps, rng) for a, b in pairs]), len(pairs) * 2
+
+
+def _case_generation(ctx):
+    """完整一代：评估 (无缓存) + 排序 + 停滞检测 + 繁殖"""
+    pop, rng = ctx['pop'], ctx['rng']
+    def run():
+        scores = get_fitness_batch(pop)
+        ranked = main.top_k(scores, max(int(len(pop) * 0.05), 3))
+        stats = main.new_stats()
+        main.update_stats(stats, scores[ranked[0]])
+        main.breed(pop, scores, ranked, stats['mut_rate'], rng)
+    return run, len(pop)
+
+
+def _case_generation_cached(ctx):
+    """完整一代，带适应度缓存 (第二次评估同一种群，模拟收敛后的重复个体)"""
+    pop, rng = ctx['pop'], ctx['rng']
+    cache = FitnessCache(len(pop))
+    cache.score_batch(pop)
+    def run():
+        scores = cache.score_batch(pop)
+        ranked = main.top_k(scores, max(int(len(pop) * 0.05), 3))
+        main.breed(pop, scores, ranked, config.MUTATION_RATE_BASE, rng)
+    return run, len(pop)
+
+
+CASES = {
+    'get_fitness':              _scalar(get_fitness),
+    'analyze_melody':           _scalar(analyze_melody),
+    'fit_melodic_flow':         _scalar_analyzed(lambda events, bars: fit_melodic_flow(events)),
+    'fit_harmonic_quality':     _scalar_analyzed(lambda events, bars: fit_harmonic_quality(events)),
+    'fit_rhythm_groove':        _scalar_analyzed(lambda events, bars: fit_rhythm_groove(bars)),
+    'fit_structure_coherence':  _scalar_analyzed(fit_structure_coherence),
+    'rescore_delta':            _case_delta,
+    'get_fitness_batch':        _case_fitness_batch,
+    'op_micro_adjust':          _op(main.op_micro_adjust),
+    'op_shadow_echo':           _op(main.op_shadow_echo),
+    'op_rhythm_clone':          _op(main.op_rhythm_clone),
+    'op_retrograde_segment':    _op(main.op_retrograde_segment),
+    'op_inversion_segment':     _op(main.op_inversion_segment),
+    'mutate_dispatcher':        _case_mutate_dispatcher,
+    'crossover':                _case_crossover,
+    'op_micro_adjust_batch':        _batch_op(main.op_micro_adjust_batch),
+    'op_shadow_echo_batch':         _batch_op(main.op_shadow_echo_batch),
+    'op_rhythm_clone_batch':        _batch_op(main.op_rhythm_clone_batch),
+    'op_retrograde_segment_batch':  _batch_op(main.op_retrograde_segment_batch),
+    'op_inversion_segment_batch':   _batch_op(main.op_inversion_segment_batch),
+    'op_random_reset_batch':        _batch_op(main.op_random_reset_batch),
+    'mutate_batch':             _case_mutate_batch,
+    'crossover_batch':          _case_crossover_batch,
+    'tournament_select':        _case_tournament,
+    'top_k':                    _case_top_k,
+    'get_fitness_held':         _case_fitness_held,
+    'get_fitness_notes':        _case_fitness_notes,
+    'mutate_notes':             _case_mutate_notes,
+    'crossover_notes':          _case_crossover_notes,
+    'train_generation':         _case_generation,
+    'train_generation_cached':  _case_generation_cached,
+}
+
+
+# ==========================================
+# 2. 运行与比较
+# ==========================================
+
+def _context(pop_size, steps, max_scalar, seed):
+    """生成某个 (POP, STEPS) 组合下各用例共享的数据"""
+    random.seed(seed)
+    rng = np.random.default_rng(seed)
+    pop = utils.generate_random_population(pop_size, steps, rng)
+    sample = pop[:max_scalar].tolist()
+    # 稀疏表示用例：带长音符的随机旋律 (逐步基因版本作为对照)
+    notes = [sparse.random_notes(steps, rng) for _ in range(len(sample))]
+    return {
+        'pop': pop,
+        'rng': rng,
+        'steps': steps,
+        'sample': sample,
+        'notes': notes,
+        'held': [sparse.to_dense(n, steps).tolist() for n in notes],
+        'analyzed': [analyze_melody(m)[:2] for m in sample],
+        'scores': get_fitness_batch(pop),
+    }
+
+
+def available_memory():
+    """可用内存 (字节)：优先读 /proc/meminfo 的 MemAvailable，读不到时用空闲物理页数，都不行返回 None"""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def bytes_per_cell(steps, probe=256, seed=0):
+    """
+    每个基因格 (个体 × 步) 的峰值内存：在 probe 个个体上实测一整代 (批量打分 + 繁殖) 的
+    临时数组峰值 (tracemalloc)，再加上上下文常驻的种群与若干个副本。
+    """
+    rng = np.random.default_rng(seed)
+    pop = utils.generate_random_population(probe, steps, rng)
+    tracemalloc.start()
+    try:
+        scores = get_fitness_batch(pop)
+        main.breed(pop, scores, main.top_k(scores, 3), config.MUTATION_RATE_BASE, rng)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return peak / pop.size + 4 * pop.itemsize
+
+
+def run_suite(pop_sizes=POP_SIZES, step_counts=STEP_COUNTS, names=None,
+              repeat=3, max_scalar=2000, seed=0, memory=None):
+    """
+    运行所选用例，返回结果列表 (每条记录一个 用例 × POP × STEPS 组合)。
+    预计峰值内存超过 memory (字节，默认可用内存 × MEMORY_FRACTION) 的组合不运行，
+    各用例记一条 skipped 记录 (写明需要与可用的内存)。
+    """
+    names = list(CASES) if names is None else names
+    if memory is None:
+        available = available_memory()
+        memory = None if available is None else available * MEMORY_FRACTION
+    results = []
+    for steps in step_counts:
+        per_cell = bytes_per_cell(steps) if memory is not None else 0.0
+        for pop_size in pop_sizes:
+            need = per_cell * pop_size * steps
+            if memory is not None and need > memory:
+                reason = f"needs ~{need / 2**20:.0f} MiB > {memory / 2**20:.0f} MiB"
+                for name in names:
+                    results.append({'name': name, 'pop_size': pop_size, 'steps': steps,
+                                    'items': None, 'seconds': None, 'us_per_item': None,
+                                    'skipped': reason})
+                    print(f"{name:28s} pop={pop_size:<6d} steps={steps:<3d} skipped ({reason})",
+                          file=sys.stderr)
+                continue
+            ctx = _context(pop_size, steps, max_scalar, seed)
+            for name in names:
+                fn, items = CASES[name](ctx)
+                seconds = _best_of(fn, repeat)
+                results.append({
+                    'name': name,
+                    'pop_size': pop_size,
+                    'steps': steps,
+                    'items': items,
+                    'seconds': seconds,
+                    'us_per_item': seconds / items * 1e6,
+                })
+                print(f"{name:28s} pop={pop_size:<6d} steps={steps:<3d} "
+                      f"{seconds * 1e3:10.3f} ms  {seconds / items * 1e6:9.3f} us/item",
+                      file=sys.stderr)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    与基线逐条比较 us_per_item。变慢超过 tolerance (比例) 记为回归。
+    返回带 ratio / regression 字段的比较记录。
+    """
+    index = {(r['name'], r['pop_size'], r['steps']): r for r in baseline['results']}
+    rows = []
+    for r in results:
+        base = index.get((r['name'], r['pop_size'], r['steps']))
+        if base is None or r.get('skipped') or base.get('skipped'): continue
+        ratio = r['us_per_item'] / base['us_per_item']
+        rows.append({
+            'name': r['name'], 'pop_size': r['pop_size'], 'steps': r['steps'],
+            'baseline_us': base['us_per_item'], 'current_us': r['us_per_item'],
+            'ratio': ratio, 'regression': ratio > 1 + tolerance,
+        })
+    return rows
+
+
+# ==========================================
+# 3. 引擎对比 (遗传算法 vs 束搜索)
+# ==========================================
+
+def run_ga_to_target(target, seed, generations):
+    """遗传算法跑到目标分为止：返回 (最终最佳分, 达标代数, 累计评估次数, 耗时)，未达标时代数为 None"""
+    evaluated = []
+    random.seed(seed)
+    t0 = time.perf_counter()
+    reached = None
+    with contextlib.redirect_stdout(io.StringIO()):
+        for snapshot in main.evolve(generations=generations, stop=TargetScore(target), workers=0,
+                                    recorder=lambda record: evaluated.append(record['evaluated']),
+                                    checkpoint_path=None):
+            if reached is None and snapshot['best_score'] >= target:
+                reached = snapshot['gen']
+    return snapshot['best_score'], reached, sum(evaluated), time.perf_counter() - t0
+
+
+def head_to_head(target, seeds=(0, 1, 2), widths=(16, 64, 256, 1024), generations=None):
+    """
+    同一个目标分下比较两种引擎。遗传算法的评估次数是实际打分的个体数 (缓存命中不计)，
+    束搜索的评估次数是打分的"前缀 + 一步"候选数折算成整条旋律 (见 beam_search.beam_search)。
+    """
+    rows = []
+    for seed in seeds:
+        score, reached, evaluations, seconds = run_ga_to_target(target, seed, generations)
+        rows.append({'engine': 'ga', 'seed': seed, 'best_score': score, 'reached': reached is not None,
+                     'generations': reached, 'evaluations': evaluations, 'seconds': seconds})
+    for width in widths:
+        _, score, stats = beam_search.beam_search(width)
+        rows.append({'engine': 'beam', 'width': width, 'best_score': score, 'reached': score >= target,
+                     'evaluations': stats['evaluations'], 'seconds': stats['elapsed']})
+    for r in rows:
+        label = f"seed={r['seed']}" if r['engine'] == 'ga' else f"width={r['width']}"
+        print(f"{r['engine']:5s} {label:11s} best {r['best_score']:8.2f} "
+              f"{'reached' if r['reached'] else 'missed ':8s} {r['evaluations']:10.0f} evals "
+              f"{r['seconds']:8.2f}s", file=sys.stderr)
+    return rows
+
+
+def islands_vs_single(target, seeds=(0, 1, 2), n_islands=None, generations=None):
+    """
+    同一个目标分、同样的总种群规模下比较单种群与岛屿模型 (n_islands 个进程)。
+    比较的是墙上耗时 (岛屿模式含进程启动)，只有多核机器上岛屿模式才可能更快。
+    """
+    if n_islands is None: n_islands = config.ISLANDS
+    rows = []
+    for seed in seeds:
+        score, reached, _, seconds = run_ga_to_target(target, seed, generations)
+        rows.append({'engine': 'single', 'seed': seed, 'best_score': score,
+                     'reached': reached is not None, 'seconds': seconds})
+        t0 = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, score, _ = islands.train_islands(n_islands, generations, seed=seed, stop=TargetScore(target))
+        rows.append({'engine': f'islands{n_islands}', 'seed': seed, 'best_score': score,
+                     'reached': score >= target, 'seconds': time.perf_counter() - t0})
+    for r in rows:
+        print(f"{r['engine']:9s} seed={r['seed']:<5d} best {r['best_score']:8.2f} "
+              f"{'reached' if r['reached'] else 'missed ':8s} {r['seconds']:8.2f}s", file=sys.stderr)
+    return rows
+
+
+# ==========================================
+# 4. 并行评估的进程数扩展
+# ==========================================
+
+def worker_scaling(pop_size, steps, worker_counts=(1, 2, 4), repeat=3, miss_rate=None, seed=0):
+    """
+    ParallelEvaluator 在不同进程数下给一批旋律打分的耗时，与本进程串行 (workers=0) 对照。
+    miss_rate 给定时只打分 pop_size × miss_rate 行，模拟带缓存训练时每代送去打分的未命中个体。
+    """
+    rng = np.random.default_rng(seed)
+    n = pop_size if miss_rate is None else max(int(pop_size * miss_rate), 1)
+    pop = utils.generate_random_population(n, steps, rng)
+    serial = _best_of(lambda: get_fitness_batch(pop), repeat)
+    rows = [{'workers': 0, 'rows': n, 'steps': steps, 'chunks': 1, 'seconds': serial, 'speedup': 1.0}]
+    for workers in worker_counts:
+        if workers < 1: continue
+        with ParallelEvaluator(workers, capacity=n, n_steps=steps) as evaluator:
+            evaluator(pop)  # 预热：子进程导入与挂载共享内存
+            seconds = _best_of(lambda: evaluator(pop), repeat)
+            chunks = len(evaluator._chunks(n)) if n > evaluator.min_chunk else 1
+        rows.append({'workers': workers, 'rows': n, 'steps': steps, 'chunks': chunks,
+                     'seconds': seconds, 'speedup': serial / seconds})
+    for r in rows:
+        print(f"workers={r['workers']:<3d} rows={r['rows']:<7d} steps={r['steps']:<5d} chunks={r['chunks']:<3d} "
+              f"{r['seconds'] * 1e3:10.3f} ms  x{r['speedup']:.2f}", file=sys.stderr)
+    return rows
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="适应度与繁殖热点的性能基准")
+    parser.add_argument('--pop', type=int, nargs='+', default=list(POP_SIZES), help="种群规模")
+    parser.add_argument('--steps', type=int, nargs='+', default=list(STEP_COUNTS), help="旋律长度")
+    parser.add_argument('--case', nargs='+', choices=list(CASES), help="只跑指定用例")
+    parser.add_argument('--quick', action='store_true', help="只跑 pop=1000, steps=32")
+    parser.add_argument('--repeat', type=int, default=3, help="每个用例重复次数 (取最快)")
+    parser.add_argument('--max-scalar', type=int, default=2000, help="标量用例的样本数")
+    parser.add_argument('--memory', type=float, help="内存上限 (MiB)，预计超出的组合跳过 (默认按可用内存)")
+    parser.add_argument('-o', '--output', help="把结果写入 JSON 文件 (可作为基线)")
+    parser.add_argument('--baseline', help="与之比较的基线 JSON 文件")
+    parser.add_argument('--tolerance', type=float, default=0.15, help="允许的变慢比例")
+    parser.add_argument('--engines', action='store_true', help="只做遗传算法与束搜索的对比")
+    parser.add_argument('--target', type=float, default=2400, help="引擎对比的目标分")
+    parser.add_argument('--widths', type=int, nargs='+', default=[16, 64, 256, 1024], help="束搜索的束宽")
+    parser.add_argument('--seeds', type=int, nargs='+', default=[0, 1, 2], help="遗传算法的随机种子")
+    parser.add_argument('--islands', type=int, nargs='?', const=config.ISLANDS,
+                        help="只做单种群与岛屿模型 (默认 config.ISLANDS 个岛) 的对比")
+    parser.add_argument('--workers', type=int, nargs='+', help="只做并行评估的进程数扩展 (用 --pop/--steps 的第一个值)")
+    parser.add_argument('--miss-rate', type=float, help="进程数扩展只打分这个比例的行 (模拟缓存未命中)")
+    args = parser.parse_args(argv)
+
+    if args.workers:
+        rows = worker_scaling(args.pop[0], args.steps[0], args.workers, args.repeat, args.miss_rate)
+        text = json.dumps({'cpus': os.cpu_count(), 'worker_scaling': rows}, indent=2)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(text)
+        else:
+            print(text)
+        return 0
+
+    if args.islands:
+        rows = islands_vs_single(args.target, args.seeds, args.islands)
+        text = json.dumps({'target': args.target, 'cpus': os.cpu_count(), 'islands_vs_single': rows}, indent=2)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(text)
+        else:
+            print(text)
+        return 0
+
+    if args.engines:
+        rows = head_to_head(args.target, args.seeds, args.widths)
+        text = json.dumps({'target': args.target, 'head_to_head': rows}, indent=2)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(text)
+        else:
+            print(text)
+        return 0
+
+    pop_sizes, step_counts = (([1000], [32]) if args.quick else (args.pop, args.steps))
+    memory = None if args.memory is None else args.memory * 2**20
+    results = run_suite(pop_sizes, step_counts, args.case, args.repeat, args.max_scalar, memory=memory)
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['comparison'] = compare(results, json.load(f), args.tolerance)
+        regressions = [c for c in report['comparison'] if c['regression']]
+        for c in regressions:
+            print(f"REGRESSION {c['name']} pop={c['pop_size']} steps={c['steps']}: "
+                  f"{c['baseline_us']:.3f} -> {c['current_us']:.3f} us/item (x{c['ratio']:.2f})",
+                  file=sys.stderr)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
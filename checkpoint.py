@@ -0,0 +1,53 @@
+# checkpoint.py
+# 训练断点：把某一代评估完成后的完整状态写成一个 .npz 文件 (未压缩，写入几乎不耗时)：
+#   population  (POP, TOTAL_STEPS) uint8 种群
+#   scores      (POP,) float64 该种群的分数
+#   stats       训练状态字典 (JSON)
+#   random 模块与 numpy Generator 的随机数状态
+# 先写临时文件再 os.replace 原子替换，训练中途被杀也不会留下半个文件。
+import json
+import os
+import random
+import numpy as np
+
+
+def save_checkpoint(path, gen, population, scores, stats, rng):
+    """原子地写入第 gen 代 (已评估、已更新 stats) 的断点"""
+    version, internal, gauss_next = random.getstate()
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(
+            f,
+            gen=np.int64(gen),
+            population=np.ascontiguousarray(population, dtype=np.uint8),
+            scores=np.asarray(scores, dtype=np.float64),
+            stats=np.frombuffer(json.dumps(stats).encode(), dtype=np.uint8),
+            random_version=np.int64(version),
+            random_internal=np.asarray(internal, dtype=np.uint32),
+            random_gauss=np.float64(np.nan if gauss_next is None else gauss_next),
+            numpy_rng=np.frombuffer(json.dumps(rng.bit_generator.state).encode(), dtype=np.uint8),
+        )
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def load_checkpoint(path):
+    """
+    读取断点，恢复 random 模块状态，返回
+    (gen, population, scores, stats, rng)，rng 为恢复好状态的 numpy Generator。
+    """
+    with np.load(path) as data:
+        gen = int(data['gen'])
+        population = data['population'].copy()
+        scores = data['scores'].copy()
+        stats = json.loads(data['stats'].tobytes().decode())
+        gauss = float(data['random_gauss'])
+        random.setstate((int(data['random_version']),
+                         tuple(int(x) for x in data['random_internal']),
+                         None if np.isnan(gauss) else gauss))
+        rng_state = json.loads(data['numpy_rng'].tobytes().decode())
+
+    rng = np.random.default_rng()
+    rng.bit_generator.state = rng_state
+    return gen, population, scores, stats, rng
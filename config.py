@@ -8,6 +8,8 @@ NUM_BARS = 4            # 【生成长度】旋律包含的小节数。4小节
 BEATS_PER_BAR = 4       # 【拍号】每小节几拍。4代表 4/4 拍，这是最常见的流行音乐拍号。
 STEPS_PER_BEAT = 2      # 【时间精度】每拍被切分成几份。2 代表最小单位是八分音符。
                         # 注意：如果此处改为4，则最小单位是十六分音符。
+PHRASE_BARS = 4         # 【乐句长度】结构层 (问答、动机重复) 按几小节一句来评价。
+                        # 长于一句的旋律逐句计分，终止式仍只看整首的最后一个音。
 
 # 【基因长度】染色体的总长度。
 # 计算公式：小节数 * 每小节拍数 * 每拍切片数
@@ -48,14 +50,109 @@ MUTATION_RATE_BASE = 0.05
 # 50 代表每一代评分最高的 50 个个体不经过交叉变异，直接复制到下一代。
 ELITISM_COUNT = 50      
 
+# 【适应度权重】(旋律, 和声, 节奏, 结构) 四层分数的加权系数，见 fitness_function.get_fitness。
+FITNESS_WEIGHTS = (3.0, 3.0, 8.0, 3.0)
+
+# 【多样性替换】每代繁殖后，只差一个小节 (含完全相同) 的个体最多保留多少个，
+# 其余的随机重写两个小节；完全相同的个体只保留一个。0 表示关闭。
+NEAR_DUPLICATE_LIMIT = 2
+
+# 【适应度缓存】最多记住多少条旋律的分数 (LRU 淘汰)。
+# 精英和未变异的后代每代都会重复出现，命中缓存即可跳过打分；设为 0 关闭缓存。
+FITNESS_CACHE_SIZE = 20000
+
+# 【并行评估】打分使用的进程数。0 或 1 表示单进程串行评估。
+# 大于 1 时种群放在共享内存中，由常驻进程池分块打分，结果与串行完全一致。
+# 有适应度缓存时每代只给未命中的旋律打分 (默认设置下约 800 条)，每块至少约 16k 个基因格
+# (见 parallel.MIN_CHUNK_CELLS)，能用上的进程数约为 未命中数 × TOTAL_STEPS / 16k：
+# 默认的 32 步、POP 1000 最多用到 1~2 个进程，长旋律 (几百步以上) 或大种群才值得调大。
+WORKERS = 0
+
+# 【岛屿模型】(islands.py) 子种群数量，每个岛在独立进程中进化。
+ISLANDS = 4
+# 【迁移间隔】每隔多少代交换一次个体。
+MIGRATION_INTERVAL = 20
+# 【移民数量】每次迁移时每个岛送出的最优个体数 (替换目标岛最差的同等数量)。
+MIGRANTS = 5
+# 【迁移拓扑】'ring' 环形 (i -> i+1) 或 'random' 每次随机错排。
+MIGRATION_TOPOLOGY = 'ring'
+
+# 【性能记录】train() 逐代写出各阶段耗时/吞吐/分数分布的 JSONL 文件路径。
+# None 表示不记录 (几乎零开销)；也可以在调用 train(recorder=...) 时传入回调函数。
+PROFILE_LOG = None
+
+# 【断点续训】断点文件路径 (None 表示不保存) 与保存间隔 (代)。
+# 断点包含种群、分数、训练状态和随机数状态，main.resume_training() 可从中继续。
+CHECKPOINT_PATH = None
+CHECKPOINT_EVERY = 25
+
+# 【种子旋律库】存放 .mid 文件的目录 (如 'nice_results')，None 表示纯随机初始化。
+# 初始种群和灾难重置时，有 SEED_FRACTION 比例的个体取自库中旋律 (量化到当前网格，见 library.py)，
+# 同一条旋律的多余副本会随机重写一个小节。
+SEED_LIBRARY = None
+SEED_FRACTION = 0.1
+# 量化结果的缓存目录 (每个 MIDI 目录一个 .npz 文件)。None 表示 $XDG_CACHE_HOME/melody-ga，
+# 未设置 XDG_CACHE_HOME 时为 ~/.cache/melody-ga。缓存不写进 MIDI 目录本身。
+LIBRARY_CACHE_DIR = None
+
+# 【自适应变异算子】按每个算子产生的后代相对父母的提升 (多臂老虎机 / 概率匹配，见 bandit.py)
+# 动态调整 BATCH_STRATEGIES 的选择概率。ADAPT_RATE 为质量的滑动平均系数，MIN_PROB 为每个算子的保底概率。
+# 打开时才记录各算子的记功统计 (stats['operators'])；默认关闭 (不产生任何记功开销)，
+# 因为在当前的适应度函数上，相同评估次数下固定权重的最终分数并不比自适应差。
+ADAPTIVE_OPERATORS = False
+OPERATOR_ADAPT_RATE = 0.2
+OPERATOR_MIN_PROB = 0.02
+
+# 【后代预筛】可选，默认关闭 (1)。大于 1 时每对父母交叉 PRESCREEN_BROOD 次，先用便宜的近似分
+# (和声层 + 节奏层 + 近似的旋律层，fitness_function.surrogate_batch，约为完整打分的 1/3) 排序，
+# 每窝只留最好的两个进入种群、接受完整评估。代价是每代多产生 PRESCREEN_BROOD 倍的候选并全部做近似打分：
+# 繁殖阶段的耗时随之增长 (候选按块处理，见 main.PRESCREEN_CHUNK_CELLS，内存不随种群规模增长)。
+# 实测 (16 个种子的平均最佳分) 8 比不预筛在 10 万 / 40 万次评估时高约 +80 / +50，
+# 相同时间 (1.5s / 3s) 下高约 +70 / +45；再大收益不明显。
+PRESCREEN_BROOD = 1
+
+# 【精英局部搜索】每代对前 MEMETIC_TOP_K 名做爬山 (memetic.py)，0 表示关闭。
+# MEMETIC_BUDGET 为每代爬山可用的评估次数 (增量打分，每个邻居计一次)。
+# 推荐 10 / 2000：相同总评估次数下最终分数更高，但每代耗时增加约一半。
+MEMETIC_TOP_K = 0
+MEMETIC_BUDGET = 2000
+
+# 【时间预算】train(time_budget=秒) 先用三个逐步放大的种群标定吞吐，再按剩余时间确定种群规模与代数，
+# 使 代数 ≈ TIME_BUDGET_GEN_RATIO × 种群规模 (实测 0.5~5 秒预算下，大种群、一两百代最好)。
+# TIME_BUDGET_RESERVE 为截止前预留的比例，用来吸收最后一代耗时的波动。
+TIME_BUDGET_GEN_RATIO = 0.06
+TIME_BUDGET_RESERVE = 0.02
+
+# 【生成引擎】'ga' 遗传算法 (main.train) 或 'beam' 束搜索 (beam_search.py)。
+ENGINE = 'ga'
+# 【束宽】束搜索每一步保留的候选数。越大越接近全局最优，耗时近似线性增长。
+BEAM_WIDTH = 256
+
 
 # ==========================================
 # 4. 伴奏与和声设置 (Accompaniment & Harmony)
 # 决定了旋律的“情感背景”
 # ==========================================
-# 【和弦走向】定义了背景音乐的根音序列。
-# 48(C3), 43(G2), 45(A2), 41(F2) 对应经典的流行走向：C大调 I - V - vi - IV
-CHORD_ROOTS = [48, 43, 45, 41] 
+# 【调性】主音的音级 (0=C, 2=D, 7=G ...)。音阶与和弦都按相对主音的音级定义，
+# 改这一项就把适应度函数和 MIDI 伴奏一起换到新调上 (见 fitness_function.FitnessModel / rerank.py)。
+KEY = 0
+
+# 【和弦进行库】相对主音的音级，每个和弦第一个是根音 (MIDI 伴奏据此排列和弦)，每个和弦占一个小节。
+PROGRESSIONS = {
+    'I-V-vi-IV':  [(0, 4, 7), (7, 11, 2), (9, 0, 4), (5, 9, 0)],   # 经典流行走向
+    'vi-IV-I-V':  [(9, 0, 4), (5, 9, 0), (0, 4, 7), (7, 11, 2)],   # 小调色彩的流行走向
+    'I-vi-IV-V':  [(0, 4, 7), (9, 0, 4), (5, 9, 0), (7, 11, 2)],   # 50 年代进行
+    'I-IV-V-I':   [(0, 4, 7), (5, 9, 0), (7, 11, 2), (0, 4, 7)],   # 正格终止
+    'ii-V-I-vi':  [(2, 5, 9), (7, 11, 2), (0, 4, 7), (9, 0, 4)],   # 爵士 ii-V-I
+}
+
+# 【和弦音级】当前使用的和弦进行 (相对主音)，适应度函数据此判断和弦音 (见 fitness_function.FitnessModel)。
+# KEY = 0 时即 C 大调 I - V - vi - IV：C - G - Am - F
+CHORDS = PROGRESSIONS['I-V-vi-IV']
+
+# 【伴奏音区】和弦伴奏根音的最低音，根音放在它往上一个八度之内。
+# 41 (F2)：C 大调 I - V - vi - IV 的根音为 48(C3), 43(G2), 45(A2), 41(F2)
+CHORD_BASS_MIN = 41
 
 # 【和弦节奏】每个和弦持续的拍数。
 # 4 代表每个和弦占满 1 个小节（全音符长度）。
@@ -64,6 +161,65 @@ CHORD_DURATION = 4
 # ==========================================
 # 5. 乐理定义 (Music Theory) - [新增部分]
 # ==========================================
-# 【C大调音阶集合】用于变异算子(main.py)和适应度计算
-# Pitch Classes: 0=C, 2=D, 4=E, 5=F, 7=G, 9=A, 11=B
-SCALE_C_MAJOR = {0, 2, 4, 5, 7, 9, 11}
\ No newline at end of file
+# 【大调音阶】相对主音的音级，用于变异算子(main.py)和适应度计算。
+# KEY = 0 时 Pitch Classes: 0=C, 2=D, 4=E, 5=F, 7=G, 9=A, 11=B
+SCALE = {0, 2, 4, 5, 7, 9, 11}
+
+# 【已弃用的旧名字】SCALE_C_MAJOR (音阶的绝对音级) 与 CHORD_ROOTS (伴奏各和弦根音的 MIDI 音高)
+# 已由 KEY / SCALE / CHORDS / CHORD_BASS_MIN 取代。旧代码读取它们时仍能拿到由当前设置推出的值
+# (并给出 DeprecationWarning，见文件末尾的 __getattr__)，但给它们赋值不会生效。
+_deprecated_names = {
+    'SCALE_C_MAJOR': "KEY / SCALE",
+    'CHORD_ROOTS': "KEY / CHORDS / CHORD_BASS_MIN",
+}
+
+
+# ==========================================
+# 6. 旋律服务 (service.py)
+# ==========================================
+# 【监听地址】HTTP 服务的主机与端口 (也可用 --unix 改为 Unix socket)。
+SERVICE_HOST = '127.0.0.1'
+SERVICE_PORT = 8765
+# 【常驻种群数】后台持续进化的种群个数，每个种群一个进程，请求取所有种群中的最佳。
+SERVICE_POPULATIONS = 1
+# 【采样范围】/sample 默认从当前前 k 名里随机挑一条。
+SERVICE_SAMPLE_K = 10
+
+
+# ==========================================
+# 7. 独立配置副本 (Per-run Config)
+# ==========================================
+def make_config(base=None, **overrides):
+    """
+    返回当前配置的独立副本 (SimpleNamespace)，可覆盖任意大写参数，例如
+        cfg = make_config(POPULATION_SIZE=500, REST_PROB=0.2)
+        main.evolve(cfg=cfg)
+    同一进程里的多次运行 (如 sweep.py) 各用各的副本，不修改本模块的全局变量。
+    base: 以另一份配置 (本模块或 make_config 的结果) 为底本，默认是本模块。
+    覆盖了小节/拍/切片数而没有指定 TOTAL_STEPS 时，会重新计算基因长度。
+    """
+    from types import SimpleNamespace
+    source = globals() if base is None else {k: getattr(base, k) for k in dir(base)}
+    values = {k: v for k, v in source.items() if k.isupper()}
+    deprecated = set(overrides) & set(_deprecated_names)
+    if deprecated:
+        raise KeyError("已弃用的配置项: " + ", ".join(f"{k} (请改用 {_deprecated_names[k]})" for k in sorted(deprecated)))
+    unknown = set(overrides) - set(values)
+    if unknown:
+        raise KeyError(f"未知的配置项: {sorted(unknown)}")
+    values.update(overrides)
+    if 'TOTAL_STEPS' not in overrides:
+        values['TOTAL_STEPS'] = values['NUM_BARS'] * values['BEATS_PER_BAR'] * values['STEPS_PER_BEAT']
+    return SimpleNamespace(**values)
+
+
+def __getattr__(name):
+    """已弃用的旧名字：按当前的 KEY / SCALE / CHORDS / CHORD_BASS_MIN 推出 (默认与旧版本的值相同)"""
+    if name not in _deprecated_names:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    import warnings
+    warnings.warn(f"config.{name} 已弃用，请改用 {_deprecated_names[name]}", DeprecationWarning, stacklevel=2)
+    if name == 'SCALE_C_MAJOR':
+        return {(KEY + pc) % 12 for pc in SCALE}
+    # 与 utils.chord_voicings 相同：根音放在 CHORD_BASS_MIN 往上一个八度内
+    return [CHORD_BASS_MIN + (KEY + chord[0] - CHORD_BASS_MIN) % 12 for chord in CHORDS]
@@ -0,0 +1,97 @@
+# diversity.py
+# 种群多样性指数：用线性哈希给每个个体、每个小节打指纹，只对变化过的行重新计算。
+#   整条旋律的哈希 = 各小节贡献之和 (按位置加权，mod 2^64)
+#   去掉第 b 小节的哈希 = 整条哈希 - 第 b 小节的贡献  -> 只差一个小节的"近似重复"落在同一组
+#   小节型哈希 = 小节内按偏移加权 (与小节位置无关)     -> 统计不同的小节节奏/音型数
+import numpy as np
+import config
+
+
+class DiversityIndex:
+    """
+    用法：
+        index = DiversityIndex()
+        index.update(population)           # 每代种群变化后调用，只重算变化的行
+        index.duplicate_rows()             # 与前面某行完全相同的行
+        index.near_duplicate_rows(limit)   # 只差一个小节的组里超出前 limit 个的行
+        index.summary()
+    """
+
+    def __init__(self, n_steps=config.TOTAL_STEPS,
+                 bar_steps=config.BEATS_PER_BAR * config.STEPS_PER_BEAT, seed=0):
+        if n_steps % bar_steps:
+            raise ValueError(f"旋律长度 {n_steps} 不是小节长度 {bar_steps} 的整数倍")
+        self.n_bars = n_steps // bar_steps
+        self.bar_steps = bar_steps
+        rng = np.random.default_rng(seed)
+        # 随机奇数权重：不同旋律哈希碰撞的概率可以忽略
+        self._w_pos = rng.integers(0, 2**63, n_steps, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self._w_bar = rng.integers(0, 2**63, bar_steps, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self._rows = np.empty((0, n_steps), dtype=np.uint8)
+        self._parts = np.empty((0, self.n_bars), dtype=np.uint64)     # 各小节对整条哈希的贡献
+        self._patterns = np.empty((0, self.n_bars), dtype=np.uint64)  # 小节型哈希
+        self._full = np.empty(0, dtype=np.uint64)
+
+    def _hash(self, rows):
+        bars = rows.astype(np.uint64).reshape(len(rows), self.n_bars, self.bar_steps)
+        parts = (bars * self._w_pos.reshape(self.n_bars, self.bar_steps)).sum(axis=2)
+        patterns = (bars * self._w_bar).sum(axis=2)
+        return parts, patterns
+
+    def update(self, population):
+        """同步到新的种群：逐行比较，只给变化的行重新计算哈希。返回变化的行数"""
+        population = np.asarray(population, dtype=np.uint8)
+        n = len(population)
+        if len(self._rows) != n:
+            self._rows = np.zeros_like(population)
+            self._parts, self._patterns = self._hash(self._rows)
+            self._full = self._parts.sum(axis=1)
+            changed = np.arange(n)
+        else:
+            changed = np.flatnonzero((population != self._rows).any(axis=1))
+        if len(changed):
+            parts, patterns = self._hash(population[changed])
+            self._rows[changed] = population[changed]
+            self._parts[changed] = parts
+            self._patterns[changed] = patterns
+            self._full[changed] = parts.sum(axis=1)
+        return len(changed)
+
+    @staticmethod
+    def _rank_in_group(keys):
+        """每个元素在同值组里是第几个出现的 (按行号顺序，从 0 开始)"""
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        group_start = np.repeat(starts, np.diff(np.r_[starts, len(keys)]))
+        rank = np.empty(len(keys), dtype=np.int64)
+        rank[order] = np.arange(len(keys)) - group_start
+        return rank
+
+    def duplicate_rows(self):
+        """与前面某一行完全相同的行号 (每组保留第一个)"""
+        return np.flatnonzero(self._rank_in_group(self._full) > 0)
+
+    def near_duplicate_rows(self, limit):
+        """
+        只差一个小节 (含完全相同) 的个体组里，排在前 limit 个之后的行号。
+        种群按分数排好序时 (精英在前)，保留的就是每组里最好的 limit 个。
+        """
+        leave_one_out = self._full[:, None] - self._parts
+        # 把小节编号混进哈希，避免"去掉第 0 小节"与"去掉第 1 小节"的组互相混淆
+        leave_one_out += np.arange(self.n_bars, dtype=np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+        rank = self._rank_in_group(leave_one_out.ravel()).reshape(leave_one_out.shape)
+        return np.flatnonzero((rank >= limit).any(axis=1))
+
+    def summary(self):
+        """unique: 不同旋律数；duplicates: 完全重复的个体数；bar_patterns: 不同小节型数；
+        bar_diversity: 不同小节型占全部小节的比例"""
+        n = len(self._full)
+        unique = len(np.unique(self._full))
+        bar_patterns = len(np.unique(self._patterns))
+        return {
+            'unique': unique,
+            'duplicates': n - unique,
+            'bar_patterns': bar_patterns,
+            'bar_diversity': bar_patterns / max(self._patterns.size, 1),
+        }
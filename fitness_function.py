@@ -1,15 +1,14 @@
 # fitness_function.py
+import bisect
+from collections import OrderedDict
+from functools import lru_cache
+import time
+import numpy as np
 import config
 
 
 # 1. 静态常量 (CONSTANTS)
-SCALE_C_MAJOR = {0, 2, 4, 5, 7, 9, 11}
-CHORDS = [
-    {0, 4, 7},      # Bar 0: C
-    {7, 11, 2},     # Bar 1: G
-    {9, 0, 4},      # Bar 2: Am
-    {5, 9, 0}       # Bar 3: F
-]
+# 调性、音阶与和弦进行定义在 config.py (KEY / SCALE / CHORDS)，由 FitnessModel 编译成查找表。
 
 # 律动模版
 GROOVE_TEMPLATES = {
@@ -54,14 +53,86 @@ GROOVE_TEMPLATES = {
     (1, 1, 0, 1, 1, 0, 1, 0): 12,
 }
 
+# 1b. 适应度模型 (FitnessModel)
+class FitnessModel:
+    """
+    由配置一次性编译出的查找表，各层打分只做查表。不同的调性 / 和弦进行 / 拍号就是不同的实例：
+        model = FitnessModel(config.make_config(STEPS_PER_BEAT=4))
+        model = FitnessModel(key=7, chords=config.PROGRESSIONS['vi-IV-I-V'])
+        get_fitness(melody, model=model)
+    和弦进行循环出现，所以逐步的表只需覆盖一个周期 period = 每小节步数 × 和弦数，
+    任意长度的旋律都用 step % period 查表。
+    key 为主音音级 (默认 cfg.KEY)，scale / chords 都是相对主音的音级 (默认 cfg.SCALE / cfg.CHORDS)。
+    表里只用到 (音高 - 主音) % 12，所以旋律移调 s 个半音后在 key + s 上的分数与原来完全相同。
+    """
+    def __init__(self, cfg=config, key=None, chords=None):
+        self.steps_per_beat = cfg.STEPS_PER_BEAT
+        self.steps_per_bar = cfg.BEATS_PER_BAR * cfg.STEPS_PER_BEAT
+        self.phrase_bars = cfg.PHRASE_BARS
+        self.weights = tuple(cfg.FITNESS_WEIGHTS)
+        self.key = (cfg.KEY if key is None else key) % 12
+        self.scale = frozenset((self.key + pc) % 12 for pc in cfg.SCALE)
+        self.chords = tuple(frozenset((self.key + pc) % 12 for pc in chord)
+                            for chord in (cfg.CHORDS if chords is None else chords))
+        self.period = self.steps_per_bar * len(self.chords)
+
+        pcs = np.arange(128) % 12
+        degree = (pcs - self.key) % 12  # 相对主音的音级
+        step = np.arange(self.period)
+        # 音级表: chord_table[chord_idx, pc] 是否和弦音, scale_table[pc] 是否调内音
+        self.chord_table = np.array([[pc in chord for pc in range(12)] for chord in self.chords])
+        self.scale_table = np.array([pc in self.scale for pc in range(12)])
+        # 逐步表 (period, 128): 该步的和弦是否包含该音高 / 该步是否强拍
+        self.step_chord = step // self.steps_per_bar
+        self.member = self.chord_table[self.step_chord][:, pcs]
+        self.strong = step % self.steps_per_beat == 0
+        # 和声分: 和弦音强拍 10 / 弱拍 5，调内非和弦音 -2，调外音 -30
+        out_of_chord = np.where(self.scale_table, -2, -30)[pcs]
+        self.harmony = np.where(self.member, np.where(self.strong[:, None], 10, 5),
+                                out_of_chord).astype(np.int8)
+        # 音程分 (按 |音程| 查表) 与惯性/大跳补偿分 (按 (d1, d2) 查表，下标偏移 127)
+        iv = np.arange(128)
+        self.interval = np.where(iv <= 2, 5, np.where(iv <= 4, 2, np.where(iv > 7, -10, 0))).astype(np.int8)
+        d1 = np.arange(-127, 128)[:, None]
+        d2 = np.arange(-127, 128)[None, :]
+        leap = np.where((d1 * d2 < 0) | (d2 == 0), 10, -5)
+        inertia = np.where((np.abs(d1) <= 4) & (np.abs(d2) <= 4) & (d1 * d2 > 0), 5, 0)
+        self.inertia = np.where(np.abs(d1) > 5, leap, inertia).astype(np.int8)
+        # 结构分: 结束音回主音 20 / 属音半终止 5，第 2 小节结束音制造悬念 (都按相对主音的音级)
+        self.cadence = np.select([degree == 0, (degree == 7) | (degree == 11)], [20, 5], 0).astype(np.int8)
+        self.half_cadence = np.isin(degree, [2, 7, 11])
+        self.groove = groove_table(self.steps_per_bar)
+
+        # 标量版本用 Python 列表查表 (下标访问比 numpy 更快)
+        self.member_rows = self.member.tolist()
+        self.harmony_rows = self.harmony.tolist()
+        self.interval_list = self.interval.tolist()
+        self.inertia_rows = self.inertia.tolist()
+        self.cadence_list = self.cadence.tolist()
+        self.half_cadence_list = self.half_cadence.tolist()
+        self.groove_list = self.groove.tolist()
+        self._steps = {}
+
+    def step_index(self, n_steps):
+        """长度为 n_steps 的旋律：每步在逐步表中的行号 (step % period)"""
+        cached = self._steps.get(n_steps)
+        if cached is None:
+            cached = self._steps[n_steps] = np.arange(n_steps) % self.period
+        return cached
+
+    def groove_for(self, length):
+        """长度为 length 的小节用的律动表 (列表形式)，最后一个不完整小节用自己的表"""
+        return self.groove_list if length == self.steps_per_bar else _groove_list(length)
+
+
 # 2. 核心预处理
-def analyze_melody(melody):
+def analyze_melody(melody, model=None):
     """
     将原始旋律数组解构为两个独立的视图：
     1. events: 纯音符序列 [(index, pitch), ...] -> 用于评估旋律连贯性
     2. bars:   小节切片 -> 用于评估节奏律动
     """
-    steps_per_bar = config.BEATS_PER_BAR * config.STEPS_PER_BEAT
+    steps_per_bar = (model or DEFAULT_MODEL).steps_per_bar
     
     # 视图1：音符事件链 (Melody Chain)
     # 过滤掉所有的 0，只保留 (时间点, 音高)
@@ -75,220 +146,605 @@ def analyze_melody(melody):
 
 
 # 3. 旋律层 (只看 events)
-def fit_melodic_flow(events):
+def fit_melodic_flow(events, model=None):
     """
     评估旋律的横向连贯性 (Interval, Gap Fill, Inertia, Resolution)
     完全忽略延音的影响。
     """
     if len(events) < 2: return 0
+    model = model or DEFAULT_MODEL
+    interval, inertia = model.interval_list, model.inertia_rows
+    member, period = model.member_rows, model.period
     score = 0
     
-    # 提取纯音高列表用于计算
-    pitches = [e[1] for e in events]
-    
-    # 使用 zip 遍历：(当前音, 下个音)
-    # 这里的 next_pitch 绝对是下一个发声的音，哪怕隔了3拍
-    for i in range(len(pitches) - 1):
-        curr_p = pitches[i]
-        next_p = pitches[i+1]
-        
-        # 1. 音程 (Interval)
-        interval = abs(next_p - curr_p)
-        if interval <= 2: score += 5       # 级进
-        elif interval <= 4: score += 2     # 小跳
-        elif interval > 7: score -= 10      # 大跳
-        elif interval > 12: score -= 20    # 只有人声不能唱的跨度才重罚
-        
-        # 2. 惯性与大跳补偿 (Gap Fill & Inertia)
-        # 需要看三个音
-        if i < len(pitches) - 2:
-            next_next_p = pitches[i+2]
-            d1 = next_p - curr_p
-            d2 = next_next_p - next_p
-            
-            # 大跳(>5)后必须反向
-            if abs(d1) > 5:
-                if d1 * d2 < 0 or d2 == 0: score += 10
-                else: score -= 5
-            # 小跳同向奖励
-            elif abs(d1) <= 4 and abs(d2) <= 4 and d1 * d2 > 0:
-                score += 5
-
-    # 3. 张力解决 (Tension & Resolution)
-    # events 列表里，next_p 就是下一个真实的音
-    steps_per_bar = config.BEATS_PER_BAR * config.STEPS_PER_BEAT
-    
-    for i in range(len(events) - 1):
+    # 遍历相邻的两个 event：(当前音, 下个音)
+    # 这里的 next_p 绝对是下一个发声的音，哪怕隔了3拍
+    last = len(events) - 1
+    for i in range(last):
         curr_idx, curr_p = events[i]
-        next_idx, next_p = events[i+1] # 拿到下一个真实音及其位置
+        next_idx, next_p = events[i+1]
         
-        # 计算当前时刻的和弦
-        curr_chord_idx = (curr_idx // steps_per_bar) % 4
-        curr_chord = CHORDS[curr_chord_idx]
+        # 1. 音程 (Interval)：级进 +5，小跳 +2，大跳 -10
+        score += interval[abs(next_p - curr_p)]
         
-        # 如果当前是离调音 (非和弦音)
-        if (curr_p % 12) not in curr_chord:
-            # 检查是否解决到了下一个音
-            next_chord_idx = (next_idx // steps_per_bar) % 4 # 注意：和弦要查下一个音发生时的和弦
-            next_chord = CHORDS[next_chord_idx]
-            
-            # 解决条件：级进移动(<=2) 且 进入和弦内
-            if abs(next_p - curr_p) <= 2 and (next_p % 12) in next_chord:
+        # 2. 惯性与大跳补偿 (Gap Fill & Inertia)：需要看三个音
+        # 大跳(>5)后必须反向；小跳同向奖励
+        if i < last - 1:
+            score += inertia[next_p - curr_p + 127][events[i+2][1] - next_p + 127]
+        
+        # 3. 张力解决 (Tension & Resolution)
+        # 当前是离调音 (非和弦音)，且级进(<=2)解决到下一个音发生时的和弦内
+        if not member[curr_idx % period][curr_p]:
+            if abs(next_p - curr_p) <= 2 and member[next_idx % period][next_p]:
                 score += 30 # 巨大的奖励，鼓励这种人性化的写法
 
     return score
 
 
 # 4. 节奏与和声层 (看 events + Grid)
-def fit_harmonic_quality(events, steps_per_beat=2):
+def fit_harmonic_quality(events, model=None):
     """
     评估纵向和声。
     只评估 Onset (起奏点)，延音不扣分也不加分。
+    和弦音强拍 +10 / 弱拍 +5；调内非和弦音只扣一点 (离调解决由 fit_melodic_flow 加回来)；调外音重罚。
     """
+    model = model or DEFAULT_MODEL
+    harmony, period = model.harmony_rows, model.period
     score = 0
-    steps_per_bar = config.BEATS_PER_BAR * steps_per_beat
-    
     for idx, pitch in events:
-        # 确定当时和弦
-        bar_idx = (idx // steps_per_bar) % 4
-        chord = CHORDS[bar_idx]
-        pc = pitch % 12
-        
-        # 强拍定义
-        is_strong_beat = (idx % steps_per_beat == 0)
-        
-        if pc in chord:
-            score += 10 if is_strong_beat else 5
-        elif pc in SCALE_C_MAJOR:
-            # 宽容处理：只要在调内，虽然不是和弦音，稍微扣一点点即可
-            # 因为如果是离调解决，fit_melodic_flow 会把分加回来的
-            score -= 2 
-        else:
-            score -= 30 # 调外音还是得罚
-            
+        score += harmony[idx % period][pitch]
     return score
 
-def fit_rhythm_groove(bars):
+# 律动查找表：一个小节的起奏型压成整数掩码 (第 i 步为第 i 位)，
+# 8 步小节只有 256 种、16 步小节也只有 65536 种，直接预先算好全部分数。
+def onset_mask(bar_segment):
+    """提取小节的起奏型: 有音且 (小节首位 或 音高变化) 即为起奏点"""
+    mask = 0
+    prev = 0
+    for i, n in enumerate(bar_segment):
+        if n > 0 and (i == 0 or n != prev):
+            mask |= 1 << i
+        prev = n
+    return mask
+
+
+@lru_cache(maxsize=None)
+def groove_table(steps_per_bar):
+    """
+    生成长度为 2**steps_per_bar 的律动分表，覆盖三种情况：
+    A. 完美匹配模版  B. 循环移位后匹配 (0.6 倍)  C. 兜底惩罚 (太乱/太空)
+    """
+    size = 1 << steps_per_bar
+    full = size - 1
+    masks = np.arange(size, dtype=np.int64)
+
+    template_score = np.full(size, np.nan)
+    for pattern, value in GROOVE_TEMPLATES.items():
+        if len(pattern) == steps_per_bar:
+            template_score[sum(bit << i for i, bit in enumerate(pattern))] = value
+
+    # C. 兜底惩罚
+    onsets = sum((masks >> i) & 1 for i in range(steps_per_bar))
+    table = np.where(onsets > 5, -5.0, 0.0) + np.where(onsets <= 1, -5.0, 0.0)
+
+    # B. 变体匹配：逐次右移一位，取第一个命中的模版。
+    # 倒序覆盖，移位次数最少的命中最后写入，与逐次尝试的结果相同
+    for k in range(steps_per_bar - 1, 0, -1):
+        rotated = ((masks << k) | (masks >> (steps_per_bar - k))) & full
+        shifted = template_score[rotated]
+        hit = ~np.isnan(shifted)
+        table[hit] = shifted[hit] * 0.6
+
+    # A. 完美匹配
+    exact = ~np.isnan(template_score)
+    table[exact] = template_score[exact]
+
+    table.flags.writeable = False
+    return table
+
+
+@lru_cache(maxsize=None)
+def _groove_list(steps_per_bar):
+    """标量版使用的 Python 列表形式 (下标访问比 numpy 更快)"""
+    return groove_table(steps_per_bar).tolist()
+
+
+# 导入时就由 config 编译好默认模型 (含当前拍号的律动表)
+DEFAULT_MODEL = FitnessModel()
+
+
+def fit_rhythm_groove(bars, model=None):
     """
     增强版节奏评分：支持模版匹配、循环移位变体检测。
+    每个小节只需一次查表 (见 groove_table)。
     """
+    model = model or DEFAULT_MODEL
     score = 0
-    # 将模版转换为集合，方便快速查找
-    # 我们只存 key (pattern)，value (score) 在查的时候再取
-    template_keys = set(GROOVE_TEMPLATES.keys())
-    
     for bar_segment in bars:
-        # 1. 提取当前小节的节奏型
-        rhythm = []
-        for i, n in enumerate(bar_segment):
-            is_onset = False
-            if n > 0:
-                if i == 0: is_onset = True
-                elif n != bar_segment[i-1]: is_onset = True
-            rhythm.append(1 if is_onset else 0)
-        
-        rhythm_tuple = tuple(rhythm)
-        
-        # --- 评分逻辑 ---
-        
-        # A. 完美匹配 (Perfect Match)
-        if rhythm_tuple in GROOVE_TEMPLATES:
-            score += GROOVE_TEMPLATES[rhythm_tuple]
-            
-        else:
-            # B. 变体匹配 (Shifted Match)
-            # 检查是否是某个名模版的“移位版本”
-            # 例如：Tresillo 晚了一拍开始，依然很有律动感
-            found_shift = False
-            shifted = list(rhythm_tuple)
-            
-            # 尝试左移/右移 1-2 位
-            for _ in range(len(shifted)):
-                # 循环移位: [1, 0, 1] -> [0, 1, 1]
-                shifted = shifted[-1:] + shifted[:-1] 
-                shifted_tuple = tuple(shifted)
-                
-                if shifted_tuple in GROOVE_TEMPLATES:
-                    # 这是一个“移位”的经典节奏
-                    # 给分，但比原版稍微低一点
-                    base_score = GROOVE_TEMPLATES[shifted_tuple]
-                    score += base_score * 0.6 
-                    found_shift = True
-                    break
-            
-            if not found_shift:
-                # C. 兜底惩罚
-                # 如果既不是模版，也不是模版的变体，可能是杂乱的随机节奏
-                # 只有当节奏点太碎时才惩罚
-                onsets = sum(rhythm)
-                if onsets > 5: score -= 5 # 太乱
-                if onsets <= 1: score -= 5 # 太空
-
+        score += model.groove_for(len(bar_segment))[onset_mask(bar_segment)]
     return score
 
 
 # 5. 结构层 (Macro)
-def fit_structure_coherence(events, bars):
+def _motif_score(m0, m2, len0, len2):
+    """动机重复：Bar 0 与 Bar 2 的起奏掩码完全相同 +15，四分之三以上的位置相同 +10"""
+    if len0 == len2 and m0 == m2: return 15
+    # 与 zip 一样只比较两小节的公共长度
+    common = min(len0, len2)
+    diff = (m0 ^ m2) & ((1 << common) - 1)
+    return 10 if common - bin(diff).count('1') >= len0 * 0.75 else 0
+
+
+def fit_structure_coherence(events, bars, model=None):
     """结构完整性"""
     if not events: return -100
-    score = 0
+    model = model or DEFAULT_MODEL
+    steps_per_bar = model.steps_per_bar
     
-    # 1. 终止式 (只看最后一个 Event)
-    last_idx, last_pitch = events[-1]
-    if last_pitch % 12 == 0: score += 20     # 回主音
-    elif last_pitch % 12 in {7, 11}: score += 5 # 属音半终止
+    # 1. 终止式 (只看最后一个 Event)：回主音 / 属音半终止
+    score = model.cadence_list[events[-1][1]]
     
-    # 2. 问答结构 (Bar 2 结束音)
-    # 找到第2小节内的最后一个 Event
-    steps_per_bar = config.BEATS_PER_BAR * config.STEPS_PER_BEAT
-    mid_events = [e for e in events if steps_per_bar <= e[0] < 2*steps_per_bar]
-    if mid_events:
-        mid_pitch = mid_events[-1][1]
-        if mid_pitch % 12 in {2, 7, 11}: score += 15 # 悬念
-        
-    # 3. 动机重复 (Rhythm Motif)
-    # 对比 Bar 0 和 Bar 2 的 Onset 模式
-    if len(bars) >= 3:
-        def get_onset_pattern(segment):
-            res = []
-            for i, n in enumerate(segment):
-                is_onset = (n > 0) and (i==0 or n != segment[i-1])
-                res.append(1 if is_onset else 0)
-            return res
-            
-        r0 = get_onset_pattern(bars[0])
-        r2 = get_onset_pattern(bars[2])
-        if r0 == r2: score += 15
-        elif sum(1 for a,b in zip(r0,r2) if a==b) >= len(r0)*0.75: score += 10
+    # 逐个乐句 (PHRASE_BARS 小节) 评价问答与动机
+    indices = [idx for idx, _ in events]
+    for first in range(0, len(bars), model.phrase_bars):
+        start = first * steps_per_bar
+        # 2. 问答结构 (乐句第 2 小节的结束音)
+        # 找到乐句第2小节内的最后一个 Event
+        k = bisect.bisect_left(indices, start + 2 * steps_per_bar) - 1
+        if k >= 0 and indices[k] >= start + steps_per_bar and model.half_cadence_list[events[k][1]]:
+            score += 15 # 悬念
+
+        # 3. 动机重复 (Rhythm Motif)
+        # 对比乐句第 1 和第 3 小节的 Onset 模式
+        if first + 2 < len(bars):
+            b0, b2 = bars[first], bars[first + 2]
+            score += _motif_score(onset_mask(b0), onset_mask(b2), len(b0), len(b2))
         
     return score
 
 
 # 6. 总控
-def get_fitness(melody):
+def get_fitness(melody, weights=None, model=None):
     if sum(melody) == 0: return -9999
+    model = model or DEFAULT_MODEL
     
     # 1. 预处理 (一次性完成)
-    events, bars, _ = analyze_melody(melody)
+    events, bars, _ = analyze_melody(melody, model)
     if not events: return -999
     
     # 2. 计算各层分数
     # 现在的 events 已经跳过了所有的延音(0)
     # 所以 Melodic Flow 不会因为节奏稀疏而受到影响
-    s_melody    = fit_melodic_flow(events)
-    s_harmony   = fit_harmonic_quality(events)
-    s_rhythm    = fit_rhythm_groove(bars)
-    s_structure = fit_structure_coherence(events, bars)
+    s_melody    = fit_melodic_flow(events, model)
+    s_harmony   = fit_harmonic_quality(events, model)
+    s_rhythm    = fit_rhythm_groove(bars, model)
+    s_structure = fit_structure_coherence(events, bars, model)
     
     # 3. 归一化/平衡
     # 如果音符很少，sum求和的分数会天然偏低。
     # 我们不仅要看总分，还要看“平均质量”。
     # 但为了简单起见，我们给 s_melody 一个基于音符数量的补偿，或者调整权重。
     
-    # 这里采用“加权求和”，权重根据经验微调
-    total = (3.0 * s_melody) + \
-            (3.0 * s_harmony) + \
-            (8.0 * s_rhythm) + \
-            (3.0 * s_structure)
+    # 这里采用“加权求和”，权重根据经验微调 (见 config.FITNESS_WEIGHTS)
+    w_melody, w_harmony, w_rhythm, w_structure = model.weights if weights is None else weights
+    total = (w_melody * s_melody) + \
+            (w_harmony * s_harmony) + \
+            (w_rhythm * s_rhythm) + \
+            (w_structure * s_structure)
             
-    return total
\ No newline at end of file
+    return total
+
+
+# 7. 批量引擎 (Batch / NumPy)
+# 把整个种群当作一个 (POP, TOTAL_STEPS) 的矩阵一次性打分，
+# 每一层的逻辑与上面的标量版本一一对应，结果逐位一致。
+
+def _batch_melodic_flow(pop, is_note, model):
+    """fit_melodic_flow 的向量化版本"""
+    n_pop, n_steps = pop.shape
+    n_events = is_note.sum(axis=1)
+
+    # 把每一行的音符"挤"到最前面：第 k 列就是第 k 个 event
+    flat = np.flatnonzero(is_note)
+    dest = flat - flat % n_steps + np.cumsum(is_note, axis=1).ravel()[flat] - 1
+    ev_p = np.zeros_like(pop)
+    ev_i = np.zeros_like(pop)
+    ev_p.ravel()[dest] = pop.ravel()[flat]
+    ev_i.ravel()[dest] = flat % n_steps
+    pos = np.arange(n_steps)
+
+    pair_ok = pos[:-1] < (n_events - 1)[:, None]
+    d = ev_p[:, 1:] - ev_p[:, :-1]
+    interval = np.abs(d)
+
+    # 1. 音程 (按 |音程| 查 model.interval 表)
+    score = np.where(pair_ok, model.interval[interval], 0).sum(axis=1)
+
+    # 2. 惯性与大跳补偿 (按相邻两个音程 (d1, d2) 查 model.inertia 表，下标偏移 127)
+    if n_steps > 2:
+        triple_ok = pos[:-2] < (n_events - 2)[:, None]
+        d = d.astype(np.int32) + 127
+        inertia = model.inertia.ravel()[d[:, :-1] * model.inertia.shape[1] + d[:, 1:]]
+        score += np.where(triple_ok, inertia, 0).sum(axis=1)
+
+    # 3. 张力解决
+    in_chord = model.member.ravel()[(ev_i.astype(np.int32) % model.period) * 128 + ev_p]
+    resolved = pair_ok & ~in_chord[:, :-1] & (interval <= 2) & in_chord[:, 1:]
+    score += 30 * resolved.sum(axis=1)
+    return score
+
+
+def _batch_harmonic_quality(pop, is_note, model):
+    """fit_harmonic_quality 的向量化版本"""
+    n_steps = pop.shape[1]
+    pos = np.arange(n_steps)
+
+    # 逐步 × 音高的得分表: (TOTAL_STEPS, 128)
+    rows = model.step_index(n_steps)
+    table = model.harmony[rows].ravel()
+
+    step_scores = table[pos * 128 + pop]
+    return np.where(is_note, step_scores, 0).sum(axis=1, dtype=np.int64)
+
+
+def _batch_onsets(pop, is_note, steps_per_bar):
+    """逐步的起奏点矩阵: 小节首位有音即起奏，否则音高变化才算起奏"""
+    onset = is_note.copy()
+    same = pop[:, 1:] == pop[:, :-1]
+    bar_start = (np.arange(1, pop.shape[1]) % steps_per_bar) == 0
+    onset[:, 1:] &= ~same | bar_start
+    return onset
+
+
+def _bar_masks(onset, steps_per_bar):
+    """把起奏点矩阵按小节压成整数掩码: 第 i 步对应第 i 位, 返回 (POP, n_bars)"""
+    n_pop, n_steps = onset.shape
+    n_bars = n_steps // steps_per_bar
+    packed = np.packbits(onset.reshape(n_pop * n_bars, steps_per_bar), axis=1, bitorder='little')
+    masks = packed[:, 0].astype(np.int64)
+    for k in range(1, packed.shape[1]):
+        masks |= packed[:, k].astype(np.int64) << (8 * k)
+    return masks.reshape(n_pop, n_bars)
+
+
+def _batch_rhythm_groove(onset, model):
+    """fit_rhythm_groove 的向量化版本"""
+    n_pop, n_steps = onset.shape
+    n_bars = n_steps // model.steps_per_bar
+    masks = _bar_masks(onset, model.steps_per_bar)
+    bar_scores = model.groove[masks]
+
+    # 按小节顺序逐个累加，保证浮点求和顺序与标量版本相同
+    score = np.zeros(n_pop)
+    for b in range(n_bars):
+        score = score + bar_scores[:, b]
+    return score
+
+
+def _batch_structure_coherence(pop, is_note, onset, model):
+    """fit_structure_coherence 的向量化版本"""
+    n_pop, n_steps = pop.shape
+    steps_per_bar = model.steps_per_bar
+    rows = np.arange(n_pop)
+
+    # 1. 终止式
+    last_idx = n_steps - 1 - np.argmax(is_note[:, ::-1], axis=1)
+    score = model.cadence[pop[rows, last_idx]].astype(np.int64)
+
+    # 各乐句的第 1 小节号 (批量版本要求旋律长度是整小节)
+    n_bars = n_steps // steps_per_bar
+    firsts = np.arange(0, n_bars, model.phrase_bars)
+
+    # 2. 问答结构：每个乐句第 2 小节的最后一个音
+    seconds = firsts[firsts + 1 < n_bars] + 1
+    if len(seconds):
+        mid = is_note.reshape(n_pop, n_bars, steps_per_bar)[:, seconds, ::-1]
+        mid_idx = seconds * steps_per_bar + steps_per_bar - 1 - np.argmax(mid, axis=2)
+        hit = mid.any(axis=2) & model.half_cadence[np.take_along_axis(pop, mid_idx, axis=1)]
+        score += hit.sum(axis=1) * 15
+
+    # 3. 动机重复：每个乐句第 1 与第 3 小节
+    firsts = firsts[firsts + 2 < n_bars]
+    if len(firsts):
+        bars = onset.reshape(n_pop, n_bars, steps_per_bar)
+        matches = (bars[:, firsts] == bars[:, firsts + 2]).sum(axis=2)
+        score += np.where(matches == steps_per_bar, 15,
+                          np.where(matches >= steps_per_bar * 0.75, 10, 0)).sum(axis=1)
+    return score
+
+
+def _timed(timings, name, fn, *args):
+    """timings 不为 None 时把 fn 的耗时累加到 timings[name]"""
+    if timings is None: return fn(*args)
+    t0 = time.perf_counter()
+    result = fn(*args)
+    timings[name] = timings.get(name, 0.0) + time.perf_counter() - t0
+    return result
+
+
+def get_fitness_batch(population, timings=None, weights=None, model=None):
+    """
+    批量版 get_fitness：输入 (POP, TOTAL_STEPS) 的整数数组，返回 (POP,) 的 float64 分数。
+    结果与逐个调用 get_fitness 完全相同。
+    传入 timings 字典时，各层耗时 (秒) 会累加进去。
+    weights 为 (旋律, 和声, 节奏, 结构) 四层的权重，默认取 model.weights (即 config.FITNESS_WEIGHTS)。
+    """
+    pop = np.asarray(population)
+    if pop.ndim != 2:
+        raise ValueError(f"population 必须是二维数组, 实际为 {pop.ndim} 维")
+    model = model or DEFAULT_MODEL
+    steps_per_bar = model.steps_per_bar
+    if pop.shape[1] % steps_per_bar:
+        raise ValueError(f"旋律长度 {pop.shape[1]} 不是小节长度 {steps_per_bar} 的整数倍")
+
+    # 转成有符号类型，音程相减不会溢出
+    pop = pop.astype(np.int16)
+    is_note = pop > 0
+    onset = _timed(timings, 'onset', _batch_onsets, pop, is_note, steps_per_bar)
+
+    s_melody    = _timed(timings, 'melody', _batch_melodic_flow, pop, is_note, model)
+    s_harmony   = _timed(timings, 'harmony', _batch_harmonic_quality, pop, is_note, model)
+    s_rhythm    = _timed(timings, 'rhythm', _batch_rhythm_groove, onset, model)
+    s_structure = _timed(timings, 'structure', _batch_structure_coherence,
+                         pop, is_note, onset, model)
+
+    w_melody, w_harmony, w_rhythm, w_structure = model.weights if weights is None else weights
+    total = (w_melody * s_melody) + \
+            (w_harmony * s_harmony) + \
+            (w_rhythm * s_rhythm) + \
+            (w_structure * s_structure)
+
+    # 与标量版相同的特殊情况
+    total = np.where(is_note.any(axis=1), total, -999.0)
+    total = np.where(pop.sum(axis=1, dtype=np.int64) == 0, -9999.0, total)
+    return total
+
+
+def _approx_melodic_flow(pop, is_note, model):
+    """
+    旋律层的近似 (预筛用)：只看相邻两步都有音的位置 (休止处断开，不把音符压缩成 event 序列)，
+    算音程分 (查 model.interval 表) 与张力解决分，跳过惯性项。延音在两种算法里都是音程为 0 的相邻音，所以结果通常很接近。
+    """
+    n_steps = pop.shape[1]
+    pair = is_note[:, 1:] & is_note[:, :-1]
+    interval = np.abs(pop[:, 1:] - pop[:, :-1])
+    score = np.where(pair, model.interval[interval], 0).sum(axis=1)
+    rows = model.step_index(n_steps)
+    in_chord = model.member.ravel()[rows * 128 + pop]
+    resolved = pair & ~in_chord[:, :-1] & (interval <= 2) & in_chord[:, 1:]
+    return score + 30 * resolved.sum(axis=1)
+
+
+def surrogate_batch(population, model=None):
+    """
+    便宜的近似分 (后代预筛用，见 main.breed)：和声层与节奏层照常计算 (逐步查表 + 起奏掩码查律动表)，
+    旋律层用 _approx_melodic_flow 近似，跳过结构层，返回 (POP,) 的加权和。
+    只有和声与节奏时，张力解决 (经过音 -> 和弦音) 得不到奖励，排序与真实分数相反。
+    """
+    pop = np.asarray(population).astype(np.int16)
+    model = model or DEFAULT_MODEL
+    is_note = pop > 0
+    onset = _batch_onsets(pop, is_note, model.steps_per_bar)
+    w_melody, w_harmony, w_rhythm, _ = model.weights
+    return w_melody * _approx_melodic_flow(pop, is_note, model) \
+           + w_harmony * _batch_harmonic_quality(pop, is_note, model) \
+           + w_rhythm * _batch_rhythm_groove(onset, model)
+
+
+# 8. 适应度缓存 (Memoization)
+class FitnessCache:
+    """
+    以旋律内容为键的适应度缓存，超出容量时按 LRU 淘汰。
+    精英、未触发变异的孩子、收敛后的重复个体都会直接命中，不再重复打分。
+    键是旋律的字节串 (MIDI 音高 0~127 可以放进一个字节)。
+    model 为打分使用的 FitnessModel (默认 DEFAULT_MODEL)；不同模型的分数不能共用一个缓存。
+    """
+    def __init__(self, max_size=None, model=None):
+        self.max_size = config.FITNESS_CACHE_SIZE if max_size is None else max_size
+        self.model = model or DEFAULT_MODEL
+        self._store = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._store)
+
+    def _put(self, key, score):
+        self._store[key] = score
+        if len(self._store) > self.max_size:
+            self._store.popitem(last=False)
+            self.evictions += 1
+
+    def __call__(self, melody):
+        """单个旋律的缓存版 get_fitness"""
+        if self.max_size <= 0:
+            return get_fitness(melody, model=self.model)
+        key = bytes(melody)
+        if key in self._store:
+            self._store.move_to_end(key)
+            self.hits += 1
+            return self._store[key]
+        self.misses += 1
+        score = get_fitness(melody, model=self.model)
+        self._put(key, score)
+        return score
+
+    def add(self, melody, score):
+        """写入一条已知分数的旋律 (如增量评估算出的结果)，不计入命中/未命中"""
+        if self.max_size > 0:
+            self._put(bytes(melody), score)
+
+    def score_batch(self, population, batch_fn=None):
+        """
+        整个种群的缓存版评估：只把没见过的旋律 (同一批内去重) 交给 batch_fn
+        (默认用本缓存的模型调用 get_fitness_batch)。
+        返回 (POP,) 的分数数组，与直接调用 batch_fn 的结果相同。
+        """
+        if batch_fn is None:
+            batch_fn = lambda p: get_fitness_batch(p, model=self.model)
+        pop = np.ascontiguousarray(population, dtype=np.uint8)
+        if self.max_size <= 0:
+            return batch_fn(pop)
+
+        keys = pop.view(np.dtype((np.void, pop.shape[1]))).ravel().tolist()
+        scores = np.empty(len(keys))
+        pending = {}  # key -> 该旋律在本批中出现的所有位置
+        store = self._store
+        for i, key in enumerate(keys):
+            score = store.get(key)
+            if score is None:
+                pending.setdefault(key, []).append(i)
+            else:
+                store.move_to_end(key)
+                scores[i] = score
+
+        self.misses += len(pending)
+        self.hits += len(keys) - len(pending)
+        if pending:
+            first_rows = [rows[0] for rows in pending.values()]
+            new_scores = batch_fn(pop[first_rows]).tolist()
+            for (key, rows), score in zip(pending.items(), new_scores):
+                scores[rows] = score
+                self._put(key, score)
+        return scores
+
+    def summary(self):
+        """日志用的计数器字符串"""
+        return f"Cache: hit {self.hits} / miss {self.misses} / evict {self.evictions}"
+
+# 9. 增量评估 (Delta)
+# 把总分拆成可局部更新的子分数：
+#   flow[i]      以第 i 步为起点的 event 贡献的旋律分 (音程/惯性/解决，最多看后面两个 event)
+#   harmony[b]   第 b 小节内所有 onset 的和声分
+#   groove[b]    第 b 小节的律动分 (masks[b] 为该小节的起奏型)
+# 局部变异后只需重算被改动的小节、改动区间前两个 event 以及结构项，结果与完整重算完全相同。
+
+def _next_note(melody, i):
+    """第 i 步之后的第一个音符位置，没有则返回 -1"""
+    for j in range(i + 1, len(melody)):
+        if melody[j] > 0: return j
+    return -1
+
+
+def _flow_at(melody, i, model):
+    """第 i 步 (必须有音) 作为 event k 时，fit_melodic_flow 中与 (k, k+1, k+2) 相关的分数"""
+    j = _next_note(melody, i)
+    if j < 0: return 0
+    curr_p, next_p = melody[i], melody[j]
+
+    # 1. 音程
+    score = model.interval_list[abs(next_p - curr_p)]
+
+    # 2. 惯性与大跳补偿
+    k = _next_note(melody, j)
+    if k >= 0:
+        score += model.inertia_rows[next_p - curr_p + 127][melody[k] - next_p + 127]
+
+    # 3. 张力解决
+    member = model.member_rows
+    if not member[i % model.period][curr_p]:
+        if abs(next_p - curr_p) <= 2 and member[j % model.period][next_p]:
+            score += 30
+    return score
+
+
+def _structure_from_masks(melody, masks, model):
+    """结构层：终止式 + 问答结构 + 动机重复 (起奏型直接用小节掩码比较)"""
+    steps_per_bar = model.steps_per_bar
+    last = len(melody) - 1
+    while last >= 0 and melody[last] <= 0: last -= 1
+    if last < 0: return -100
+    score = model.cadence_list[melody[last]]
+
+    for first in range(0, len(masks), model.phrase_bars):
+        start = first * steps_per_bar
+        mid = min(start + 2 * steps_per_bar, len(melody)) - 1
+        while mid >= start + steps_per_bar and melody[mid] <= 0: mid -= 1
+        if mid >= start + steps_per_bar and model.half_cadence_list[melody[mid]]: score += 15
+
+        if first + 2 < len(masks):
+            len0 = min(steps_per_bar, len(melody) - start)
+            len2 = min(steps_per_bar, len(melody) - start - 2 * steps_per_bar)
+            score += _motif_score(masks[first], masks[first + 2], len0, len2)
+    return score
+
+
+def _bar_components(melody, b, model):
+    """第 b 小节的 (和声分, 起奏掩码, 律动分)"""
+    start = b * model.steps_per_bar
+    segment = melody[start:start + model.steps_per_bar]
+    harmony, period = model.harmony_rows, model.period
+    score = 0
+    for i, n in enumerate(segment, start):
+        if n > 0: score += harmony[i % period][n]
+    mask = onset_mask(segment)
+    return score, mask, model.groove_for(len(segment))[mask]
+
+
+def _finish_components(melody, comp, model, weights=None):
+    """由各层子分数汇总出 s_* 与 total (求和顺序与 get_fitness 相同)"""
+    s_rhythm = 0
+    for g in comp['groove']: s_rhythm += g
+    comp['s_harmony'] = sum(comp['harmony'])
+    comp['s_rhythm'] = s_rhythm
+    comp['s_structure'] = _structure_from_masks(melody, comp['masks'], model)
+    if not any(n > 0 for n in melody):
+        comp['total'] = -9999
+    else:
+        w_melody, w_harmony, w_rhythm, w_structure = model.weights if weights is None else weights
+        comp['total'] = (w_melody * comp['s_melody']) + \
+                        (w_harmony * comp['s_harmony']) + \
+                        (w_rhythm * comp['s_rhythm']) + \
+                        (w_structure * comp['s_structure'])
+    return comp
+
+
+def score_components(melody, weights=None, model=None):
+    """
+    完整计算一次，返回可供 rescore_delta 增量更新的子分数字典。
+    comp['total'] 与 get_fitness(melody) 相同。
+    """
+    model = model or DEFAULT_MODEL
+    flow = [_flow_at(melody, i, model) if n > 0 else 0 for i, n in enumerate(melody)]
+    harmony, masks, groove = [], [], []
+    for b in range(-(-len(melody) // model.steps_per_bar)):
+        h, m, g = _bar_components(melody, b, model)
+        harmony.append(h)
+        masks.append(m)
+        groove.append(g)
+    comp = {
+        'flow': flow, 'harmony': harmony, 'masks': masks, 'groove': groove,
+        's_melody': sum(flow),
+    }
+    return _finish_components(melody, comp, model, weights)
+
+
+def rescore_delta(melody, parent, lo, hi, weights=None, model=None):
+    """
+    增量评估：melody 与 parent 对应的旋律只在 [lo, hi) 区间内不同。
+    只重算受影响的小节、区间前两个 event 的旋律项以及结构项，
+    返回新的子分数字典，comp['total'] 与完整重算结果完全一致。
+    """
+    model = model or DEFAULT_MODEL
+    steps_per_bar = model.steps_per_bar
+    comp = {
+        'flow': parent['flow'][:], 'harmony': parent['harmony'][:],
+        'masks': parent['masks'][:], 'groove': parent['groove'][:],
+    }
+
+    # 旋律层：区间之前的两个 event 的"后继"可能变了，也要重算
+    start, found = lo, 0
+    while start > 0 and found < 2:
+        start -= 1
+        if melody[start] > 0: found += 1
+    flow = comp['flow']
+    old_flow = sum(flow[start:hi])
+    for i in range(start, hi):
+        flow[i] = _flow_at(melody, i, model) if melody[i] > 0 else 0
+    comp['s_melody'] = parent['s_melody'] - old_flow + sum(flow[start:hi])
+
+    # 和声/节奏层：只重算区间覆盖到的小节
+    for b in range(lo // steps_per_bar, (hi - 1) // steps_per_bar + 1):
+        comp['harmony'][b], comp['masks'][b], comp['groove'][b] = _bar_components(melody, b, model)
+    return _finish_components(melody, comp, model, weights)
@@ -0,0 +1,94 @@
+# instrument.py
+# 训练过程的逐代记录器：各阶段耗时、评估吞吐、分数分布、各适应度层耗时、变异策略计数。
+# 每代一条记录，写入 JSONL 文件或交给回调函数；不启用时使用 NullRecorder，几乎没有开销。
+import json
+import time
+from contextlib import contextmanager
+
+
+class Recorder:
+    """
+    用法：
+        rec = Recorder("train_profile.jsonl")          # 或 Recorder(callback=print)
+        rec.start_generation(gen)
+        with rec.phase('evaluate'): ...
+        rec.set(best_score=...)
+        rec.end_generation()
+    """
+    enabled = True
+
+    def __init__(self, path=None, callback=None):
+        self.callback = callback
+        self._file = open(path, 'a', encoding='utf-8') if path else None
+        self.record = None
+
+    def start_generation(self, gen):
+        self.record = {'gen': gen, 'phases': {}}
+        self._t0 = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name):
+        """给一段代码计时，同名阶段在一代内累加"""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            phases = self.record['phases']
+            phases[name] = phases.get(name, 0.0) + time.perf_counter() - t0
+
+    def set(self, **fields):
+        self.record.update(fields)
+
+    def count(self, key, name, n=1):
+        """record[key][name] += n (如变异策略计数)"""
+        bucket = self.record.setdefault(key, {})
+        bucket[name] = bucket.get(name, 0) + n
+
+    def end_generation(self):
+        record = self.record
+        record['wall'] = time.perf_counter() - self._t0
+        if self._file:
+            self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self._file.flush()
+        if self.callback:
+            self.callback(record)
+        self.record = None
+        return record
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+class _NullPhase:
+    def __enter__(self): return self
+    def __exit__(self, *exc): return False
+
+
+class NullRecorder:
+    """不记录任何东西的记录器 (默认)"""
+    enabled = False
+    _phase = _NullPhase()
+
+    def start_generation(self, gen): pass
+    def phase(self, name): return self._phase
+    def set(self, **fields): pass
+    def count(self, key, name, n=1): pass
+    def end_generation(self): pass
+    def close(self): pass
+
+
+NULL_RECORDER = NullRecorder()
+
+
+def make_recorder(target=None):
+    """
+    把 train() 的 recorder 参数统一成记录器对象：
+    None -> NULL_RECORDER；str -> 写入该 JSONL 文件；可调用对象 -> 回调；Recorder 原样返回
+    """
+    if target is None: return NULL_RECORDER
+    if isinstance(target, (Recorder, NullRecorder)): return target
+    if isinstance(target, str): return Recorder(path=target)
+    if callable(target): return Recorder(callback=target)
+    raise TypeError(f"无法识别的 recorder: {target!r}")
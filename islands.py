@@ -0,0 +1,183 @@
+# islands.py
+# 岛屿模型：N 个子种群各自在独立进程中进化 (每个岛运行 main.evolve)，
+# 每隔 M 代沿环形或随机拓扑把各自最好的 k 个个体迁移给邻居，替换对方最差的 k 个。
+# 只有迁移时才需要进程间通信，平时各岛互不等待。
+# 所有跨进程的等待都带超时：某个岛异常退出时其余岛与主进程不会永远阻塞，而是抛出 RuntimeError。
+import contextlib
+import os
+import queue
+import random
+import time
+import multiprocessing as mp
+import config
+import utils
+from main import evolve, top_k
+
+POLL_SECONDS = 1.0  # 等待移民 / 结果时检查其他进程状态的间隔
+
+
+def migration_targets(n_islands, topology, epoch, seed):
+    """
+    第 epoch 次迁移时每个岛的目标岛编号。
+    ring:   i -> i+1
+    random: 所有岛用同一个种子生成同一个错排 (无自环的排列)，保证每个岛恰好收到一批移民
+    """
+    if topology == 'ring':
+        return [(i + 1) % n_islands for i in range(n_islands)]
+    if topology == 'random':
+        r = random.Random(seed * 1000003 + epoch)
+        while True:
+            targets = list(range(n_islands))
+            r.shuffle(targets)
+            if all(t != i for i, t in enumerate(targets)): return targets
+    raise ValueError(f"未知的迁移拓扑: {topology}")
+
+
+class _OtherIslandStopped:
+    """停止条件：任一岛触发了停止条件 (如达到目标分) 时，其余岛在当前代结束"""
+    def __init__(self, event):
+        self.event = event
+
+    def __call__(self, snapshot):
+        return self.event.is_set()
+
+    def __repr__(self):
+        return "OtherIslandStopped()"
+
+
+def _receive(inbox, abort, finished):
+    """
+    等待本岛的移民。按 POLL_SECONDS 轮询：有岛异常退出 (abort) 时抛出 RuntimeError；
+    有岛已提前停止 (finished) 时不再等待，返回 None。
+    """
+    while True:
+        try:
+            return inbox.get(timeout=POLL_SECONDS)
+        except queue.Empty:
+            if abort.is_set(): raise RuntimeError("其他岛屿异常退出，迁移中止")
+            if finished.is_set(): return None
+
+
+def _island_main(island_id, n_islands, cfg, generations, interval, migrants,
+                 topology, seed, stop, start, inboxes, results, abort, finished):
+    """单个岛屿 (运行在子进程中)：main.evolve 加迁移钩子，只有 0 号岛输出日志"""
+    random.seed(seed + island_id)
+    for inbox in inboxes:
+        inbox.cancel_join_thread()  # 提前停止时没人读的移民不阻塞进程退出
+
+    def migrate(gen, population, scores):
+        # 把自己的前 k 名发给目标岛，再用收到的移民替换自己最差的 k 个
+        if n_islands < 2 or gen == 0 or gen % interval: return ()
+        target = migration_targets(n_islands, topology, gen // interval, seed)[island_id]
+        top = top_k(scores, migrants)
+        inboxes[target].put((population[top].copy(), scores[top].copy()))
+        received = _receive(inboxes[island_id], abort, finished)
+        if received is None: return ()
+        incoming, incoming_scores = received
+        worst = top_k(-scores, len(incoming))
+        population[worst] = incoming
+        scores[worst] = incoming_scores
+        return worst
+
+    history = []  # (距共同起点的秒数, 最佳分)，只在刷新纪录时记录
+    best_score, best_melody = -float('inf'), None
+    profile = cfg.PROFILE_LOG
+    if isinstance(profile, str):
+        root, ext = os.path.splitext(profile)
+        profile = f"{root}.island{island_id}{ext}"
+    with contextlib.ExitStack() as log:
+        if island_id:
+            log.enter_context(contextlib.redirect_stdout(log.enter_context(open(os.devnull, 'w'))))
+        for snapshot in evolve(workers=0, recorder=profile, checkpoint_every=0, generations=generations,
+                               stop=list(stop) + [_OtherIslandStopped(finished)], cfg=cfg, migrate=migrate):
+            if snapshot['best_score'] > best_score:
+                best_score, best_melody = snapshot['best_score'], snapshot['best_melody']
+                history.append((time.time() - start, best_score))
+            if snapshot['stop_reason'] is not None:
+                finished.set()
+    results.put((island_id, best_score, best_melody, history))
+
+
+def _collect(procs, results, abort):
+    """
+    收集各岛的结果。按 POLL_SECONDS 轮询进程状态：有岛异常退出 (或退出后迟迟没有结果) 时
+    通知其余岛中止，并抛出 RuntimeError。
+    """
+    outcomes, silent = {}, set()
+    while len(outcomes) < len(procs):
+        try:
+            outcome = results.get(timeout=POLL_SECONDS)
+            outcomes[outcome[0]] = outcome
+            continue
+        except queue.Empty:
+            pass
+        for island_id, p in enumerate(procs):
+            if island_id in outcomes or p.is_alive(): continue
+            # 正常退出的进程结果可能还在管道里，再等一轮
+            if p.exitcode == 0 and island_id not in silent:
+                silent.add(island_id)
+                continue
+            abort.set()
+            raise RuntimeError(f"岛屿 {island_id} 异常退出 (exitcode {p.exitcode})，训练中止")
+    return [outcomes[i] for i in range(len(procs))]
+
+
+def train_islands(n_islands=None, generations=None, interval=None, migrants=None,
+                  topology=None, pop_size=None, seed=0, cfg=None, stop=None):
+    """
+    岛屿模式训练，参数缺省时取 cfg (默认 config) 中的 ISLANDS / MIGRATION_* 设置。
+    每个岛运行完整的 main.evolve (多样性替换、精英爬山、自适应算子等按 cfg 设置)，
+    只是多一个迁移钩子；断点续训不适用于岛屿模式 (迁移途中的个体不在断点里)。
+    每个岛的规模默认是 POPULATION_SIZE // n_islands，总评估量与单种群相当。
+    stop: 停止条件 (见 stopping.py)，任一岛触发后所有岛在当前代结束。
+    返回 (最佳旋律, 最佳分, 合并后的 (耗时, 最佳分) 记录)，耗时从启动各岛之前的同一时刻算起。
+    """
+    if cfg is None: cfg = config
+    if n_islands is None: n_islands = cfg.ISLANDS
+    if generations is None: generations = cfg.GENERATIONS
+    if interval is None: interval = cfg.MIGRATION_INTERVAL
+    if migrants is None: migrants = cfg.MIGRANTS
+    if topology is None: topology = cfg.MIGRATION_TOPOLOGY
+    if pop_size is None: pop_size = cfg.POPULATION_SIZE // n_islands
+    if stop is None: stop = []
+    elif callable(stop): stop = [stop]
+    migration_targets(n_islands, topology, 0, seed)  # 提前检查拓扑名
+    island_cfg = config.make_config(base=cfg, POPULATION_SIZE=pop_size)
+
+    print(f"Start Islands: {n_islands} x Pop {pop_size} | {generations} Gens | "
+          f"migrate {migrants} every {interval} ({topology})")
+
+    inboxes = [mp.Queue() for _ in range(n_islands)]
+    results = mp.Queue()
+    abort, finished = mp.Event(), mp.Event()
+    start = time.time()  # 各岛共用的计时起点 (墙上时钟，跨进程可比)
+    procs = [mp.Process(target=_island_main,
+                        args=(i, n_islands, island_cfg, generations, interval, migrants,
+                              topology, seed, stop, start, inboxes, results, abort, finished))
+             for i in range(n_islands)]
+    for p in procs: p.start()
+    try:
+        outcomes = _collect(procs, results, abort)
+    finally:
+        for p in procs:
+            p.join(timeout=POLL_SECONDS)
+            if p.is_alive(): p.terminate()
+
+    best = max(outcomes, key=lambda o: o[1])
+    for island_id, score, _, _ in outcomes:
+        print(f"  Island {island_id}: best {score:.2f}")
+
+    # 合并各岛的刷新记录：任意时刻的全局最佳分
+    events = sorted(e for o in outcomes for e in o[3])
+    history, running = [], -float('inf')
+    for elapsed, score in events:
+        if score > running:
+            running = score
+            history.append((elapsed, score))
+    return best[2], best[1], history
+
+
+if __name__ == "__main__":
+    melody, score, _ = train_islands()
+    print(f"Best: {score:.2f}")
+    utils.save_melody_to_midi(melody, "final_islands_music.mid")
@@ -0,0 +1,213 @@
+# library.py
+# MIDI 旋律库：把现有的 .mid 文件 (如 nice_results/ 里手选的好旋律) 量化成染色体，
+# 用来给初始种群和灾难重置"播种"。
+#   read_midi()        最小的标准 MIDI 文件 (SMF) 解析器，只取音符
+#   quantize_notes()   把旋律音轨量化到 config 的网格 (NUM_BARS × BEATS_PER_BAR × STEPS_PER_BEAT)
+#   load_library()     解析整个目录，结果缓存在用户缓存目录 (见 cache_path)；文件增删改或网格参数变化时自动重建
+#   seed_rows()        从库中取出若干行 (多出库容量的副本会被变异，避免完全重复)
+import hashlib
+import json
+import os
+import struct
+import numpy as np
+import config
+
+CACHE_NAME = '.melody_library.npz'
+CACHE_APP = 'melody-ga'
+
+
+# ---------- SMF 解析 ----------
+def _read_varlen(data, pos):
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return value, pos
+
+
+def read_midi(path):
+    """
+    解析 MIDI 文件，返回 (ticks_per_beat, notes)，
+    notes 为 [(音轨, 通道, pitch, 起始 tick, 结束 tick), ...]，按起始时间排序。
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:4] != b'MThd':
+        raise ValueError(f"不是标准 MIDI 文件: {path}")
+    header_len, _, n_tracks, division = struct.unpack('>IHHH', data[4:14])
+    if division & 0x8000:
+        raise ValueError(f"不支持 SMPTE 时间格式: {path}")
+
+    notes = []
+    pos = 8 + header_len
+    for track in range(n_tracks):
+        if data[pos:pos + 4] != b'MTrk':
+            raise ValueError(f"音轨 {track} 头部损坏: {path}")
+        length, = struct.unpack('>I', data[pos + 4:pos + 8])
+        pos, end = pos + 8, pos + 8 + length
+        tick, status, sounding = 0, 0, {}
+        while pos < end:
+            delta, pos = _read_varlen(data, pos)
+            tick += delta
+            if data[pos] & 0x80:
+                status = data[pos]
+                pos += 1
+            kind, channel = status & 0xF0, status & 0x0F
+            if status == 0xFF:                      # meta 事件
+                pos += 1
+                length, pos = _read_varlen(data, pos)
+                pos += length
+            elif status in (0xF0, 0xF7):            # sysex
+                length, pos = _read_varlen(data, pos)
+                pos += length
+            elif kind in (0x80, 0x90):
+                pitch, velocity = data[pos], data[pos + 1]
+                pos += 2
+                key = (channel, pitch)
+                if key in sounding:                 # 同音重新按下也先结束前一个
+                    notes.append((track, channel, pitch, sounding.pop(key), tick))
+                if kind == 0x90 and velocity > 0:
+                    sounding[key] = tick
+            elif kind in (0xC0, 0xD0):
+                pos += 1
+            else:
+                pos += 2
+        for (channel, pitch), start in sounding.items():
+            notes.append((track, channel, pitch, start, tick))
+        pos = end
+    notes.sort(key=lambda n: (n[3], n[0], n[1], n[2]))
+    return division, notes
+
+
+# ---------- 量化 ----------
+def melody_voice(notes):
+    """旋律所在的 (音轨, 通道)：平均音高最高的一组 (跳过打击乐通道 9)"""
+    voices = {}
+    for track, channel, pitch, _, _ in notes:
+        if channel != 9:
+            voices.setdefault((track, channel), []).append(pitch)
+    if not voices:
+        return None
+    return max(voices, key=lambda v: sum(voices[v]) / len(voices[v]))
+
+
+def quantize_notes(notes, ticks_per_beat, cfg=config):
+    """
+    把单声部音符 [(pitch, 起始 tick, 结束 tick), ...] 量化成逐步的基因，
+    按 TOTAL_STEPS 切成若干条 (只保留有音符的片段)，返回 (n, TOTAL_STEPS) uint8。
+    同一步有多个音时取最高音；音高按八度平移进 PITCH_MIN..PITCH_MAX。
+    """
+    ticks_per_step = ticks_per_beat / cfg.STEPS_PER_BEAT
+    total_steps = 0
+    placed = []
+    for pitch, start, end in notes:
+        s = int(round(start / ticks_per_step))
+        e = max(int(round(end / ticks_per_step)), s + 1)
+        while pitch < cfg.PITCH_MIN: pitch += 12
+        while pitch > cfg.PITCH_MAX: pitch -= 12
+        if pitch < cfg.PITCH_MIN:   # 音域不足一个八度时只能截断
+            pitch = cfg.PITCH_MIN
+        placed.append((pitch, s, e))
+        total_steps = max(total_steps, e)
+    n_windows = max(-(-total_steps // cfg.TOTAL_STEPS), 1)
+    grid = np.zeros(n_windows * cfg.TOTAL_STEPS, dtype=np.uint8)
+    for pitch, s, e in placed:
+        grid[s:e] = np.maximum(grid[s:e], pitch)
+    windows = grid.reshape(n_windows, cfg.TOTAL_STEPS)
+    return windows[windows.any(axis=1)]
+
+
+def midi_to_melodies(path, cfg=config):
+    """读入一个 MIDI 文件，返回其旋律音轨量化后的染色体 (n, TOTAL_STEPS)"""
+    ticks_per_beat, notes = read_midi(path)
+    voice = melody_voice(notes)
+    melody = [(p, s, e) for t, c, p, s, e in notes if (t, c) == voice]
+    if not melody:
+        return np.empty((0, cfg.TOTAL_STEPS), dtype=np.uint8)
+    return quantize_notes(melody, ticks_per_beat, cfg)
+
+
+# ---------- 旋律库与缓存 ----------
+def _signature(directory, files, cfg):
+    """缓存失效的依据：文件名/大小/修改时间 + 量化网格参数"""
+    stats = [(name, os.stat(os.path.join(directory, name))) for name in files]
+    return json.dumps({
+        'files': [(name, st.st_size, st.st_mtime_ns) for name, st in stats],
+        'grid': [cfg.TOTAL_STEPS, cfg.STEPS_PER_BEAT, cfg.PITCH_MIN, cfg.PITCH_MAX],
+    })
+
+
+def cache_path(directory, cfg=config):
+    """
+    directory 的缓存文件：cfg.LIBRARY_CACHE_DIR (默认 $XDG_CACHE_HOME/melody-ga 或 ~/.cache/melody-ga)
+    下以目录绝对路径的哈希命名，不同目录互不覆盖。
+    """
+    root = cfg.LIBRARY_CACHE_DIR
+    if root is None:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        root = os.path.join(base, CACHE_APP)
+    digest = hashlib.sha1(os.path.abspath(directory).encode()).hexdigest()[:16]
+    return os.path.join(root, digest + CACHE_NAME)
+
+
+def load_library(directory, cfg=config, use_cache=True):
+    """
+    解析目录下所有 .mid 文件，返回 (melodies, names)：
+    melodies 为 (n, TOTAL_STEPS) uint8，names[i] 为第 i 行来自的文件名。
+    结果缓存在 cache_path(directory) (用户缓存目录，不写进 MIDI 目录)，下次启动直接读取。
+    """
+    files = sorted(name for name in os.listdir(directory) if name.lower().endswith(('.mid', '.midi')))
+    signature = _signature(directory, files, cfg)
+    path = cache_path(directory, cfg)
+    if use_cache and os.path.exists(path):
+        with np.load(path) as data:
+            if data['signature'].tobytes().decode() == signature:
+                return data['melodies'].copy(), json.loads(data['names'].tobytes().decode())
+
+    rows, names = [], []
+    for name in files:
+        try:
+            melodies = midi_to_melodies(os.path.join(directory, name), cfg)
+        except (ValueError, IndexError, struct.error) as e:
+            print(f"  跳过 {name}: {e}")
+            continue
+        rows.append(melodies)
+        names += [name] * len(melodies)
+    melodies = np.concatenate(rows) if rows else np.empty((0, cfg.TOTAL_STEPS), dtype=np.uint8)
+
+    if use_cache:
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = path + '.tmp'
+            with open(tmp, 'wb') as f:
+                np.savez(f, melodies=melodies,
+                         names=np.frombuffer(json.dumps(names).encode(), dtype=np.uint8),
+                         signature=np.frombuffer(signature.encode(), dtype=np.uint8))
+            os.replace(tmp, path)
+        except OSError:
+            pass  # 缓存目录不可写时不缓存
+    return melodies, names
+
+
+def seed_rows(library, n, rng, mutate=None):
+    """
+    从库中取 n 行：先每条各取一次 (随机顺序)，不够时循环；
+    mutate(pop, rows) 用来变异第一轮之后的副本。
+    """
+    if n <= 0 or len(library) == 0:
+        return np.empty((0, library.shape[1]), dtype=np.uint8)
+    order = np.concatenate([rng.permutation(len(library)) for _ in range(-(-n // len(library)))])[:n]
+    rows = library[order].copy()
+    if mutate is not None and n > len(library):
+        mutate(rows, np.arange(len(library), n))
+    return rows
+
+
+if __name__ == "__main__":
+    import sys
+    from fitness_function import get_fitness
+    melodies, names = load_library(sys.argv[1] if len(sys.argv) > 1 else 'nice_results')
+    for melody, name in zip(melodies, names):
+        print(f"{get_fitness(melody.tolist()):9.2f}  {name}")
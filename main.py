@@ -1,8 +1,23 @@
 # main.py
+import bisect
+import itertools
+import math
+import os
 import random
+import sys
+import time
+import numpy as np
 import config
 import utils
-from fitness_function import get_fitness 
+from fitness_function import FitnessCache, FitnessModel, DEFAULT_MODEL, get_fitness_batch, surrogate_batch
+from parallel import ParallelEvaluator
+from instrument import NULL_RECORDER, Recorder, make_recorder
+from checkpoint import save_checkpoint, load_checkpoint
+from stopping import Deadline, first_triggered
+from diversity import DiversityIndex
+from library import load_library, seed_rows
+from memetic import refine_elites
+from bandit import OperatorBandit
 
 # ==========================================
 # 1. 乐理变异算子 (Musical Mutators)
@@ -33,21 +48,28 @@ def op_shadow_echo(melody):
     return melody
 
 def op_rhythm_clone(melody):
-    """动机克隆：将 Bar 0 的节奏强行复制到 Bar 2"""
+    """动机克隆：将乐句第 1 小节的节奏强行复制到第 3 小节 (多个乐句时随机挑一句)"""
     steps_per_bar = config.BEATS_PER_BAR * config.STEPS_PER_BEAT
-    if len(melody) >= 3 * steps_per_bar:
-        bar0 = melody[0:steps_per_bar]
-        bar2_start = 2 * steps_per_bar
+    phrases = _clone_phrases(len(melody), steps_per_bar, config.PHRASE_BARS)
+    if phrases:
+        start = random.randrange(phrases) * config.PHRASE_BARS * steps_per_bar if phrases > 1 else 0
+        bar0 = melody[start:start + steps_per_bar]
+        bar2_start = start + 2 * steps_per_bar
         for i in range(steps_per_bar):
             # 只复制节奏(0/1关系)，保留 Bar 2 原有的音高(如果有的话)，或者赋予新音高
             if bar0[i] > 0:
                 # 如果 Bar 2 该位置本来是空的，填一个随机调内音
                 if melody[bar2_start + i] == 0:
-                    melody[bar2_start + i] = random.choice(list(config.SCALE_C_MAJOR)) + 60
+                    melody[bar2_start + i] = random.choice(utils.scale_pitches())
             else:
                 melody[bar2_start + i] = 0
     return melody
 
+def _clone_phrases(n_steps, steps_per_bar, phrase_bars):
+    """含有第 3 小节 (可做动机克隆) 的乐句数"""
+    n_bars = n_steps // steps_per_bar
+    return 0 if n_bars < 3 else (n_bars - 3) // phrase_bars + 1
+
 def op_retrograde_segment(melody):
     """局部逆行：将一小段旋律倒着放 (巴赫常用技巧)"""
     length = 4 # 倒转 4 个步长（半个小节）
@@ -80,121 +102,733 @@ def op_inversion_segment(melody):
 # 2. 遗传核心 (Engine)
 # ==========================================
 
+def op_random_reset(melody):
+    """彻底重置：换成一条新的随机旋律 (引入鲶鱼)"""
+    return utils.generate_random_melody(len(melody))
+
+# 变异策略池及其权重
+STRATEGIES = [
+    (op_micro_adjust,       0.50), # 50% 概率只是微调 (最安全)
+    (op_shadow_echo,        0.20), # 20% 增加律动
+    (op_rhythm_clone,       0.10), # 10% 强化结构
+    (op_retrograde_segment, 0.05), # 5%  整活：逆行
+    (op_inversion_segment,  0.05), # 5%  整活：倒影
+    (op_random_reset,       0.10), # 10% 彻底重置
+]
+# 轮盘赌的累计权重只算一次 (逐个累加，与原来边走边加的浮点结果相同)
+STRATEGY_CUMULATIVE = list(itertools.accumulate(weight for _, weight in STRATEGIES))
+
 def mutate_dispatcher(melody, rate):
-    """
-    变异调度器：根据概率轮盘赌选择一种变异策略
-    """
+    """变异调度器：根据概率轮盘赌选择一种变异策略"""
     if random.random() > rate: return melody
     
-    new_melody = melody[:] # Copy
-    
-    # 定义变异策略池及其权重
-    strategies = [
-        (op_micro_adjust,     0.50), # 50% 概率只是微调 (最安全)
-        (op_shadow_echo,      0.20), # 20% 增加律动
-        (op_rhythm_clone,     0.10), # 10% 强化结构
-        (op_retrograde_segment, 0.05), # 5%  整活：逆行
-        (op_inversion_segment,  0.05), # 5%  整活：倒影
-        (utils.generate_random_melody, 0.10) # 10% 彻底重置 (引入鲶鱼)
-    ]
-    
-    # 轮盘赌选择
-    r = random.random()
-    cumulative = 0
-    for func, weight in strategies:
-        cumulative += weight
-        if r < cumulative:
-            # 如果是重置函数，不需要传参
-            if func == utils.generate_random_melody:
-                return func() 
-            return func(new_melody)
-    
-    return new_melody
+    k = bisect.bisect_right(STRATEGY_CUMULATIVE, random.random())
+    if k >= len(STRATEGIES): return melody[:]
+    return STRATEGIES[k][0](melody[:])
 
 def crossover(p1, p2):
     """单点交叉：保持乐句完整性，比均匀交叉更好"""
     point = random.randint(1, len(p1) - 1)
     return p1[:point] + p2[point:], p2[:point] + p1[point:]
 
+# ==========================================
+# 2b. 批量算子 (Batch Operators)
+# 种群是一块连续的 (POP, TOTAL_STEPS) uint8 数组，每行一个个体。
+# 每个 op_*_batch(pop, rows, rng, cfg) 原地修改 pop[rows]，语义与对应的标量算子相同，
+# 只是用随机掩码和下标数组一次处理整批后代。cfg 默认是 config 模块，也可以是 config.make_config() 的副本。
+# ==========================================
+
+def op_micro_adjust_batch(pop, rows, rng, cfg=config):
+    """批量微调：每行随机选一个位置，上下移动 1-2 个半音"""
+    idx = rng.integers(0, pop.shape[1], len(rows))
+    old = pop[rows, idx].astype(np.int16)
+    new = old + rng.choice(np.array([-2, -1, 1, 2], dtype=np.int16), len(rows))
+    ok = (old > 0) & (new >= cfg.PITCH_MIN) & (new <= cfg.PITCH_MAX)
+    pop[rows[ok], idx[ok]] = new[ok]
+
+def op_shadow_echo_batch(pop, rows, rng, cfg=config):
+    """批量回声：每行从左到右第一个"有音+空拍"且掷中 30% 的位置，把音延续到空拍上"""
+    block = pop[rows]
+    candidate = (block[:, :-1] > 0) & (block[:, 1:] == 0)
+    trigger = candidate & (rng.random(candidate.shape) < 0.3)
+    hit = trigger.any(axis=1)
+    first = np.argmax(trigger, axis=1)[hit]
+    pop[rows[hit], first + 1] = block[hit, first]
+
+def op_rhythm_clone_batch(pop, rows, rng, cfg=config):
+    """批量动机克隆：乐句第 1 小节的节奏复制到第 3 小节 (多个乐句时每行随机挑一句)"""
+    steps_per_bar = cfg.BEATS_PER_BAR * cfg.STEPS_PER_BEAT
+    phrases = _clone_phrases(pop.shape[1], steps_per_bar, cfg.PHRASE_BARS)
+    if not phrases: return
+    start = np.zeros(len(rows), dtype=np.int64)
+    if phrases > 1:
+        start = rng.integers(0, phrases, len(rows)) * (cfg.PHRASE_BARS * steps_per_bar)
+    bar0 = start[:, None] + np.arange(steps_per_bar)
+    bar2 = bar0 + 2 * steps_per_bar
+    bar0_on = pop[rows[:, None], bar0] > 0
+    block = pop[rows[:, None], bar2]
+    # 需要补音的位置填一个随机调内音
+    scale = np.array(utils.scale_pitches(cfg), dtype=np.uint8)
+    fill = bar0_on & (block == 0)
+    block[fill] = rng.choice(scale, int(fill.sum()))
+    block[~bar0_on] = 0
+    pop[rows[:, None], bar2] = block
+
+def _segment_index(pop, rows, rng, length=4):
+    """每行随机选一段长度为 length 的窗口，返回 (行号, 列号) 下标矩阵"""
+    start = rng.integers(0, pop.shape[1] - length + 1, len(rows))
+    return rows[:, None], start[:, None] + np.arange(length)
+
+def op_retrograde_segment_batch(pop, rows, rng, cfg=config):
+    """批量局部逆行"""
+    r, c = _segment_index(pop, rows, rng)
+    pop[r, c] = pop[r, c][:, ::-1]
+
+def op_inversion_segment_batch(pop, rows, rng, cfg=config):
+    """批量局部倒影：以每段第一个音为轴镜像翻转"""
+    r, c = _segment_index(pop, rows, rng)
+    segment = pop[r, c].astype(np.int16)
+    pivot = segment[:, :1]
+    pivot = np.where(pivot == 0, 72, pivot) # 默认轴
+    mirrored = np.clip(2 * pivot - segment, cfg.PITCH_MIN, cfg.PITCH_MAX)
+    pop[r, c] = np.where(segment > 0, mirrored, segment)
+
+def op_random_reset_batch(pop, rows, rng, cfg=config):
+    """批量重置：整行换成新的随机旋律"""
+    pop[rows] = utils.generate_random_population(len(rows), pop.shape[1], rng, cfg)
+
+BATCH_STRATEGIES = [
+    (op_micro_adjust_batch,       0.50),
+    (op_shadow_echo_batch,        0.20),
+    (op_rhythm_clone_batch,       0.10),
+    (op_retrograde_segment_batch, 0.05),
+    (op_inversion_segment_batch,  0.05),
+    (op_random_reset_batch,       0.10),
+]
+
+BATCH_CUMULATIVE = np.cumsum([weight for _, weight in BATCH_STRATEGIES])
+
+def mutate_batch(pop, rate, rng, cfg=config, weights=None):
+    """
+    批量变异调度器：每个后代以 rate 的概率被选中，再按轮盘赌分配一种算子。
+    weights 为各算子的选择概率 (如 OperatorBandit.probabilities())，默认用 BATCH_STRATEGIES 的权重。
+    原地修改 pop，返回每行使用的算子编号 (-1 表示未变异)。
+    """
+    ops = np.full(len(pop), -1, dtype=np.int8)
+    chosen = np.flatnonzero(rng.random(len(pop)) <= rate)
+    if weights is None:
+        cumulative = BATCH_CUMULATIVE
+    else:
+        cumulative = np.cumsum(weights)
+        cumulative /= cumulative[-1]
+    picked = np.searchsorted(cumulative, rng.random(len(chosen)), side='right')
+    for k, (op, _) in enumerate(BATCH_STRATEGIES):
+        rows = chosen[picked == k]
+        if len(rows):
+            op(pop, rows, rng, cfg)
+            ops[rows] = k
+    return ops
+
+def crossover_batch(p1, p2, rng):
+    """批量单点交叉：每一对父母各自随机一个切点"""
+    point = rng.integers(1, p1.shape[1], len(p1))
+    head = np.arange(p1.shape[1]) < point[:, None]
+    return np.where(head, p1, p2), np.where(head, p2, p1)
+
 # ==========================================
 # 3. 训练主循环 (Clean Version)
 # ==========================================
 
-def train():
-    TOTAL_GENS = 500
-    POP_SIZE = config.POPULATION_SIZE
-    
-    # 初始化
-    population = [utils.generate_random_melody() for _ in range(POP_SIZE)]
-    
-    # 状态追踪
-    stats = {
+# 预筛时每块候选的基因格上限 (行 × 步)：近似打分的临时数组随块大小增长，
+# 一次处理整代 (如 10 万 × 256 步 × 一窝 16 个) 要占用数 GB 内存。
+PRESCREEN_CHUNK_CELLS = 1 << 20
+
+def new_stats(cfg=config):
+    """训练状态：停滞计数、历史最佳分、当前变异率"""
+    return {
         'stag_count': 0,
         'best_score': -9999,
-        'mut_rate': config.MUTATION_RATE_BASE
+        'mut_rate': cfg.MUTATION_RATE_BASE
     }
+
+def update_stats(stats, current_best_score, cfg=config):
+    """停滞检测与自适应：有进展就恢复基础变异率，越停滞变异率越高"""
+    if current_best_score > stats['best_score'] + 0.1:
+        stats['stag_count'] = 0
+        stats['best_score'] = current_best_score
+        stats['mut_rate'] = cfg.MUTATION_RATE_BASE # 进展顺利，保持稳定
+    else:
+        stats['stag_count'] += 1
+        # 动态调整变异率：越停滞，越焦虑
+        if stats['stag_count'] > 10: stats['mut_rate'] = 0.2
+        if stats['stag_count'] > 30: stats['mut_rate'] = 0.5
+
+def cataclysm(population, ranked, rng, cfg=config, library=None):
+    """灾难机制：只留前3个精英，其余全部随机重置 (给了种子库时按 SEED_FRACTION 从库中补充)"""
+    survivors = population[ranked[:3]]
+    new_blood = utils.generate_random_population(len(population) - 3, population.shape[1], rng, cfg)
+    if library is not None:
+        seed_population(new_blood, library, rng, cfg)
+    return np.concatenate([survivors, new_blood])
+
+def seed_population(population, library, rng, cfg=config):
+    """把种群前 SEED_FRACTION 的行换成库中旋律，多余的副本各重写一个小节。原地修改，返回替换行数"""
+    n = min(int(len(population) * cfg.SEED_FRACTION), len(population))
+    rows = seed_rows(library, n, rng, lambda p, r: regenerate_bars(p, r, rng, n_bars=1, cfg=cfg))
+    population[:len(rows)] = rows
+    return len(rows)
+
+def regenerate_bars(pop, rows, rng, n_bars=2, cfg=config):
+    """把每行随机 n_bars 个不同的小节换成新的随机音符，其余小节保留"""
+    bar_steps = cfg.BEATS_PER_BAR * cfg.STEPS_PER_BEAT
+    total_bars = pop.shape[1] // bar_steps
+    n_bars = min(n_bars, total_bars)
+    bars = np.argsort(rng.random((len(rows), total_bars)), axis=1)[:, :n_bars]
+    cols = (bars[:, :, None] * bar_steps + np.arange(bar_steps)).reshape(len(rows), -1)
+    fresh = utils.generate_random_population(len(rows), cols.shape[1], rng, cfg)
+    pop[rows[:, None], cols] = fresh
+
+def diversify(population, index, rng, near_limit, cfg=config):
+    """
+    多样性替换：完全重复的个体只留第一个，只差一个小节的近似重复组只留前 near_limit 个，
+    多出来的个体随机重写两个小节 (新素材)。population 按精英在前排列，保留的是每组中最好的。
+    原地修改，返回被替换的行号。
+    """
+    index.update(population)
+    rows = np.union1d(index.duplicate_rows(), index.near_duplicate_rows(near_limit))
+    if len(rows):
+        regenerate_bars(population, rows, rng, cfg=cfg)
+        index.update(population)
+    return rows
+
+def top_k(scores, k):
+    """
+    分数最高的 k 个下标，按分数降序排列 (同分时下标小的在前)，
+    与 np.argsort(-scores, kind='stable')[:k] 完全相同，但只做部分排序。
+    """
+    k = min(k, len(scores))
+    if k <= 0: return np.empty(0, dtype=np.int64)
+    kth = np.partition(scores, len(scores) - k)[len(scores) - k]
+    above = np.flatnonzero(scores > kth)
+    ties = np.flatnonzero(scores == kth)[:k - len(above)]
+    idx = np.concatenate([above, ties])
+    return idx[np.lexsort((idx, -scores[idx]))]
+
+def tournament_select(scores, n_pairs, rng, size=5):
+    """
+    批量锦标赛选择：每场不放回地抽 size 个选手，取分数最高者 (同分取先抽到的)，
+    一次性抽完所有场次，返回两组父母下标。
+    """
+    pop_size = len(scores)
+    if size > pop_size:
+        raise ValueError(f"锦标赛规模 {size} 超过种群规模 {pop_size}")
+    n = 2 * n_pairs
+    rows = np.arange(n)
     
-    print(f"Start Training: {TOTAL_GENS} Gens | Pop {POP_SIZE}")
+    if size * size <= pop_size:
+        # 小锦标赛：直接抽下标，含重复下标的场次整场重抽 (拒绝采样 = 不放回抽样)
+        contestants = rng.integers(0, pop_size, (n, size))
+        while size > 1:
+            ordered = np.sort(contestants, axis=1)
+            dup = (ordered[:, 1:] == ordered[:, :-1]).any(axis=1)
+            if not dup.any(): break
+            contestants[dup] = rng.integers(0, pop_size, (int(dup.sum()), size))
+        winners = contestants[rows, np.argmax(scores[contestants], axis=1)]
+    else:
+        # 大锦标赛：重复下标太多，改为直接按名次分布抽冠军。
+        # 冠军名次 >= r 的概率 = C(pop-r, size) / C(pop, size)
+        ranked = np.argsort(-scores, kind='stable')
+        r = np.arange(1, pop_size - size + 1)
+        tail = np.cumprod((pop_size - r + 1 - size) / (pop_size - r + 1))
+        rank = np.searchsorted(-tail, -rng.random(n), side='left')
+        # 同分的选手谁先被抽到是等可能的：在同分区间内均匀挑一个
+        desc = -scores[ranked]
+        lo = np.searchsorted(desc, desc[rank], side='left')
+        hi = np.searchsorted(desc, desc[rank], side='right')
+        winners = ranked[lo + (rng.random(n) * (hi - lo)).astype(np.int64)]
+    return winners[:n_pairs], winners[n_pairs:]
 
-    for gen in range(TOTAL_GENS):
-        # 1. 评估与排序
-        scored_pop = [(get_fitness(ind), ind) for ind in population]
-        scored_pop.sort(key=lambda x: x[0], reverse=True)
+def breed(population, scores, ranked, mut_rate, rng, recorder=NULL_RECORDER, cfg=config,
+          weights=None, lineage=None, brood=1, model=None, screening=None):
+    """
+    繁殖下一代：精英保留 + 锦标赛选择 + 整块交叉与变异。
+    ranked 为按分数降序的下标 (至少包含前 5% 的精英，见 top_k)。
+    weights: 变异算子的选择概率 (见 mutate_batch)。
+    lineage: 传入字典时写入每个后代的来历，供下一代评估后给算子记功：
+             'rows' 后代在新种群中的行号，'ops' 所用算子，'parent_scores' 父母中较高的分数。
+    brood:   大于 1 时每对父母交叉 brood 次 (一窝 2×brood 个候选)，用 surrogate_batch
+             (model 的和声、节奏层与近似的旋律层) 预筛，每窝只留近似分最高的两个进入种群 (下一代才做完整评估)。
+    screening: 传入字典时累加预筛统计 'generations' / 'candidates' / 'kept' / 'seconds' (只计 surrogate_batch 的时间)。
+    """
+    pop_size = len(population)
+    
+    with recorder.phase('select'):
+        # [A] 精英保留 (Top 5%)
+        elite_count = int(pop_size * 0.05)
+        elites = population[ranked[:elite_count]]
         
-        current_best_score, best_melody = scored_pop[0]
+        # [B] 锦标赛选择 (Tournament Size = 5)
+        n_children = pop_size - elite_count
+        n_pairs = (n_children + 1) // 2
+        parents1, parents2 = tournament_select(scores, n_pairs, rng)
+    
+    # 不预筛时一次处理全部父母；预筛时按窝分块，每块的候选不超过 PRESCREEN_CHUNK_CELLS 个基因格
+    block = n_pairs if brood == 1 else max(1, PRESCREEN_CHUNK_CELLS // (2 * brood * population.shape[1]))
+    kept_children, kept_ops, kept_scores = [], [], []
+    n_candidates, surrogate_seconds = 0, 0.0
+    for lo in range(0, n_pairs, block):
+        p1, p2 = parents1[lo:lo + block], parents2[lo:lo + block]
+        n_kept = min(2 * (lo + len(p1)), n_children) - 2 * lo  # 奇数时最后一对只留一个
+        if brood > 1:
+            # 每对父母交叉 brood 次 (一窝)，块内第 k 对的 2×brood 个候选是第 [2k·brood, 2(k+1)·brood) 行
+            p1, p2 = np.repeat(p1, brood), np.repeat(p2, brood)
+        n_block = n_kept if brood == 1 else 2 * len(p1)
+        n_candidates += n_block
         
-        # 2. 停滞检测与自适应 (封装逻辑)
-        if current_best_score > stats['best_score'] + 0.1:
-            stats['stag_count'] = 0
-            stats['best_score'] = current_best_score
-            stats['mut_rate'] = config.MUTATION_RATE_BASE # 进展顺利，保持稳定
-        else:
-            stats['stag_count'] += 1
-            # 动态调整变异率：越停滞，越焦虑
-            if stats['stag_count'] > 10: stats['mut_rate'] = 0.2
-            if stats['stag_count'] > 30: stats['mut_rate'] = 0.5
-            
-        # 3. 灾难机制 (Cataclysm)
-        if stats['stag_count'] > 50:
-            print(f"  >>> [灭绝] Gen {gen}: 陷入局部最优，重置种群...")
-            # 只留前3个精英，其余全部随机重置
-            survivors = [p[1] for p in scored_pop[:3]]
-            new_blood = [utils.generate_random_melody() for _ in range(POP_SIZE - 3)]
-            population = survivors + new_blood
-            stats['stag_count'] = 0
-            continue # 跳过本轮
-
-        # 4. 繁殖下一代
-        new_pop = []
+        # [C] 整块交叉与变异
+        with recorder.phase('crossover'):
+            child1, child2 = crossover_batch(population[p1], population[p2], rng)
+            # 交错排列 (child1, child2, child1, ...)，截断以防溢出 (如果是奇数)
+            children = np.stack([child1, child2], axis=1).reshape(-1, population.shape[1])[:n_block]
+        with recorder.phase('mutate'):
+            ops = mutate_batch(children, mut_rate, rng, cfg, weights)
+        if lineage is not None:
+            parent_scores = np.repeat(np.maximum(scores[p1], scores[p2]), 2)[:n_block]
         
-        # [A] 精英保留 (Top 5%)
-        elite_count = int(POP_SIZE * 0.05)
-        new_pop.extend([p[1] for p in scored_pop[:elite_count]])
+        # [D] 预筛：每窝 2×brood 个候选里只留近似分最高的两个
+        if brood > 1:
+            with recorder.phase('prescreen'):
+                t0 = time.perf_counter()
+                surrogate = surrogate_batch(children, model).reshape(-1, 2 * brood)
+                surrogate_seconds += time.perf_counter() - t0
+                best = np.argsort(-surrogate, axis=1, kind='stable')[:, :2]
+                keep = (best + 2 * brood * np.arange(len(surrogate))[:, None]).ravel()[:n_kept]
+                children, ops = children[keep], ops[keep]
+                if lineage is not None: parent_scores = parent_scores[keep]
+        kept_children.append(children)
+        kept_ops.append(ops)
+        if lineage is not None: kept_scores.append(parent_scores)
+    
+    children = np.concatenate(kept_children) if len(kept_children) > 1 else kept_children[0]
+    ops = np.concatenate(kept_ops) if len(kept_ops) > 1 else kept_ops[0]
+    if lineage is not None: parent_scores = np.concatenate(kept_scores)
+    if brood > 1:
+        if screening is not None:
+            screening['generations'] = screening.get('generations', 0) + 1
+            screening['candidates'] = screening.get('candidates', 0) + n_candidates
+            screening['kept'] = screening.get('kept', 0) + n_children
+            screening['seconds'] = screening.get('seconds', 0.0) + surrogate_seconds
+        if recorder.enabled:
+            recorder.set(prescreen={'candidates': n_candidates, 'kept': n_children,
+                                    'seconds': surrogate_seconds})
+    
+    if lineage is not None:
+        lineage['rows'] = np.arange(elite_count, pop_size)
+        lineage['ops'] = ops
+        lineage['parent_scores'] = parent_scores
+    
+    if recorder.enabled:
+        counts = np.bincount(ops.astype(np.int64) + 1, minlength=len(BATCH_STRATEGIES) + 1)
+        recorder.count('strategies', 'none', int(counts[0]))
+        for (op, _), n in zip(BATCH_STRATEGIES, counts[1:].tolist()):
+            recorder.count('strategies', op.__name__, n)
+    
+    return np.concatenate([elites, children])
+
+def evolve(cache_size=None, workers=None, recorder=None,
+           checkpoint_path=None, checkpoint_every=None, resume=False,
+           generations=None, stop=None, cfg=None, library=None, migrate=None):
+    """
+    进化主循环的生成器形式：每评估完一代就产出一个快照字典
+        {'gen', 'best_score', 'best_melody', 'elite', 'elite_scores', 'stats', 'elapsed', 'stop_reason'}
+    elite / elite_scores 为本代前 5% 的个体 (按分数从高到低) 及其分数。
+    调用方可以随时停止迭代；也可以通过 stop 传入停止条件 (见 stopping.py)，
+    任一条件触发后产出最后一个快照 (stop_reason 为该条件) 并结束。
+
+    generations: 最多进化多少代，默认取 config.GENERATIONS。
+    recorder: 逐代性能记录 (见 instrument.py)。可以是 JSONL 文件路径、回调函数或 Recorder 对象，
+              默认取 config.PROFILE_LOG，为 None 时不记录。
+    checkpoint_path / checkpoint_every: 每隔多少代把完整状态原子地写入断点文件 (见 checkpoint.py)，
+              默认取 config.CHECKPOINT_PATH / CHECKPOINT_EVERY。
+    resume:   断点文件存在时从中恢复，后续轨迹与不中断的运行完全一致。
+    cfg:      本次运行使用的配置，默认是 config 模块本身；传入 config.make_config(...) 的副本
+              即可单独调整种群规模、变异率、休止符概率、适应度权重等，不影响其他运行。
+    library:  种子旋律库，MIDI 目录路径或 (n, TOTAL_STEPS) 数组，默认取 config.SEED_LIBRARY。
+              初始种群与灾难重置时按 SEED_FRACTION 比例从库中取个体 (见 library.py)。
+    migrate:  迁移钩子 (岛屿模型，见 islands.py)，每代评估与精英爬山之后调用
+              migrate(gen, population, scores)，可原地替换个体及其分数，返回被替换的行号。
+    """
+    if cfg is None: cfg = config
+    TOTAL_GENS = cfg.GENERATIONS if generations is None else generations
+    POP_SIZE = cfg.POPULATION_SIZE
+    if workers is None: workers = cfg.WORKERS
+    if recorder is None: recorder = cfg.PROFILE_LOG
+    if checkpoint_path is None: checkpoint_path = cfg.CHECKPOINT_PATH
+    if checkpoint_every is None: checkpoint_every = cfg.CHECKPOINT_EVERY
+    if cache_size is None: cache_size = cfg.FITNESS_CACHE_SIZE
+    if library is None: library = cfg.SEED_LIBRARY
+    if isinstance(library, (str, os.PathLike)):
+        library = load_library(library, cfg)[0]
+    if library is not None:
+        library = np.asarray(library, dtype=np.uint8)
+        if library.ndim != 2 or library.shape[1] != cfg.TOTAL_STEPS:
+            raise ValueError(f"种子库形状 {library.shape} 与基因长度 {cfg.TOTAL_STEPS} 不符")
+        if not len(library): library = None
+    # 适应度模型 (查找表) 按本次运行的配置编译一次
+    model = DEFAULT_MODEL if cfg is config else FitnessModel(cfg)
+    if stop is None: stop = []
+    elif callable(stop): stop = [stop]
+    recorder = make_recorder(recorder)
+    t0 = time.perf_counter()
+    
+    # 适应度缓存 (默认容量见 config.FITNESS_CACHE_SIZE)，只在本次运行内有效，不同权重的运行互不干扰
+    cache = FitnessCache(cache_size, model)
+    
+    start_gen, resumed_scores = 0, None
+    if resume and checkpoint_path and os.path.exists(checkpoint_path):
+        # 断点恢复：种群、分数、stats 与两套随机数状态都来自检查点
+        start_gen, population, resumed_scores, stats, rng = load_checkpoint(checkpoint_path)
+        POP_SIZE = len(population)
+        print(f"Resume from {checkpoint_path}: Gen {start_gen}")
+    else:
+        # 批量算子使用 numpy 随机数，种子取自 random 模块，random.seed() 即可复现整次训练
+        rng = np.random.default_rng(random.getrandbits(64))
         
-        # [B] 锦标赛选择与交叉
-        while len(new_pop) < POP_SIZE:
-            # 选取父母 (Tournament Size = 5)
-            parent1 = max(random.sample(scored_pop, 5), key=lambda x:x[0])[1]
-            parent2 = max(random.sample(scored_pop, 5), key=lambda x:x[0])[1]
+        # 初始化：整个种群是一块 (POP, TOTAL_STEPS) 的 uint8 数组
+        population = utils.generate_random_population(POP_SIZE, cfg.TOTAL_STEPS, rng, cfg)
+        if library is not None:
+            seeded = seed_population(population, library, rng, cfg)
+            print(f"Seeded {seeded} individuals from library ({len(library)} melodies)")
+        
+        # 状态追踪
+        stats = new_stats(cfg)
+    
+    # 精英局部搜索 (config.MEMETIC_TOP_K 为 0 时关闭)
+    memetic_k, memetic_budget = cfg.MEMETIC_TOP_K, cfg.MEMETIC_BUDGET
+    memetic_total = {'evaluations': 0, 'improved': 0, 'gain': 0.0}
+    
+    # 自适应变异算子 (config.ADAPTIVE_OPERATORS 为 False 时关闭，不做任何记功)：
+    # 统计每个算子的后代相对父母的提升，按统计结果调整各算子的选择概率
+    bandit = None
+    if cfg.ADAPTIVE_OPERATORS:
+        bandit = OperatorBandit([op.__name__ for op, _ in BATCH_STRATEGIES],
+                                [weight for _, weight in BATCH_STRATEGIES],
+                                cfg.OPERATOR_ADAPT_RATE, cfg.OPERATOR_MIN_PROB, stats.get('operators'))
+    lineage = {}
+    
+    # 后代预筛 (config.PRESCREEN_BROOD 为 1 时关闭)：多产生的候选只算便宜的近似分
+    brood = cfg.PRESCREEN_BROOD
+    screening = {}
+    
+    # 多样性指数：每代繁殖后替换重复/近似重复个体 (config.NEAR_DUPLICATE_LIMIT 为 0 时关闭)
+    near_limit = cfg.NEAR_DUPLICATE_LIMIT
+    diversity = DiversityIndex(population.shape[1], cfg.BEATS_PER_BAR * cfg.STEPS_PER_BEAT)
+    
+    # 评估器：多进程时使用共享内存进程池，否则直接调用批量引擎
+    if workers > 1:
+        evaluator = ParallelEvaluator(workers, capacity=POP_SIZE, n_steps=population.shape[1], model=model)
+        batch_fn = evaluator
+    else:
+        evaluator = None
+        batch_fn = lambda p: get_fitness_batch(p, model=model)
+    
+    print(f"Start Training: {TOTAL_GENS} Gens | Pop {POP_SIZE}")
+
+    try:
+        for gen in range(start_gen, TOTAL_GENS):
+            recorder.start_generation(gen)
+            
+            # 1. 评估与排序 (批量引擎打分，已见过的旋律直接查缓存)
+            resumed = resumed_scores is not None
+            misses = cache.misses
+            layers = {}
+            with recorder.phase('evaluate'):
+                if resumed:
+                    # 断点恢复的这一代：分数与 stats 已保存在检查点中
+                    scores, resumed_scores = resumed_scores, None
+                elif recorder.enabled and evaluator is None:
+                    scores = cache.score_batch(population, lambda p: get_fitness_batch(p, timings=layers, model=model))
+                else:
+                    scores = cache.score_batch(population, batch_fn)
+            with recorder.phase('sort'):
+                # 只需要精英和最佳个体，部分排序即可
+                ranked = top_k(scores, max(int(POP_SIZE * 0.05), 3))
+            
+            # 1a. 给上一代用过的变异算子记功 (在爬山改动分数之前)
+            if bandit is not None and lineage:
+                bandit.credit(lineage['ops'], scores[lineage['rows']] - lineage['parent_scores'])
+                stats['operators'] = bandit.state()
+                recorder.set(operators=bandit.summary())
+            lineage = {}
+            
+            # 1b. 精英爬山：原地改进前 k 名 (断点恢复的这一代已经做过)
+            if memetic_k and not resumed:
+                with recorder.phase('memetic'):
+                    memetic = refine_elites(population, scores, ranked, stats, memetic_k, memetic_budget, rng, cfg, model)
+                    if memetic['improved']:
+                        for row in ranked[:memetic_k]:
+                            cache.add(population[row].tobytes(), scores[row])
+                        ranked = top_k(scores, len(ranked))
+                for name in memetic_total: memetic_total[name] += memetic[name]
+                recorder.set(memetic=memetic)
+            
+            # 1c. 迁移：移民 (已带分数) 替换本种群的个体后重新排序
+            if migrate is not None and not resumed:
+                with recorder.phase('migrate'):
+                    replaced = migrate(gen, population, scores)
+                    if len(replaced):
+                        for row in replaced:
+                            cache.add(population[row].tobytes(), scores[row])
+                        ranked = top_k(scores, len(ranked))
+            
+            current_best_score = scores[ranked[0]]
+            best_melody = population[ranked[0]].copy()
             
-            # 交叉
-            child1, child2 = crossover(parent1, parent2)
+            # 2. 停滞检测与自适应
+            if not resumed:
+                update_stats(stats, current_best_score, cfg)
+                # 断点：保存评估完成、stats 已更新的状态
+                if checkpoint_path and checkpoint_every and gen % checkpoint_every == 0:
+                    with recorder.phase('checkpoint'):
+                        save_checkpoint(checkpoint_path, gen, population, scores, stats, rng)
             
-            # 变异 (使用调度器)
-            child1 = mutate_dispatcher(child1, stats['mut_rate'])
-            child2 = mutate_dispatcher(child2, stats['mut_rate'])
+            if recorder.enabled:
+                evaluated = cache.misses - misses
+                eval_time = recorder.record['phases']['evaluate']
+                recorder.set(
+                    evaluated=evaluated,
+                    evals_per_sec=evaluated / eval_time if eval_time > 0 else 0.0,
+                    score={'min': float(scores.min()), 'median': float(np.median(scores)),
+                           'max': float(current_best_score)},
+                    layers=layers,
+                    stag_count=stats['stag_count'], mut_rate=stats['mut_rate'],
+                    cache={'hits': cache.hits, 'misses': cache.misses, 'evictions': cache.evictions},
+                    cataclysm=False,
+                )
             
-            new_pop.extend([child1, child2])
+            # 日志
+            if gen % 20 == 0:
+                memetic_log = (f" | Memetic: {memetic_total['improved']} improved +{memetic_total['gain']:.1f} "
+                               f"/ {memetic_total['evaluations']} evals") if memetic_k else ""
+                ops_log = (" | Ops: " + "/".join(f"{p * 100:.0f}" for p in bandit.probabilities())) if bandit is not None else ""
+                screen_log = (f" | Screen: {screening['candidates'] / screening['generations']:.0f} candidates/gen,"
+                              f" surrogate {screening['seconds']:.2f}s") if screening else ""
+                print(f"Gen {gen:03d} | Best: {current_best_score:.2f} | Stag: {stats['stag_count']} | Mut: {stats['mut_rate']:.2f} | {cache.summary()}{memetic_log}{ops_log}{screen_log}")
             
-        # 截断以防溢出 (如果是奇数)
-        population = new_pop[:POP_SIZE]
+            # 3. 产出快照，检查停止条件
+            snapshot = {
+                'gen': gen,
+                'best_score': float(current_best_score),
+                'best_melody': best_melody.tolist(),
+                'elite': population[ranked].tolist(),
+                'elite_scores': scores[ranked].tolist(),
+                'stats': dict(stats),
+                'elapsed': time.perf_counter() - t0,
+                'stop_reason': None,
+            }
+            snapshot['stop_reason'] = first_triggered(stop, snapshot)
+            yield snapshot
+            if snapshot['stop_reason'] is not None:
+                recorder.end_generation()
+                print(f"Stop at Gen {gen}: {snapshot['stop_reason']!r}")
+                return
+                
+            # 4. 灾难机制 (Cataclysm)
+            if stats['stag_count'] > 50:
+                print(f"  >>> [灭绝] Gen {gen}: 陷入局部最优，重置种群...")
+                with recorder.phase('cataclysm'):
+                    population = cataclysm(population, ranked, rng, cfg, library)
+                stats['stag_count'] = 0
+                recorder.set(cataclysm=True)
+                recorder.end_generation()
+                continue # 跳过本轮
+
+            # 5. 繁殖下一代
+            weights = bandit.probabilities() if bandit is not None else None
+            population = breed(population, scores, ranked, stats['mut_rate'], rng, recorder, cfg, weights,
+                               lineage if bandit is not None else None, brood, model, screening)
+            
+            # 6. 多样性替换：重复和近似重复的后代换成新素材，避免它们占满种群
+            if near_limit:
+                with recorder.phase('diversity'):
+                    replaced = diversify(population, diversity, rng, near_limit, cfg)
+                if lineage:
+                    # 被重写的后代不再代表原来的算子
+                    lineage['ops'][np.isin(lineage['rows'], replaced)] = -1
+                if recorder.enabled:
+                    recorder.set(replaced=len(replaced), diversity=diversity.summary())
+            recorder.end_generation()
+    finally:
+        if evaluator: evaluator.close()
+        recorder.close()
+
+def train(time_budget=None, **kwargs):
+    """
+    跑完整个进化过程 (或直到停止条件触发)，返回最佳旋律。参数同 evolve()。
+    time_budget: 给定秒数时改为限时训练 (见 train_within)，种群规模与代数按实测吞吐自动确定。
+    """
+    if time_budget is not None:
+        best, report = train_within(time_budget, **kwargs)
+        print(format_budget_report(report))
+        return best['best_melody']
+    best = None
+    for snapshot in evolve(**kwargs):
+        best = snapshot
+    return best['best_melody']
+
+def resume_training(checkpoint_path=None, **kwargs):
+    """从最近的断点继续训练 (断点不存在时从头开始)"""
+    return train(checkpoint_path=checkpoint_path, resume=True, **kwargs)
+
+# ==========================================
+# 4. 限时训练 (Time Budget)
+# 先用小种群标定吞吐，再按剩余时间确定种群规模与代数；截止时刻之前一定返回
+# ==========================================
+BUDGET_PILOT_POP = 64       # 第一个标定种群的规模；之后每个取当前规划规模的 BUDGET_PILOT_GROWTH 倍 (至少 4 倍于它)
+BUDGET_PILOT_GROWTH = (0.5, 1.0)  # 第二、第三个标定种群相对当前规划规模的比例
+BUDGET_PILOT_GENS = 4       # 每个标定种群跑几代 (第 0 代含初始化，单独计时)
+BUDGET_MIN_POP = 50         # 剩余时间连这么大的种群都跑不了几代时，直接返回标定阶段的结果
+
+def _timed_evolve(deadline, estimate=0.0, stop=(), **kwargs):
+    """运行 evolve() 直到结束或 Deadline 触发，返回 (最后的快照, 开始时刻, 每代产出快照的时刻)"""
+    start = time.perf_counter()
+    last, marks = None, []
+    for snapshot in evolve(stop=list(stop) + [Deadline(deadline, estimate)], **kwargs):
+        marks.append(time.perf_counter())
+        last = snapshot
+    return last, start, marks
+
+def fit_generation_cost(samples):
+    """
+    按 [(种群规模, 耗时), ...] 最小二乘拟合 耗时 = a + b × 种群规模，返回 (a, b)。
+    只有一个样本或拟合出的斜率不为正 (计时噪声或多进程开销为主) 时，保守地把最大样本的耗时
+    全部算作与规模成正比；截距为负时改为过原点拟合。
+    """
+    sizes, times = np.array(sorted(samples), dtype=float).T
+    if len(set(sizes)) > 1:
+        b, a = np.polyfit(sizes, times, 1)
+        if b > 0:
+            if a >= 0: return float(a), float(b)
+            return 0.0, float(sizes @ times / (sizes @ sizes))
+    return 0.0, float(times[-1] / sizes[-1])
+
+def plan_budget(seconds, first_cost, gen_cost, ratio):
+    """
+    在 seconds 秒内安排一次运行：第 0 代耗时 a0 + b0·P，之后每代 a + b·P，代数 G = ratio·P。
+    解 a0 + b0·P + ratio·P·(a + b·P) = seconds 得到种群规模 P，返回 (P, G)，时间不够时 P 为 0。
+    """
+    (a0, b0), (a, b) = first_cost, gen_cost
+    qa, qb, qc = ratio * b, b0 + ratio * a, a0 - seconds
+    if qc >= 0: return 0, 0
+    pop_size = int((-qb + math.sqrt(qb * qb - 4 * qa * qc)) / (2 * qa))
+    generations = int((seconds - a0 - b0 * pop_size) / (a + b * pop_size))
+    return pop_size, max(generations, 0)
+
+def train_within(seconds, cfg=None, stop=None, recorder=None, library=None, **kwargs):
+    """
+    在 seconds 秒内尽量进化出最好的旋律，其余参数同 evolve() (不支持 resume；代数由预算决定，不能指定 generations)。
+      calibrate  三个标定种群各跑 BUDGET_PILOT_GENS 代，最小二乘拟合每代耗时 = a + b × 种群规模。
+                 小种群的每代耗时以固定开销为主，之后的种群按已有样本的规划结果放大
+                 (见 BUDGET_PILOT_GROWTH)，最后一个接近正式规模，斜率 b 不靠外推
+      plan       按剩余时间解出种群规模 P 与代数 G (G ≈ config.TIME_BUDGET_GEN_RATIO × P)
+      evolve     正式运行 (标定种群的精英作为种子)，Deadline 预计下一代会超时就停止
+    截止时刻为 seconds × (1 - TIME_BUDGET_RESERVE)，标定阶段同样受它约束。
+    返回 (最佳快照, 报告)：报告包含规划结果、实际代数和各阶段占用的时间 (见 format_budget_report)。
+    """
+    t0 = time.perf_counter()
+    if cfg is None: cfg = config
+    if kwargs.pop('resume', False):
+        raise ValueError("限时训练不支持断点恢复")
+    if 'generations' in kwargs:
+        raise ValueError("限时训练的代数由时间预算决定，不能指定 generations")
+    if stop is None: stop = []
+    elif callable(stop): stop = [stop]
+    deadline = t0 + seconds * (1 - cfg.TIME_BUDGET_RESERVE)
+    phases = {}
+
+    # 1. 标定：几个逐步放大的种群，第 0 代与之后每代分别拟合
+    # (标定也挂一个记录器，与正式运行的每代开销一致)
+    pilot_kwargs = dict(kwargs, checkpoint_path=None, generations=BUDGET_PILOT_GENS)
+    best, elites, first, steady = None, [], [], []
+    pop_size = BUDGET_PILOT_POP
+    for growth in BUDGET_PILOT_GROWTH + (None,):
+        snapshot, start, marks = _timed_evolve(deadline, cfg=config.make_config(cfg, POPULATION_SIZE=pop_size),
+                                               recorder=Recorder(), library=library, **pilot_kwargs)
+        if snapshot is None: break
+        if best is None or snapshot['best_score'] > best['best_score']: best = snapshot
+        elites += snapshot['elite']
+        if len(marks) < 2: break
+        first.append((pop_size, marks[0] - start))
+        steady.append((pop_size, (marks[-1] - marks[0]) / (len(marks) - 1)))  # 均值：偶发的慢代也要算进预算
+        if growth is None: break
+        # 按已有样本规划，下一个标定种群取规划规模的 growth 倍
+        planned, _ = plan_budget(deadline - time.perf_counter(), fit_generation_cost(first),
+                                 fit_generation_cost(steady), cfg.TIME_BUDGET_GEN_RATIO)
+        pop_size = max(4 * BUDGET_PILOT_POP, int(planned * growth))
+    t = time.perf_counter()
+    phases['calibrate'] = t - t0
+
+    # 2. 规划：剩余时间内的种群规模与代数
+    report = {'budget': seconds, 'population': 0, 'planned_generations': 0, 'generations': 0, 'stop_reason': None}
+    if len(steady) == len(BUDGET_PILOT_GROWTH) + 1:
+        first_cost, gen_cost = fit_generation_cost(first), fit_generation_cost(steady)
+        pop_size, generations = plan_budget(deadline - t, first_cost, gen_cost, cfg.TIME_BUDGET_GEN_RATIO)
+        report['cost'] = {'first_gen': first_cost, 'per_gen': gen_cost}
+        if pop_size >= BUDGET_MIN_POP and generations >= 1:
+            report.update(population=pop_size, planned_generations=generations)
+    phases['plan'] = time.perf_counter() - t
+
+    # 3. 正式运行，记录器汇总 evolve 内部各阶段的耗时
+    evolve_phases = {}
+    if report['population']:
+        t = time.perf_counter()
+        rec = make_recorder(recorder)
+        forward = rec.callback if rec.enabled else None
+        def accumulate(record):
+            for name, seconds_used in record['phases'].items():
+                evolve_phases[name] = evolve_phases.get(name, 0.0) + seconds_used
+            if forward: forward(record)
+        if rec.enabled: rec.callback = accumulate
+        else: rec = Recorder(callback=accumulate)
+        if library is None and cfg.SEED_LIBRARY is None and elites:
+            library = np.array(elites, dtype=np.uint8)
+        pop_size = report['population']
+        snapshot, start, marks = _timed_evolve(deadline, gen_cost[0] + gen_cost[1] * pop_size, stop,
+                                           cfg=config.make_config(cfg, POPULATION_SIZE=pop_size),
+                                           recorder=rec, library=library, generations=sys.maxsize, **kwargs)
+        report['generations'] = len(marks)
+        if snapshot is not None:
+            report['stop_reason'] = repr(snapshot['stop_reason'])
+            if best is None or snapshot['best_score'] >= best['best_score']: best = snapshot
+            phases['first_gen'] = marks[0] - t          # 初始化 + 第 0 代
+            phases['generations'] = marks[-1] - marks[0]
+        t_end = time.perf_counter()
+        phases['finish'] = t_end - (marks[-1] if marks else t)  # 最后一代之后收尾 (关闭进程池等)
 
-        # 日志
-        if gen % 20 == 0:
-            print(f"Gen {gen:03d} | Best: {current_best_score:.2f} | Stag: {stats['stag_count']} | Mut: {stats['mut_rate']:.2f}")
+    report['best_score'] = best['best_score'] if best else None
+    report['evolve_phases'] = evolve_phases
+    report['phases'] = phases
+    report['elapsed'] = time.perf_counter() - t0
+    report['unused'] = seconds - report['elapsed']
+    return best, report
 
-    return scored_pop[0][1]
+def format_budget_report(report):
+    """限时训练报告的可读形式：规划与实际代数，以及各阶段占预算的比例"""
+    budget = report['budget']
+    share = lambda name, t: f"{name} {t * 1000:.0f}ms ({t / budget:.0%})"
+    lines = [f"Time budget {budget:.2f}s | Used {report['elapsed']:.3f}s ({report['elapsed'] / budget:.1%}) | "
+             f"Pop {report['population']} | Gens {report['generations']}/{report['planned_generations']} planned | "
+             f"Best {report['best_score']}",
+             "  " + " | ".join(share(name, t) for name, t in report['phases'].items())]
+    if report['evolve_phases']:
+        lines.append("  evolve: " + " | ".join(share(name, t) for name, t in
+                                               sorted(report['evolve_phases'].items(), key=lambda item: -item[1])))
+    return "\n".join(lines)
 
 if __name__ == "__main__":
-    final_melody = train()
+    if config.ENGINE == 'beam':
+        from beam_search import train_beam
+        final_melody = train_beam()
+    else:
+        final_melody = train()
     utils.save_melody_to_midi(final_melody, "final_gen_music.mid")
\ No newline at end of file
@@ -0,0 +1,121 @@
+# memetic.py
+# 精英的局部搜索 (Memetic)：每代对前 k 名做有预算的爬山，只接受让分数变高的改动。
+# 邻域覆盖 op_micro_adjust 式的 ±1/±2 半音 (单步或整个长音)、休止/延音切换，
+# 以及逆行 / 倒影 / 动机克隆这些片段算子在每个位置上的确定性版本。
+# 每个邻居用 rescore_delta 增量打分 (与 get_fitness 完全一致)，按一次评估计入预算。
+# 已确认是局部最优的旋律记在 stats['local_optima'] 里 (随断点保存)，之后不再重复爬。
+import hashlib
+import config
+from fitness_function import DEFAULT_MODEL, score_components, rescore_delta
+
+OPTIMA_MEMORY = 64  # 最多记住多少条局部最优旋律
+
+
+def neighbourhood(melody, cfg=config):
+    """当前旋律的全部邻居改动 [(lo, hi, 新的片段), ...]，跳过不改变旋律的改动"""
+    n = len(melody)
+    moves = []
+
+    def add(lo, values):
+        if values != melody[lo:lo + len(values)]:
+            moves.append((lo, lo + len(values), values))
+
+    # 1. 音高微调：单步 ±1/±2，长音整体 ±1/±2
+    i = 0
+    while i < n:
+        j = i + 1
+        while j < n and melody[j] == melody[i]: j += 1
+        if melody[i] > 0:
+            for shift in (-2, -1, 1, 2):
+                pitch = melody[i] + shift
+                if cfg.PITCH_MIN <= pitch <= cfg.PITCH_MAX:
+                    for k in range(i, j): add(k, [pitch])
+                    if j - i > 1: add(i, [pitch] * (j - i))
+        i = j
+
+    # 2. 休止 / 延音切换
+    for i in range(n):
+        if melody[i] > 0: add(i, [0])
+        if i > 0 and melody[i - 1] > 0: add(i, [melody[i - 1]])
+
+    # 3. 片段算子：每个起点上的逆行与倒影 (长度 4)，以及每个乐句第 1 -> 第 3 小节的节奏克隆
+    length = 4
+    for start in range(n - length + 1):
+        segment = melody[start:start + length]
+        add(start, segment[::-1])
+        pivot = segment[0] or 72
+        add(start, [max(cfg.PITCH_MIN, min(cfg.PITCH_MAX, 2 * pivot - p)) if p > 0 else 0 for p in segment])
+    steps_per_bar = cfg.BEATS_PER_BAR * cfg.STEPS_PER_BEAT
+    for start in range(0, n - 3 * steps_per_bar + 1, cfg.PHRASE_BARS * steps_per_bar):
+        bar0 = melody[start:start + steps_per_bar]
+        bar2 = melody[start + 2 * steps_per_bar:start + 3 * steps_per_bar]
+        add(start + 2 * steps_per_bar, [(b2 or b0) if b0 > 0 else 0 for b0, b2 in zip(bar0, bar2)])
+    return moves
+
+
+def hill_climb(melody, budget, rng, cfg=config, model=None, comp=None):
+    """
+    首次改进爬山：按随机顺序尝试邻居，遇到更好的就接受并在新旋律的邻域里接着试，
+    连续一整轮邻居都没有改进 (局部最优) 或评估次数用完时停止。
+    预算小于邻域时，随机顺序保证每代试到的不是同一批邻居。
+    返回 (旋律, 子分数字典, 评估次数, 是否已是局部最优)。
+    """
+    model = model or DEFAULT_MODEL
+    evaluations = 0
+    if comp is None:
+        comp = score_components(melody, model=model)
+        evaluations += 1
+    moves = neighbourhood(melody, cfg)
+    order = rng.permutation(len(moves))
+    k = since = 0
+    while since < len(moves) and evaluations < budget:
+        lo, hi, values = moves[order[k % len(moves)]]
+        k += 1
+        since += 1
+        candidate = melody[:]
+        candidate[lo:hi] = values
+        new_comp = rescore_delta(candidate, comp, lo, hi, model=model)
+        evaluations += 1
+        if new_comp['total'] > comp['total']:
+            melody, comp = candidate, new_comp
+            moves = neighbourhood(melody, cfg)
+            order = rng.permutation(len(moves))
+            k = since = 0
+    return melody, comp, evaluations, since >= len(moves)
+
+
+def _key(melody):
+    return hashlib.blake2b(bytes(melody), digest_size=8).hexdigest()
+
+
+def refine_elites(population, scores, ranked, stats, top_k, budget, rng, cfg=config, model=None):
+    """
+    对 ranked 的前 top_k 个个体爬山，原地更新 population 与 scores。
+    budget 为本代总评估次数，按排名依次使用 (每个精英最好能爬到局部最优并记下来，
+    之后再遇到它就直接跳过，预算留给新出现的精英)。
+    返回 {'evaluations', 'improved', 'gain', 'optima'}。
+    """
+    optima = stats.setdefault('local_optima', [])
+    known = set(optima)
+    result = {'evaluations': 0, 'improved': 0, 'gain': 0.0, 'optima': 0}
+    rows = ranked[:top_k]
+    for row in rows:
+        melody = population[row].tolist()
+        key = _key(melody)
+        if key in known:
+            result['optima'] += 1
+            continue
+        remaining = budget - result['evaluations']
+        if remaining <= 1: break
+        new_melody, comp, evaluations, at_optimum = hill_climb(melody, remaining, rng, cfg, model)
+        result['evaluations'] += evaluations
+        if comp['total'] > scores[row]:
+            result['improved'] += 1
+            result['gain'] += float(comp['total'] - scores[row])
+            population[row] = new_melody
+            scores[row] = comp['total']
+        if at_optimum:
+            optima.append(_key(new_melody))
+            known.add(optima[-1])
+    del optima[:-OPTIMA_MEMORY]
+    return result
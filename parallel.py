@@ -0,0 +1,109 @@
+# parallel.py
+# 多进程并行评估：种群放在共享内存里，常驻进程池按行区间原地打分，
+# 每一代只传递 (start, stop) 两个整数，不再 pickle 整个种群。
+# 配合适应度缓存时只有未命中的旋律会送到这里 (见 FitnessCache.score_batch)，
+# 所以是否值得并行取决于每代的未命中数 × 旋律长度，而不是种群规模。
+import weakref
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+import config
+from fitness_function import get_fitness_batch
+
+
+# 每块至少多少个基因格 (行 × 步) 才值得跨进程调度：一次 map 往返约 0.2~1 ms，
+# 批量打分约 60~150 ns/格，16k 格 (约 1~2 ms) 以下的块调度开销与计算相当。
+# 32 步的旋律对应 512 行，256 步 64 行，4096 步 4 行；不足一块时直接在本进程串行打分。
+MIN_CHUNK_CELLS = 16384
+
+# 子进程内挂载好的共享内存视图 (由 _attach 初始化)
+_worker = {}
+
+
+def _attach(pop_name, score_name, capacity, n_steps, model):
+    """进程池初始化：按名字挂载共享内存，建立 numpy 视图"""
+    pop_shm = shared_memory.SharedMemory(name=pop_name)
+    score_shm = shared_memory.SharedMemory(name=score_name)
+    _worker['shm'] = (pop_shm, score_shm)  # 保持引用，防止被回收
+    _worker['pop'] = np.ndarray((capacity, n_steps), dtype=np.uint8, buffer=pop_shm.buf)
+    _worker['scores'] = np.ndarray((capacity,), dtype=np.float64, buffer=score_shm.buf)
+    _worker['model'] = model
+
+
+def _score_chunk(bounds):
+    """子进程任务：给共享种群的 [start, stop) 行打分，直接写回共享分数区"""
+    start, stop = bounds
+    _worker['scores'][start:stop] = get_fitness_batch(_worker['pop'][start:stop],
+                                                      model=_worker['model'])
+    return stop - start
+
+
+def _release(pool, shms):
+    """关闭进程池并释放共享内存 (close() 或对象被回收时调用)"""
+    pool.terminate()
+    pool.join()
+    for shm in shms:
+        shm.close()
+        shm.unlink()
+
+
+class ParallelEvaluator:
+    """
+    常驻进程池 + 共享内存的批量评估器，调用方式与 get_fitness_batch 相同：
+        scores = evaluator(population)
+    打分逐行独立，所以结果与串行版本逐位一致。
+    model 为适应度模型 (默认 DEFAULT_MODEL)，随初始化参数传给子进程。
+    每批按 workers 均分成连续的块，每块至少 min_chunk 行 (默认按 MIN_CHUNK_CELLS 与旋律长度换算)，
+    所以只有一批的行数达到 2 × min_chunk 时才会用上多个进程。
+    """
+    def __init__(self, workers, capacity=None, n_steps=None, min_chunk=None, model=None):
+        self.workers = workers
+        self.capacity = config.POPULATION_SIZE if capacity is None else capacity
+        self.n_steps = config.TOTAL_STEPS if n_steps is None else n_steps
+        if min_chunk is None: min_chunk = max(1, MIN_CHUNK_CELLS // self.n_steps)
+        self.min_chunk = min_chunk  # 太小的块不值得跨进程调度
+        self.model = model
+
+        pop_bytes = self.capacity * self.n_steps
+        self._pop_shm = shared_memory.SharedMemory(create=True, size=max(pop_bytes, 1))
+        self._score_shm = shared_memory.SharedMemory(create=True, size=max(self.capacity * 8, 1))
+        self._pop = np.ndarray((self.capacity, self.n_steps), dtype=np.uint8, buffer=self._pop_shm.buf)
+        self._scores = np.ndarray((self.capacity,), dtype=np.float64, buffer=self._score_shm.buf)
+
+        self._pool = mp.Pool(workers, initializer=_attach,
+                             initargs=(self._pop_shm.name, self._score_shm.name,
+                                       self.capacity, self.n_steps, model))
+        self._finalizer = weakref.finalize(self, _release, self._pool,
+                                           (self._pop_shm, self._score_shm))
+
+    def _chunks(self, n):
+        """把 n 行切成大约 workers 份连续区间"""
+        size = max(self.min_chunk, -(-n // self.workers))
+        return [(start, min(start + size, n)) for start in range(0, n, size)]
+
+    def __call__(self, population):
+        pop = np.asarray(population, dtype=np.uint8)
+        if pop.ndim != 2 or pop.shape[1] != self.n_steps:
+            raise ValueError(f"population 形状应为 (N, {self.n_steps}), 实际为 {pop.shape}")
+
+        scores = np.empty(len(pop))
+        # 超过共享区容量时分批处理
+        for offset in range(0, len(pop), self.capacity):
+            block = pop[offset:offset + self.capacity]
+            n = len(block)
+            if n <= self.min_chunk:
+                scores[offset:offset + n] = get_fitness_batch(block, model=self.model)
+                continue
+            self._pop[:n] = block
+            self._pool.map(_score_chunk, self._chunks(n))
+            scores[offset:offset + n] = self._scores[:n]
+        return scores
+
+    def close(self):
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
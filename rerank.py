@@ -0,0 +1,111 @@
+# rerank.py
+# 移调复用：适应度只依赖相对主音的音级，旋律移调 s 个半音后在 KEY + s 调上的分数与原来完全相同
+# (见 fitness_function.FitnessModel)。所以进化一次的种群不必为每个调重新训练：
+#   对每个和弦进行，把种群的 12 种移位 (-6..+5 半音) 叠成一块，在 config.KEY 上一次批量打分，
+#   得到 scores[移位, 个体]。目标调 k 的排名与 k 无关，只需把选中的旋律再整体移到 k
+#   (差一个八度不影响分数，折叠到离原音区最近的 -6..+5)。
+# 换调是精确的；换和弦进行时挑出的只是现有种群里最合适的旋律，比专门在该进行上进化的结果差，
+# 但作为种子库 (main.evolve(library=...)) 能让新进行上的短程训练起步更快。
+#   python rerank.py checkpoint.npz --top 3 -o rerank_out      (也可以给 MIDI 目录，按 library.py 读入)
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import config
+import utils
+from fitness_function import FitnessModel, get_fitness_batch
+
+KEY_NAMES = ('C', 'C#', 'D', 'Eb', 'E', 'F', 'F#', 'G', 'Ab', 'A', 'Bb', 'B')
+SHIFTS = np.arange(-6, 6)
+
+
+def fold(shift):
+    """移调量折叠到 -6..+5 (差整八度的移调分数相同)"""
+    return (shift + 6) % 12 - 6
+
+
+def shifted_scores(population, chords, cfg=config):
+    """
+    种群的 12 种移位在和弦进行 chords 上的分数 (cfg.KEY 调)，返回 (12, n)。
+    移位后超出 MIDI 音域的组合记为 -inf。
+    """
+    pop = np.asarray(population, dtype=np.int16)
+    moved = np.where(pop > 0, pop[None] + SHIFTS[:, None, None], 0)
+    valid = ((moved >= 0) & (moved <= 127)).all(axis=2)
+    moved = np.clip(moved, 0, 127).astype(np.uint8).reshape(-1, pop.shape[1])
+    scores = get_fitness_batch(moved, model=FitnessModel(cfg, chords=chords)).reshape(len(SHIFTS), len(pop))
+    return np.where(valid, scores, -np.inf)
+
+
+def rerank(population, progressions=None, keys=None, top=1, cfg=config):
+    """
+    为每个 (目标调, 和弦进行) 挑出种群里最好的 top 条旋律 (已移到目标调)。
+    population:   (n, TOTAL_STEPS) 旋律，按 cfg.KEY 进化得到
+    progressions: 和弦进行名称列表或 {名称: 和弦列表}，默认 config.PROGRESSIONS 全部
+    keys:         目标调的主音音级列表，默认 12 个调
+    返回 {(key, 名称): [{'score', 'melody', 'row', 'shift'}, ...]}，按分数降序；
+    row 为旋律在 population 中的行号，shift 为相对原旋律的移调半音数。
+    """
+    if progressions is None: progressions = cfg.PROGRESSIONS
+    if not isinstance(progressions, dict):
+        progressions = {name: cfg.PROGRESSIONS[name] for name in progressions}
+    if keys is None: keys = range(12)
+    pop, rows = np.unique(np.asarray(population, dtype=np.uint8), axis=0, return_index=True)
+
+    result = {}
+    for name, chords in progressions.items():
+        scores = shifted_scores(pop, chords, cfg).ravel()
+        k = min(top, int(np.isfinite(scores).sum()))
+        best = np.argpartition(-scores, k - 1)[:k] if k else np.empty(0, dtype=np.int64)
+        best = best[np.argsort(-scores[best], kind='stable')]
+        for key in keys:
+            entries = []
+            for flat in best.tolist():
+                j, i = divmod(flat, len(pop))
+                shift = int(fold(SHIFTS[j] + key - cfg.KEY))
+                entries.append({'score': float(scores[flat]), 'melody': utils.transpose(pop[i], shift).tolist(),
+                                'row': int(rows[i]), 'shift': shift})
+            result[(key, name)] = entries
+    return result
+
+
+def load_population(source, cfg=config):
+    """断点文件 (.npz，见 checkpoint.py) 或 MIDI 目录 (见 library.py) -> (n, TOTAL_STEPS) uint8"""
+    if os.path.isdir(source):
+        from library import load_library
+        return load_library(source, cfg)[0]
+    from checkpoint import load_checkpoint
+    return load_checkpoint(source)[1]
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="把进化好的种群移调到 12 个调、按不同和弦进行重新排名")
+    parser.add_argument('source', help="断点文件 (.npz) 或 MIDI 目录")
+    parser.add_argument('--progressions', nargs='+', choices=sorted(config.PROGRESSIONS),
+                        help="和弦进行 (默认全部)")
+    parser.add_argument('--keys', nargs='+', choices=KEY_NAMES, help="目标调 (默认 12 个调)")
+    parser.add_argument('--top', type=int, default=1, help="每个 (调, 和弦进行) 保留几条")
+    parser.add_argument('-o', '--output', help="导出 MIDI 的目录 (伴奏按各自的调和和弦进行)")
+    args = parser.parse_args(argv)
+
+    population = load_population(args.source)
+    keys = None if args.keys is None else [KEY_NAMES.index(k) for k in args.keys]
+    t0 = time.perf_counter()
+    result = rerank(population, args.progressions, keys, args.top)
+    print(f"Reranked {len(population)} melodies for {len(result)} key/progression pairs "
+          f"in {time.perf_counter() - t0:.2f}s")
+
+    for (key, name), entries in result.items():
+        if not entries: continue
+        print(f"  {KEY_NAMES[key]:>2} {name:<10} Best {entries[0]['score']:.2f} "
+              f"(row {entries[0]['row']}, shift {entries[0]['shift']:+d})")
+        if args.output:
+            utils.export_melodies([e['melody'] for e in entries], args.output,
+                                  names=[f"{KEY_NAMES[key]}_{name}_{rank + 1}.mid" for rank in range(len(entries))],
+                                  key=key, chords=config.PROGRESSIONS[name])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
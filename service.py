@@ -0,0 +1,280 @@
+# service.py
+# 常驻旋律服务：后台进程里的种群一直在进化 (main.evolve 不设代数上限)，
+# 每代把前几名通过队列发给服务进程；asyncio 服务器只读最新快照，请求随到随答，从不等待进化。
+#   GET /best            当前最佳旋律 (MIDI)
+#   GET /sample?k=10     从前 k 名里随机挑一条 (MIDI)
+#   GET /metrics         进化吞吐、请求数与延迟 (JSON)
+# MIDI 请求支持 ?tempo=；响应头 X-Score / X-Generation / X-Population 给出旋律来源。
+#   python service.py --port 8765 --populations 2
+#   python service.py --unix /tmp/melody.sock      (curl --unix-socket /tmp/melody.sock http://x/best)
+import argparse
+import asyncio
+import collections
+import contextlib
+import json
+import multiprocessing as mp
+import os
+import queue
+import random
+import sys
+import time
+from urllib.parse import urlsplit, parse_qs
+import config
+import main
+import utils
+
+
+def _population_main(pop_id, seed, snapshots):
+    """单个常驻种群 (运行在子进程中)：无限进化，每代把精英发给服务进程"""
+    random.seed(seed + pop_id)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):  # 后台进程不刷屏
+        for snapshot in main.evolve(generations=sys.maxsize, workers=0,
+                                    recorder=None, checkpoint_path=None):
+            message = (pop_id, snapshot['gen'], snapshot['elapsed'],
+                       snapshot['elite'], snapshot['elite_scores'])
+            try:
+                snapshots.put_nowait(message)
+            except queue.Full:
+                pass  # 服务进程来不及取时丢掉这一代，下一代的快照更新
+
+
+class _Latency:
+    """最近 window 次请求的耗时 (秒)"""
+    def __init__(self, window=1000):
+        self.count = 0
+        self.samples = collections.deque(maxlen=window)
+
+    def add(self, seconds):
+        self.count += 1
+        self.samples.append(seconds)
+
+    def summary(self):
+        if not self.samples:
+            return {'count': self.count}
+        ms = sorted(s * 1000 for s in self.samples)
+        pick = lambda q: ms[min(int(q * len(ms)), len(ms) - 1)]
+        return {'count': self.count, 'p50_ms': pick(0.5), 'p99_ms': pick(0.99), 'max_ms': ms[-1]}
+
+
+class MelodyService:
+    """
+    用法：
+        service = MelodyService(populations=2)
+        asyncio.run(service.serve(port=8765))
+    """
+
+    def __init__(self, populations=None, seed=0, sample_k=None, render_cache=256):
+        self.populations = config.SERVICE_POPULATIONS if populations is None else populations
+        self.seed = seed
+        self.sample_k = config.SERVICE_SAMPLE_K if sample_k is None else sample_k
+        self._render_cache_size = render_cache
+        self._render_cache = collections.OrderedDict()
+        self._render_hits = self._render_misses = 0
+        self._latest = {}   # pop_id -> (gen, elapsed, elite, elite_scores)
+        self._snapshots_received = 0
+        self._latency = collections.defaultdict(_Latency)
+        self._rng = random.Random(seed)
+        self._procs = []
+        self._queue = None
+        self._t0 = time.perf_counter()
+
+    # ---------- 后台种群 ----------
+    def start(self):
+        """启动后台种群进程"""
+        self._queue = mp.Queue(maxsize=16 * self.populations)
+        self._procs = [mp.Process(target=_population_main, args=(i, self.seed, self._queue), daemon=True)
+                       for i in range(self.populations)]
+        for p in self._procs: p.start()
+
+    def stop(self):
+        for p in self._procs:
+            p.terminate()
+            p.join()
+        self._procs = []
+
+    async def _drain(self):
+        """在线程池里阻塞读队列，事件循环只负责把快照换上去"""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                pop_id, gen, elapsed, elite, elite_scores = await loop.run_in_executor(
+                    None, self._queue.get, True, 0.5)
+            except queue.Empty:
+                continue
+            self._latest[pop_id] = (gen, elapsed, elite, elite_scores)
+            self._snapshots_received += 1
+
+    async def wait_ready(self):
+        """等到每个种群都发来第一份快照"""
+        while len(self._latest) < self.populations:
+            await asyncio.sleep(0.05)
+
+    # ---------- 查询 ----------
+    def ranked(self, k):
+        """所有种群当前精英中的前 k 名：[(分数, 种群编号, 代数, 旋律), ...]"""
+        pool = [(score, pop_id, gen, melody)
+                for pop_id, (gen, _, elite, scores) in self._latest.items()
+                for score, melody in zip(scores, elite)]
+        pool.sort(key=lambda item: -item[0])
+        return pool[:k]
+
+    def render(self, melody, tempo):
+        """渲染 MIDI bytes；同一旋律连续被请求时直接复用 (LRU)"""
+        key = (bytes(melody), tempo)
+        data = self._render_cache.get(key)
+        if data is not None:
+            self._render_hits += 1
+            self._render_cache.move_to_end(key)
+            return data
+        self._render_misses += 1
+        data = utils.melody_to_midi_bytes(melody, tempo)
+        self._render_cache[key] = data
+        if len(self._render_cache) > self._render_cache_size:
+            self._render_cache.popitem(last=False)
+        return data
+
+    def metrics(self):
+        populations = []
+        for pop_id in range(self.populations):
+            entry = {'id': pop_id, 'alive': pop_id < len(self._procs) and self._procs[pop_id].is_alive()}
+            if pop_id in self._latest:
+                gen, elapsed, _, scores = self._latest[pop_id]
+                gens_per_sec = (gen + 1) / elapsed if elapsed > 0 else 0.0
+                entry.update(gen=gen, best_score=scores[0], gens_per_sec=gens_per_sec,
+                             melodies_per_sec=gens_per_sec * config.POPULATION_SIZE)
+            populations.append(entry)
+        best = self.ranked(1)
+        return {
+            'uptime': time.perf_counter() - self._t0,
+            'best_score': best[0][0] if best else None,
+            'populations': populations,
+            'snapshots_received': self._snapshots_received,
+            'render_cache': {'hits': self._render_hits, 'misses': self._render_misses},
+            'requests': {path: latency.summary() for path, latency in sorted(self._latency.items())},
+        }
+
+    # ---------- HTTP ----------
+    def handle(self, method, target):
+        """处理一个请求，返回 (状态码, Content-Type, 额外响应头, body)"""
+        url = urlsplit(target)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        if method != 'GET':
+            return 405, 'text/plain', {}, b'method not allowed\n'
+        if url.path == '/metrics':
+            return 200, 'application/json', {}, json.dumps(self.metrics()).encode()
+        if url.path not in ('/best', '/sample'):
+            return 404, 'text/plain', {}, b'not found\n'
+        try:
+            tempo = int(query.get('tempo', 80))
+            k = 1 if url.path == '/best' else int(query.get('k', self.sample_k))
+        except ValueError:
+            return 400, 'text/plain', {}, b'tempo and k must be integers\n'
+        if k < 1 or not 1 <= tempo <= 1000:
+            return 400, 'text/plain', {}, b'k must be >= 1 and tempo in 1..1000\n'
+        candidates = self.ranked(k)
+        if not candidates:
+            return 503, 'text/plain', {'Retry-After': '1'}, b'population not ready\n'
+        score, pop_id, gen, melody = candidates[0] if k == 1 else self._rng.choice(candidates)
+        headers = {'X-Score': f'{score:.2f}', 'X-Generation': str(gen), 'X-Population': str(pop_id)}
+        return 200, 'audio/midi', headers, self.render(melody, tempo)
+
+    async def _serve_client(self, reader, writer):
+        """HTTP/1.1，支持 keep-alive"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                t = time.perf_counter()
+                parts = request_line.decode('latin-1').split()
+                if len(parts) != 3:
+                    status, ctype, extra, body = 400, 'text/plain', {}, b'bad request\n'
+                    path = 'other'
+                else:
+                    method, target, version = parts
+                    status, ctype, extra, body = self.handle(method, target)
+                    # 延迟统计只按已知路由分组，其余 (任意路径) 都归入 other，避免统计表无限增长
+                    path = urlsplit(target).path
+                    if path not in ROUTES: path = 'other'
+                close = len(parts) != 3 or headers.get('connection', '').lower() == 'close' \
+                        or (parts[2] == 'HTTP/1.0' and headers.get('connection', '').lower() != 'keep-alive')
+
+                head = [f"HTTP/1.1 {status} {_REASONS.get(status, '')}",
+                        f"Content-Type: {ctype}", f"Content-Length: {len(body)}",
+                        f"Connection: {'close' if close else 'keep-alive'}"]
+                head += [f"{name}: {value}" for name, value in extra.items()]
+                writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+                await writer.drain()
+                self._latency[path].add(time.perf_counter() - t)
+                if close:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            pass  # 服务关闭时仍保持连接 (keep-alive) 的客户端
+        finally:
+            writer.close()
+
+    async def serve(self, host=None, port=None, unix_path=None, ready=None):
+        """
+        启动后台种群并开始监听 (unix_path 不为 None 时监听 Unix socket)，直到被取消。
+        ready: 可选的 asyncio.Event，开始监听后置位。
+        """
+        self.start()
+        drain = asyncio.create_task(self._drain())
+        listening = None  # 自己创建的 Unix socket 文件，退出时删除
+        try:
+            if unix_path:
+                server = await asyncio.start_unix_server(self._serve_client, path=unix_path)
+                listening = unix_path
+            else:
+                server = await asyncio.start_server(
+                    self._serve_client,
+                    config.SERVICE_HOST if host is None else host,
+                    config.SERVICE_PORT if port is None else port)
+            async with server:
+                for sock in server.sockets:
+                    print(f"Melody service listening on {sock.getsockname()} | "
+                          f"{self.populations} population(s)")
+                if ready is not None: ready.set()
+                await server.serve_forever()
+        finally:
+            drain.cancel()
+            self.stop()
+            if listening:
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(listening)
+
+
+ROUTES = ('/best', '/sample', '/metrics')
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+            405: 'Method Not Allowed', 503: 'Service Unavailable'}
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="常驻旋律服务：后台持续进化，请求即时返回 MIDI")
+    parser.add_argument('--host', help=f"监听地址 (默认 {config.SERVICE_HOST})")
+    parser.add_argument('--port', type=int, help=f"端口 (默认 {config.SERVICE_PORT})")
+    parser.add_argument('--unix', metavar='PATH', help="改为监听 Unix socket")
+    parser.add_argument('--populations', type=int, help="后台种群数 (默认 config.SERVICE_POPULATIONS)")
+    parser.add_argument('--seed', type=int, default=0, help="随机种子")
+    args = parser.parse_args(argv)
+
+    service = MelodyService(populations=args.populations, seed=args.seed)
+    try:
+        asyncio.run(service.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,339 @@
+# sparse.py
+# 稀疏音符表示：一条旋律是按起始步排序、互不重叠的 (N, 3) int32 数组，每行 (onset, pitch, duration)。
+# 相邻且同音高的音符会被合并 (与逐步基因里的连音含义相同)，休止符不占行。
+# 适应度、变异/交叉算子和 MIDI 导出都直接在音符上计算，开销随音符数 (和小节数) 增长，
+# 与网格长度无关，适合 64~256 小节、16 分音符精度的长曲子。
+# 打分与 fitness_function.get_fitness(to_dense(notes, n_steps), model=model) 完全一致。
+import bisect
+import itertools
+from functools import lru_cache
+import numpy as np
+import config
+import utils
+from fitness_function import DEFAULT_MODEL, groove_table, _motif_score
+
+ONSET, PITCH, DURATION = 0, 1, 2
+
+# random_notes 使用的时值 (步数) 与权重
+DURATIONS = np.array([1, 2, 3, 4, 6, 8])
+DURATION_WEIGHTS = np.array([0.25, 0.3, 0.1, 0.2, 0.05, 0.1])
+
+
+# ==========================================
+# 1. 转换 (Dense <-> Sparse)
+# ==========================================
+
+def empty_notes():
+    return np.empty((0, 3), dtype=np.int32)
+
+
+def from_dense(melody, offset=0):
+    """逐步基因 -> 音符数组 (连续的同音高步合并为一个音符)。offset 加到所有起始步上"""
+    m = np.asarray(melody, dtype=np.int32)
+    if len(m) == 0: return empty_notes()
+    prev = np.r_[0, m[:-1]]
+    nxt = np.r_[m[1:], 0]
+    starts = np.flatnonzero((m > 0) & (m != prev))
+    ends = np.flatnonzero((m > 0) & (m != nxt)) + 1
+    return np.column_stack([starts + offset, m[starts], ends - starts]).astype(np.int32)
+
+
+def to_dense(notes, n_steps=config.TOTAL_STEPS, lo=0, hi=None):
+    """音符数组 -> 逐步基因的 [lo, hi) 区间 (uint8)。只遍历与区间重叠的音符"""
+    if hi is None: hi = n_steps
+    out = np.zeros(hi - lo, dtype=np.uint8)
+    notes = window_notes(notes, lo, hi)
+    if len(notes):
+        start = np.maximum(notes[:, ONSET], lo) - lo
+        stop = np.minimum(notes[:, ONSET] + notes[:, DURATION], hi) - lo
+        length = stop - start
+        pos = np.arange(length.sum()) - np.repeat(np.cumsum(length) - length, length) + np.repeat(start, length)
+        out[pos] = np.repeat(notes[:, PITCH], length)
+    return out
+
+
+def window_notes(notes, lo, hi):
+    """与 [lo, hi) 有重叠的音符 (二分查找，不扫描整条旋律)"""
+    first = np.searchsorted(notes[:, ONSET] + notes[:, DURATION], lo, side='right')
+    last = np.searchsorted(notes[:, ONSET], hi, side='left')
+    return notes[first:last]
+
+
+def normalize(notes):
+    """排序、丢掉空音符、合并首尾相接的同音高音符，得到规范形式"""
+    notes = np.asarray(notes, dtype=np.int32).reshape(-1, 3)
+    notes = notes[notes[:, DURATION] > 0]
+    notes = notes[np.argsort(notes[:, ONSET], kind='stable')]
+    if len(notes) < 2: return notes
+    end = notes[:, ONSET] + notes[:, DURATION]
+    joined = (notes[1:, PITCH] == notes[:-1, PITCH]) & (notes[1:, ONSET] == end[:-1])
+    if not joined.any(): return notes
+    heads = np.flatnonzero(np.r_[True, ~joined])
+    merged = notes[heads].copy()
+    merged[:, DURATION] = np.add.reduceat(notes[:, DURATION], heads)
+    return merged
+
+
+def splice(notes, lo, hi, segment):
+    """把 [lo, hi) 区间替换成逐步基因 segment，跨边界的音符在边界处截断，返回规范形式"""
+    onset, end = notes[:, ONSET], notes[:, ONSET] + notes[:, DURATION]
+    first = np.searchsorted(end, lo, side='right')
+    last = np.searchsorted(onset, hi, side='left')
+    parts = [notes[:first]]
+    if first < last:
+        crossing = notes[first:last]
+        c_on, c_end = crossing[:, ONSET], crossing[:, ONSET] + crossing[:, DURATION]
+        head = crossing[c_on < lo].copy()
+        head[:, DURATION] = lo - head[:, ONSET]
+        tail = crossing[c_end > hi].copy()
+        tail[:, DURATION] = tail[:, ONSET] + tail[:, DURATION] - hi
+        tail[:, ONSET] = hi
+        parts += [head, from_dense(segment, lo), tail]
+    else:
+        parts.append(from_dense(segment, lo))
+    parts.append(notes[last:])
+    return normalize(np.concatenate(parts))
+
+
+def random_notes(n_steps=config.TOTAL_STEPS, rng=None, cfg=config):
+    """随机生成长度为 n_steps 的音符数组：时值取自 DURATIONS，每个时值格子以 REST_PROB 的概率为休止"""
+    if rng is None: rng = np.random.default_rng()
+    n_slots = n_steps // int(DURATIONS.min()) + 1
+    durations = rng.choice(DURATIONS, n_slots, p=DURATION_WEIGHTS / DURATION_WEIGHTS.sum())
+    onsets = np.cumsum(durations) - durations
+    keep = onsets < n_steps
+    onsets, durations = onsets[keep], np.minimum(durations[keep], n_steps - onsets[keep])
+    pitches = rng.integers(cfg.PITCH_MIN, cfg.PITCH_MAX + 1, len(onsets))
+    sounding = rng.random(len(onsets)) >= cfg.REST_PROB
+    return normalize(np.column_stack([onsets, pitches, durations])[sounding])
+
+
+# ==========================================
+# 2. 适应度 (与 get_fitness 的每一层一一对应，查同一个 FitnessModel 的表)
+# 逐步基因里每个有音的步都是一个 event，延音就是重复的 event；
+# 这里按音符整段计算，音符内部的重复 event 用闭式计数代替逐步遍历。
+# ==========================================
+
+def _crossings(onset, end, period):
+    """
+    每个音符内部跨过的 period 倍数边界 B (onset < B < end)。
+    返回 (音符下标, B) 两个数组；一个音符可能跨过多条边界。
+    """
+    first = (onset // period + 1) * period
+    count = np.maximum((end - 1 - first) // period + 1, 0)
+    idx = np.repeat(np.arange(len(onset)), count)
+    k = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+    return idx, first[idx] + k * period
+
+
+@lru_cache(maxsize=None)
+def _harmony_prefix(model):
+    """和声表按步的前缀和 (period + 1, 128)：prefix[k, p] = 前 k 步上音高 p 的和声分之和"""
+    prefix = np.zeros((model.period + 1, 128), dtype=np.int64)
+    np.cumsum(model.harmony, axis=0, out=prefix[1:])
+    return prefix
+
+
+def _sparse_melodic_flow(onset, pitch, dur, end, crossing, model):
+    if dur.sum() < 2: return 0
+    interval, inertia, member, period = model.interval, model.inertia, model.member, model.period
+    # 1. 音程：音符内部的重复音 (音程 0) + 相邻音符之间
+    d = pitch[1:] - pitch[:-1]
+    score = int(interval[0]) * int((dur - 1).sum()) + int(interval[np.abs(d)].sum())
+
+    # 2. 惯性与大跳补偿：连续三个 event 的两个音程 (d1, d2)，按三个 event 落在哪些音符里分四类
+    held = dur > 1
+    score += int(inertia[127, 127]) * int(np.maximum(dur - 2, 0).sum())   # 同一音符内的三步: (0, 0)
+    score += int(inertia[127, d[held[:-1]] + 127].sum())                   # 音符的最后两步 + 下一个音: (0, d)
+    score += int(inertia[d[held[1:]] + 127, 127].sum())                    # 跳进一个至少两步长的音符: (d, 0)
+    single = ~held[1:-1]
+    score += int(inertia[d[:-1][single] + 127, d[1:][single] + 127].sum())  # 经过单步音符的两次跳进: (d, d')
+
+    # 3. 张力解决：相邻音符之间 (前一个音的最后一步 -> 下一个音的起点)，
+    # 以及同一个音符跨小节 (和弦变了) 的前后两步
+    resolved = (~member[(end[:-1] - 1) % period, pitch[:-1]] & (np.abs(d) <= 2)
+                & member[onset[1:] % period, pitch[1:]])
+    idx, boundary = crossing
+    held_over = ~member[(boundary - 1) % period, pitch[idx]] & member[boundary % period, pitch[idx]]
+    return score + 30 * (int(resolved.sum()) + int(held_over.sum()))
+
+
+def _sparse_harmonic_quality(onset, pitch, end, model):
+    """每个音符覆盖的各步和声分之和 = 前缀和之差 (整周期部分乘周期数)"""
+    prefix, period = _harmony_prefix(model), model.period
+    def upto(x):
+        return (x // period) * prefix[period, pitch] + prefix[x % period, pitch]
+    return int((upto(end) - upto(onset)).sum())
+
+
+def _sparse_bar_masks(onset, crossing, n_steps, steps_per_bar):
+    """每个小节的起奏掩码：音符起点 + 被延续进来的小节首位"""
+    n_bars = -(-n_steps // steps_per_bar)
+    _, boundary = crossing
+    bars = np.concatenate([onset // steps_per_bar, boundary // steps_per_bar])
+    bits = np.concatenate([np.left_shift(1, onset % steps_per_bar), np.ones(len(boundary), dtype=np.int64)])
+    return np.bincount(bars, weights=bits, minlength=n_bars).astype(np.int64)
+
+
+def _sparse_rhythm_groove(masks, n_steps, model):
+    """逐小节查律动表，按小节顺序累加 (与 fit_rhythm_groove 的浮点求和顺序相同)"""
+    steps_per_bar = model.steps_per_bar
+    values = model.groove[masks[:n_steps // steps_per_bar]].tolist()
+    rest = n_steps % steps_per_bar
+    if rest:
+        values.append(groove_table(rest)[masks[-1]])
+    return sum(values)
+
+
+def _sparse_structure_coherence(onset, pitch, end, masks, n_steps, model):
+    steps_per_bar, phrase_bars = model.steps_per_bar, model.phrase_bars
+    # 1. 终止式 (最后一个音符)
+    score = model.cadence_list[pitch[-1]]
+    # 2. 问答结构：每个乐句第 2 小节内最后一个 event 所在的音符
+    # (乐句第 2 小节结束前起奏的最后一个音符，且要延续到第 2 小节之内)
+    starts = np.arange(0, len(masks), phrase_bars) * steps_per_bar
+    k = np.searchsorted(onset, starts + 2 * steps_per_bar) - 1
+    last = np.maximum(k, 0)
+    question = (k >= 0) & (end[last] > starts + steps_per_bar) & model.half_cadence[pitch[last]]
+    score += 15 * int(question.sum())
+    # 3. 动机重复：每个乐句第 1 与第 3 小节的起奏型
+    for first in range(0, len(masks) - 2, phrase_bars):
+        len0 = min(steps_per_bar, n_steps - first * steps_per_bar)
+        len2 = min(steps_per_bar, n_steps - (first + 2) * steps_per_bar)
+        score += _motif_score(int(masks[first]), int(masks[first + 2]), len0, len2)
+    return score
+
+
+def get_fitness_notes(notes, n_steps=config.TOTAL_STEPS, weights=None, model=None):
+    """
+    音符数组的适应度，等于 get_fitness(to_dense(notes, n_steps), weights, model)。
+    notes 须为规范形式 (见 normalize)，且全部落在 [0, n_steps) 内。
+    """
+    if len(notes) == 0: return -9999
+    model = model or DEFAULT_MODEL
+    onset = notes[:, ONSET].astype(np.int64)
+    pitch = notes[:, PITCH].astype(np.int64)
+    dur = notes[:, DURATION].astype(np.int64)
+    end = onset + dur
+
+    crossing = _crossings(onset, end, model.steps_per_bar)
+    masks = _sparse_bar_masks(onset, crossing, n_steps, model.steps_per_bar)
+    s_melody    = _sparse_melodic_flow(onset, pitch, dur, end, crossing, model)
+    s_harmony   = _sparse_harmonic_quality(onset, pitch, end, model)
+    s_rhythm    = _sparse_rhythm_groove(masks, n_steps, model)
+    s_structure = _sparse_structure_coherence(onset, pitch, end, masks, n_steps, model)
+
+    w_melody, w_harmony, w_rhythm, w_structure = model.weights if weights is None else weights
+    return (w_melody * s_melody) + \
+           (w_harmony * s_harmony) + \
+           (w_rhythm * s_rhythm) + \
+           (w_structure * s_structure)
+
+
+# ==========================================
+# 3. 算子 (Operators)
+# 每个算子接收 (notes, n_steps, rng)，返回新的规范音符数组，不修改输入。
+# 需要逐步语义的算子只把受影响的小窗口展开成网格，处理完再拼回去。
+# ==========================================
+
+def op_micro_adjust_notes(notes, n_steps, rng, cfg=config):
+    """微调：随机一个音符整体上下移动 1-2 个半音"""
+    if len(notes) == 0: return notes
+    k = rng.integers(len(notes))
+    new = notes[k, PITCH] + rng.choice([-2, -1, 1, 2])
+    if not cfg.PITCH_MIN <= new <= cfg.PITCH_MAX: return notes
+    out = notes.copy()
+    out[k, PITCH] = new
+    return normalize(out)
+
+
+def op_shadow_echo_notes(notes, n_steps, rng, cfg=config):
+    """回声：从前往后第一个"后面是空拍"且掷中 30% 的音符，延长一步"""
+    if len(notes) == 0: return notes
+    end = notes[:, ONSET] + notes[:, DURATION]
+    next_onset = np.r_[notes[1:, ONSET], n_steps]
+    trigger = np.flatnonzero((end < next_onset) & (rng.random(len(notes)) < 0.3))
+    if len(trigger) == 0: return notes
+    out = notes.copy()
+    out[trigger[0], DURATION] += 1
+    return normalize(out)
+
+
+def op_rhythm_clone_notes(notes, n_steps, rng, cfg=config):
+    """动机克隆：随机一个乐句 (PHRASE_BARS 小节)，把第 1 小节的节奏复制到第 3 小节"""
+    steps_per_bar = cfg.BEATS_PER_BAR * cfg.STEPS_PER_BEAT
+    n_bars = n_steps // steps_per_bar
+    if n_bars < 3: return notes
+    n_phrases = (n_bars - 3) // cfg.PHRASE_BARS + 1   # 与 main._clone_phrases 相同
+    lo = int(rng.integers(n_phrases)) * cfg.PHRASE_BARS * steps_per_bar
+    bar0 = to_dense(notes, n_steps, lo, lo + steps_per_bar)
+    bar2 = to_dense(notes, n_steps, lo + 2 * steps_per_bar, lo + 3 * steps_per_bar)
+    fill = (bar0 > 0) & (bar2 == 0)
+    bar2[fill] = rng.choice(utils.scale_pitches(cfg), int(fill.sum()))
+    bar2[bar0 == 0] = 0
+    return splice(notes, lo + 2 * steps_per_bar, lo + 3 * steps_per_bar, bar2)
+
+
+def op_retrograde_segment_notes(notes, n_steps, rng, cfg=config, length=4):
+    """局部逆行：随机 4 步倒着放"""
+    lo = int(rng.integers(0, n_steps - length + 1))
+    segment = to_dense(notes, n_steps, lo, lo + length)
+    return splice(notes, lo, lo + length, segment[::-1])
+
+
+def op_inversion_segment_notes(notes, n_steps, rng, cfg=config, length=4):
+    """局部倒影：以这 4 步的第一个音为轴镜像翻转"""
+    lo = int(rng.integers(0, n_steps - length + 1))
+    segment = to_dense(notes, n_steps, lo, lo + length).astype(np.int16)
+    pivot = segment[0] if segment[0] > 0 else 72 # 默认轴
+    mirrored = np.clip(2 * pivot - segment, cfg.PITCH_MIN, cfg.PITCH_MAX)
+    return splice(notes, lo, lo + length, np.where(segment > 0, mirrored, segment))
+
+
+def op_random_reset_notes(notes, n_steps, rng, cfg=config):
+    """重置：换成全新的随机音符"""
+    return random_notes(n_steps, rng, cfg)
+
+
+SPARSE_STRATEGIES = [
+    (op_micro_adjust_notes,       0.50),
+    (op_shadow_echo_notes,        0.20),
+    (op_rhythm_clone_notes,       0.10),
+    (op_retrograde_segment_notes, 0.05),
+    (op_inversion_segment_notes,  0.05),
+    (op_random_reset_notes,       0.10),
+]
+SPARSE_CUMULATIVE = list(itertools.accumulate(weight for _, weight in SPARSE_STRATEGIES))
+
+
+def mutate_notes(notes, rate, n_steps, rng, cfg=config):
+    """变异调度器：以 rate 的概率变异，按轮盘赌选一种算子"""
+    if rng.random() > rate: return notes
+    k = bisect.bisect_right(SPARSE_CUMULATIVE, rng.random())
+    if k >= len(SPARSE_STRATEGIES): return notes
+    return SPARSE_STRATEGIES[k][0](notes, n_steps, rng, cfg)
+
+
+def crossover_notes(a, b, n_steps, rng):
+    """单点交叉：切点前取 a、切点后取 b (以及反过来)，跨切点的音符被截断"""
+    point = int(rng.integers(1, n_steps))
+    def cut(head, tail):
+        prefix = splice(head, point, n_steps, np.zeros(0, dtype=np.uint8))
+        suffix = splice(tail, 0, point, np.zeros(0, dtype=np.uint8))
+        return normalize(np.concatenate([prefix, suffix]))
+    return cut(a, b), cut(b, a)
+
+
+# ==========================================
+# 4. MIDI 导出
+# ==========================================
+
+def notes_to_midi_bytes(notes, n_steps=config.TOTAL_STEPS, tempo=80, key=None, chords=None, cfg=config):
+    """音符数组直接渲染成 MIDI bytes (和弦伴奏铺满整首)，不展开成逐步基因"""
+    triples = [(p, o, d) for o, p, d in notes.tolist()]
+    return utils.notes_to_midi_bytes(triples, n_steps, tempo, key, chords, cfg)
+
+
+def save_notes_to_midi(notes, filename, n_steps=config.TOTAL_STEPS, tempo=80, key=None, chords=None, cfg=config):
+    with open(filename, "wb") as f:
+        f.write(notes_to_midi_bytes(notes, n_steps, tempo, key, chords, cfg))
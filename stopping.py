@@ -0,0 +1,85 @@
+# stopping.py
+# evolve() 的停止条件。每个条件都是一个可调用对象：接收每代的快照字典，返回 True 表示该停了。
+# 快照字段见 main.evolve()：gen / best_score / best_melody / stats / elapsed ...
+import collections
+import time
+
+
+class TargetScore:
+    """最佳分达到目标即停止"""
+    def __init__(self, score):
+        self.score = score
+
+    def __call__(self, snapshot):
+        return snapshot['best_score'] >= self.score
+
+    def __repr__(self):
+        return f"TargetScore({self.score})"
+
+
+class NoImprovement:
+    """连续 patience 代最佳分提升不超过 min_delta 即停止 (已收敛)"""
+    def __init__(self, patience, min_delta=0.1):
+        self.patience = patience
+        self.min_delta = min_delta
+        self._best = None
+        self._since = 0
+
+    def __call__(self, snapshot):
+        score = snapshot['best_score']
+        if self._best is None or score > self._best + self.min_delta:
+            self._best = score
+            self._since = 0
+        else:
+            self._since += 1
+        return self._since >= self.patience
+
+    def __repr__(self):
+        return f"NoImprovement({self.patience})"
+
+
+class TimeLimit:
+    """从 evolve() 开始计时，超过 seconds 秒即停止"""
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def __call__(self, snapshot):
+        return snapshot['elapsed'] >= self.seconds
+
+    def __repr__(self):
+        return f"TimeLimit({self.seconds})"
+
+
+class Deadline:
+    """
+    硬截止时刻 (time.perf_counter() 的绝对时间)：预计下一代做不完就现在停止。
+    下一代的耗时取最近 window 代里最长的一代乘以 headroom；还没有观测时用 estimate。
+    与 TimeLimit 不同，停下来的时刻一般在截止之前，而不是超过之后。
+    """
+    def __init__(self, deadline, estimate=0.0, window=5, headroom=1.2):
+        self.deadline = deadline
+        self.estimate = estimate
+        self.headroom = headroom
+        self._last = None
+        self._recent = collections.deque(maxlen=window)
+
+    def __call__(self, snapshot):
+        now = time.perf_counter()
+        if self._last is not None:
+            self._recent.append(now - self._last)
+        self._last = now
+        next_gen = max(self._recent) * self.headroom if self._recent else self.estimate
+        return now + next_gen >= self.deadline
+
+    def __repr__(self):
+        return f"Deadline({self.deadline - time.perf_counter():+.3f}s)"
+
+
+def first_triggered(criteria, snapshot):
+    """依次检查所有条件 (每个都会被调用以更新内部状态)，返回第一个触发的条件，没有则返回 None"""
+    hit = None
+    for criterion in criteria:
+        if criterion(snapshot) and hit is None:
+            hit = criterion
+    return hit
+
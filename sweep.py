@@ -0,0 +1,116 @@
+# sweep.py
+# 参数扫描 / 多种子运行：把若干组配置覆盖项 × 随机种子展开成独立的训练任务，
+# 交给进程池并行执行。每个任务用 config.make_config() 得到自己的配置副本，互不干扰；
+# 任务一完成就把结果 (最佳分、收敛代数、耗时) 追加到结果表。
+#   python sweep.py --set POPULATION_SIZE=[500,1000] --set MUTATION_RATE_BASE=[0.05,0.1] --seeds 0 1 2
+#   python sweep.py --set "FITNESS_WEIGHTS=[(3,3,8,3),(3,3,6,3)]" --patience 60 -o sweep.jsonl
+import argparse
+import ast
+import contextlib
+import io
+import itertools
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import config
+import main
+from fitness_function import get_fitness
+from stopping import NoImprovement
+
+
+def expand_grid(grid):
+    """{'A': [1, 2], 'B': [3]} -> [{'A': 1, 'B': 3}, {'A': 2, 'B': 3}]"""
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[n] for n in names))]
+
+
+def run_one(overrides, seed, generations=None, patience=None):
+    """
+    单次训练 (在子进程中执行)：返回结果记录。
+    converged_gen 为最后一次刷新最佳分 (提升超过 0.1) 的代数；
+    reference_score 是最佳旋律在默认权重下的分数，权重不同的运行之间可以直接比较。
+    """
+    cfg = config.make_config(**overrides)
+    stop = [NoImprovement(patience)] if patience else None
+    random.seed(seed)
+    t0 = time.perf_counter()
+    best, converged_gen, last = -float('inf'), 0, None
+    with contextlib.redirect_stdout(io.StringIO()):  # 并行时不刷屏
+        for snapshot in main.evolve(generations=generations, stop=stop, cfg=cfg,
+                                    workers=0, recorder=None, checkpoint_path=None):
+            if snapshot['best_score'] > best + 0.1:
+                best, converged_gen = snapshot['best_score'], snapshot['gen']
+            last = snapshot
+    return {
+        'overrides': overrides,
+        'seed': seed,
+        'best_score': last['best_score'],
+        'reference_score': get_fitness(last['best_melody']),
+        'converged_gen': converged_gen,
+        'generations': last['gen'] + 1,
+        'runtime': time.perf_counter() - t0,
+        'best_melody': last['best_melody'],
+    }
+
+
+def run_sweep(runs, seeds=(0,), workers=None, generations=None, patience=None):
+    """
+    runs: 配置覆盖项字典的列表 (可由 expand_grid 生成)。
+    按 runs × seeds 展开任务并行执行，按完成顺序逐个产出结果记录。
+    """
+    for overrides in runs:
+        config.make_config(**overrides)  # 提前检查配置项名，别等到子进程里才报错
+    jobs = [(overrides, seed) for overrides in runs for seed in seeds]
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+        futures = [pool.submit(run_one, overrides, seed, generations, patience)
+                   for overrides, seed in jobs]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def _format_row(result):
+    overrides = ' '.join(f"{k}={v}" for k, v in result['overrides'].items()) or '(default)'
+    return (f"{result['best_score']:9.2f} {result['reference_score']:9.2f} {result['converged_gen']:6d} {result['generations']:6d} "
+            f"{result['runtime']:8.2f}s  seed={result['seed']:<4d} {overrides}")
+
+
+def _parse_set(text):
+    """NAME=值 或 NAME=[值1, 值2, ...]，值按 Python 字面量解析"""
+    name, _, value = text.partition('=')
+    if not value:
+        raise argparse.ArgumentTypeError(f"应为 NAME=VALUE 形式: {text}")
+    values = ast.literal_eval(value)
+    return name.strip(), values if isinstance(values, list) else [values]
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="并行参数扫描与多种子运行")
+    parser.add_argument('--set', type=_parse_set, action='append', default=[], metavar='NAME=VALUES',
+                        help="要扫描的配置项，可重复；多个取值写成列表")
+    parser.add_argument('--seeds', type=int, nargs='+', default=[0], help="随机种子")
+    parser.add_argument('--workers', type=int, help="进程数 (默认 CPU 核数)")
+    parser.add_argument('--generations', type=int, help="每次运行的最大代数 (默认 config.GENERATIONS)")
+    parser.add_argument('--patience', type=int, help="连续多少代没有提升就提前结束")
+    parser.add_argument('-o', '--output', help="结果逐行追加到该 JSONL 文件")
+    args = parser.parse_args(argv)
+
+    runs = expand_grid(dict(args.set))
+    print(f"{'best':>9s} {'ref':>9s} {'conv':>6s} {'gens':>6s} {'time':>9s}  config", file=sys.stderr)
+    out = open(args.output, 'a', encoding='utf-8') if args.output else None
+    try:
+        for result in run_sweep(runs, args.seeds, args.workers, args.generations, args.patience):
+            print(_format_row(result), file=sys.stderr)
+            if out:
+                out.write(json.dumps(result) + '\n')
+                out.flush()
+    finally:
+        if out: out.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
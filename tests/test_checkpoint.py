@@ -0,0 +1,50 @@
+# 断点续训：从断点恢复后的轨迹与不中断的运行完全一致
+import random
+import main
+import config
+
+GENERATIONS = 30
+CRASH_AT = 17   # 在这一代之后中断，最近的断点是第 15 代
+EVERY = 5
+
+
+def _run(path, generations=GENERATIONS, resume=False, stop_after=None, cfg=config):
+    snapshots = []
+    for snapshot in main.evolve(generations=generations, workers=0, checkpoint_path=path,
+                                checkpoint_every=EVERY, resume=resume, recorder=None, cfg=cfg):
+        snapshots.append((snapshot['gen'], snapshot['best_score'], snapshot['best_melody'],
+                          snapshot['elite_scores'], snapshot['stats']['mut_rate']))
+        if snapshot['gen'] == stop_after: break
+    return snapshots
+
+
+def _check_resume(tmp_path, cfg=config):
+    random.seed(11)
+    full = _run(None, cfg=cfg)
+
+    path = str(tmp_path / 'run.npz')
+    random.seed(11)
+    _run(path, stop_after=CRASH_AT, cfg=cfg)
+    random.seed(999)  # 恢复不能依赖调用方的随机数状态
+    resumed = _run(path, resume=True, cfg=cfg)
+
+    start = CRASH_AT - CRASH_AT % EVERY
+    assert resumed[0][0] == start
+    assert resumed == full[start:]
+
+
+def test_resume_reproduces_uninterrupted_run(tmp_path):
+    _check_resume(tmp_path, config.make_config(POPULATION_SIZE=200))
+
+
+def test_resume_with_memetic_refinement(tmp_path):
+    _check_resume(tmp_path, config.make_config(POPULATION_SIZE=200, MEMETIC_TOP_K=2, MEMETIC_BUDGET=20))
+
+
+def test_resume_with_adaptive_operators(tmp_path):
+    _check_resume(tmp_path, config.make_config(POPULATION_SIZE=200, ADAPTIVE_OPERATORS=True))
+
+
+def test_resume_with_prescreen(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, 'PRESCREEN_CHUNK_CELLS', 1024)  # 每块 5 窝，一代分成多块
+    _check_resume(tmp_path, config.make_config(POPULATION_SIZE=200, PRESCREEN_BROOD=3))
@@ -0,0 +1,72 @@
+# 批量 / 增量 / 缓存打分都必须与逐个调用 get_fitness 的结果完全一致
+import random
+import numpy as np
+import pytest
+import config
+import utils
+from fitness_function import (FitnessModel, FitnessCache, get_fitness, get_fitness_batch,
+                              score_components, rescore_delta)
+
+CONFIGS = {
+    'default':   (config.make_config(), None, None),
+    '16th':      (config.make_config(STEPS_PER_BEAT=4), None, None),
+    '8_bars':    (config.make_config(NUM_BARS=8, REST_PROB=0.3), None, None),
+    '6_bars_D':  (config.make_config(NUM_BARS=6), 2, config.PROGRESSIONS['ii-V-I-vi']),
+    'weights':   (config.make_config(FITNESS_WEIGHTS=(1, 5, 2, 7)), 9, config.PROGRESSIONS['vi-IV-I-V']),
+    'long':      (config.make_config(NUM_BARS=64, STEPS_PER_BEAT=4), None, None),
+}
+
+
+def _population(cfg, n, seed):
+    """随机种群，外加全休止、只有一个音的边界情况"""
+    pop = utils.generate_random_population(n, cfg.TOTAL_STEPS, np.random.default_rng(seed), cfg)
+    pop[0] = 0
+    pop[1] = 0
+    pop[1, cfg.TOTAL_STEPS // 2] = 67
+    return pop
+
+
+@pytest.fixture(params=list(CONFIGS))
+def setup(request):
+    cfg, key, chords = CONFIGS[request.param]
+    return cfg, FitnessModel(cfg, key=key, chords=chords)
+
+
+def test_batch_matches_scalar(setup):
+    cfg, model = setup
+    pop = _population(cfg, 40 if cfg.TOTAL_STEPS > 256 else 300, seed=1)
+    expected = [get_fitness(m, model=model) for m in pop.tolist()]
+    assert get_fitness_batch(pop, model=model).tolist() == expected
+
+
+def test_components_total_matches_scalar(setup):
+    cfg, model = setup
+    for melody in _population(cfg, 30, seed=2).tolist()[2:]:
+        assert score_components(melody, model=model)['total'] == get_fitness(melody, model=model)
+
+
+def test_rescore_delta_matches_full(setup):
+    cfg, model = setup
+    r = random.Random(3)
+    values = [0] + list(range(cfg.PITCH_MIN, cfg.PITCH_MAX + 1))
+    for melody in _population(cfg, 30, seed=3).tolist()[2:]:
+        comp = score_components(melody, model=model)
+        for _ in range(5):
+            lo = r.randrange(len(melody))
+            hi = min(len(melody), lo + r.randint(1, 6))
+            child = melody[:]
+            for i in range(lo, hi):
+                child[i] = r.choice(values)
+            if not any(child): continue
+            new = rescore_delta(child, comp, lo, hi, model=model)
+            assert new['total'] == get_fitness(child, model=model)
+            melody, comp = child, new  # 连续增量更新也不能累积误差
+
+
+def test_cache_matches_batch():
+    pop = _population(config, 500, seed=4)
+    pop[250:] = pop[:250]  # 同一批内的重复
+    cache = FitnessCache(100)
+    expected = get_fitness_batch(pop)
+    assert cache.score_batch(pop).tolist() == expected.tolist()
+    assert cache.score_batch(pop[::-1]).tolist() == expected[::-1].tolist()
@@ -0,0 +1,56 @@
+# 稀疏音符表示：打分与逐步基因完全一致，算子输出规范形式，MIDI 与逐步导出相同
+import numpy as np
+import pytest
+import config
+import utils
+import sparse
+from fitness_function import FitnessModel, get_fitness
+from test_fitness import CONFIGS
+
+
+def _pieces(cfg, n_steps, n, seed):
+    """随机音符 (长音符、跨小节) 与逐步基因转换来的音符交替，外加空旋律和单个音符"""
+    rng = np.random.default_rng(seed)
+    pieces = [sparse.empty_notes(), np.array([[n_steps // 2, 67, 1]], dtype=np.int32)]
+    for i in range(n):
+        if i % 2: pieces.append(sparse.random_notes(n_steps, rng, cfg))
+        else: pieces.append(sparse.from_dense(utils.generate_random_population(1, n_steps, rng, cfg)[0]))
+    return pieces
+
+
+@pytest.fixture(params=list(CONFIGS))
+def setup(request):
+    cfg, key, chords = CONFIGS[request.param]
+    return cfg, FitnessModel(cfg, key=key, chords=chords)
+
+
+@pytest.mark.parametrize('extra', [0, 3])  # 3: 最后一个小节不完整
+def test_fitness_matches_dense(setup, extra):
+    cfg, model = setup
+    n_steps = cfg.TOTAL_STEPS + extra
+    for notes in _pieces(cfg, n_steps, 20 if n_steps > 256 else 200, seed=extra):
+        dense = sparse.to_dense(notes, n_steps).tolist()
+        assert sparse.get_fitness_notes(notes, n_steps, model=model) == get_fitness(dense, model=model)
+
+
+def test_operators_return_canonical_notes(setup):
+    cfg, _ = setup
+    n_steps = cfg.TOTAL_STEPS
+    rng = np.random.default_rng(4)
+    pieces = _pieces(cfg, n_steps, 20, seed=4)[2:]
+    for notes in pieces:
+        children = [op(notes, n_steps, rng, cfg) for op, _ in sparse.SPARSE_STRATEGIES]
+        children += sparse.crossover_notes(notes, pieces[0], n_steps, rng)
+        for child in children:
+            dense = sparse.to_dense(child, n_steps)
+            assert np.array_equal(sparse.from_dense(dense), child)
+            assert (child[:, sparse.ONSET] + child[:, sparse.DURATION] <= n_steps).all()
+            assert ((dense == 0) | ((dense >= cfg.PITCH_MIN) & (dense <= cfg.PITCH_MAX))).all()
+
+
+def test_midi_matches_dense_export(setup):
+    cfg, _ = setup
+    n_steps = cfg.TOTAL_STEPS
+    for notes in _pieces(cfg, n_steps, 3, seed=5)[1:]:
+        dense = sparse.to_dense(notes, n_steps)
+        assert sparse.notes_to_midi_bytes(notes, n_steps, cfg=cfg) == utils.melody_to_midi_bytes(dense, cfg=cfg)
@@ -1,5 +1,10 @@
 # utils.py
+import io
+import os
 import random
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import numpy as np
 from midiutil import MIDIFile
 import config  # 导入配置
 
@@ -14,58 +19,164 @@ def generate_random_melody(length=config.TOTAL_STEPS):
         melody.append(note)
     return melody
 
-def save_melody_to_midi(melody, filename="output.mid", tempo=80):
+def generate_random_population(size, length=None, rng=None, cfg=config):
     """
-    保存 MIDI 文件 (包含连音处理 & 和弦伴奏)
+    批量生成随机基因：返回 (size, length) 的 uint8 数组，分布与 generate_random_melody 相同。
+    rng 为 numpy 的 Generator，不传则新建一个；cfg 提供音域与休止符概率 (默认 config 模块)。
     """
-    track = 0
-    channel_melody = 0  # 旋律通道
-    channel_chord = 1   # 和弦伴奏通道
-    
-    time = 0
-    volume = 100
-    
-    # --- 【关键修改】 动态计算步长 ---
-    # 如果 STEPS_PER_BEAT=4, duration=0.25 (16分音符)
-    # 如果 STEPS_PER_BEAT=2, duration=0.5 (8分音符)
-    step_duration = 1.0 / config.STEPS_PER_BEAT 
-    
-    MyMIDI = MIDIFile(1) 
-    MyMIDI.addTempo(track, time, tempo)
-    
-    # --- 1. 旋律写入 ---
-    if len(melody) > 0:
-        current_pitch = melody[0]
-        current_length = 1
-        current_start = 0
-    
+    if length is None: length = cfg.TOTAL_STEPS
+    if rng is None: rng = np.random.default_rng()
+    pop = rng.integers(cfg.PITCH_MIN, cfg.PITCH_MAX + 1, (size, length), dtype=np.uint8)
+    pop[rng.random((size, length)) < cfg.REST_PROB] = 0
+    return pop
+
+def scale_pitches(cfg=config, base=60):
+    """当前调 (cfg.KEY) 的调内音在 base 往上一个八度内的 MIDI 音高，升序"""
+    return sorted(base + (cfg.KEY + pc) % 12 for pc in cfg.SCALE)
+
+def transpose(melody, shift):
+    """旋律整体移调 shift 个半音 (休止符不变)，返回 uint8 数组；超出 MIDI 音域 1~127 时报错"""
+    melody = np.asarray(melody)
+    moved = np.where(melody > 0, melody.astype(np.int16) + shift, 0)
+    if (moved < 0).any() or (moved > 127).any():
+        raise ValueError(f"移调 {shift:+d} 后超出 MIDI 音域")
+    return moved.astype(np.uint8)
+
+def melody_notes(melody):
+    """
+    把逐步的基因合并成音符 (连音处理)：返回 [(pitch, 起始步, 持续步数), ...]，休止符不出现
+    """
+    notes = []
+    if len(melody) == 0: return notes
+    current_pitch = melody[0]
+    current_length = 1
+    current_start = 0
     for i in range(1, len(melody)):
         note = melody[i]
         if note == current_pitch and note != 0:
             current_length += 1
         else:
             if current_pitch != 0:
-                MyMIDI.addNote(track, channel_melody, current_pitch, 
-                               current_start * step_duration, 
-                               current_length * step_duration, volume)
+                notes.append((int(current_pitch), current_start, current_length))
             current_pitch = note
             current_length = 1
             current_start = i
-            
-    # 写入最后一个音
+    # 最后一个音
     if current_pitch != 0:
-        MyMIDI.addNote(track, channel_melody, current_pitch, 
-                       current_start * step_duration, 
-                       current_length * step_duration, volume)
-            
-    # --- 2. 写入背景和弦 ---
-    for i, root in enumerate(config.CHORD_ROOTS):
-        start_time = i * config.CHORD_DURATION
-        # 和弦伴奏
-        MyMIDI.addNote(track, channel_chord, root, start_time, config.CHORD_DURATION, 70)
-        MyMIDI.addNote(track, channel_chord, root+4, start_time, config.CHORD_DURATION, 70)
-        MyMIDI.addNote(track, channel_chord, root+7, start_time, config.CHORD_DURATION, 70)
+        notes.append((int(current_pitch), current_start, current_length))
+    return notes
+
+def chord_voicings(key=None, chords=None, bass_min=None, cfg=config):
+    """
+    和弦进行 (相对主音的音级，第一个是根音) 在 key 调上的伴奏音高：
+    根音放在 bass_min 往上一个八度内，其余音依次叠在根音之上。
+    key / chords / bass_min 默认取 cfg.KEY / CHORDS / CHORD_BASS_MIN。
+    """
+    if key is None: key = cfg.KEY
+    if chords is None: chords = cfg.CHORDS
+    if bass_min is None: bass_min = cfg.CHORD_BASS_MIN
+    voicings = []
+    for chord in chords:
+        root = (key + chord[0]) % 12
+        bass = bass_min + (root - bass_min) % 12
+        voicings.append(tuple(bass + (pc - chord[0]) % 12 for pc in chord))
+    return tuple(voicings)
+
+@lru_cache(maxsize=None)
+def _chord_events(voicings, chord_duration, n_chords):
+    """背景和弦的音符事件 (pitch, 起始拍, 时值, 力度)，和弦进行循环 n_chords 次，只构造一次"""
+    events = []
+    for i in range(n_chords):
+        start_time = i * chord_duration
+        for pitch in voicings[i % len(voicings)]:
+            events.append((pitch, start_time, chord_duration, 70))
+    return tuple(events)
+
+def _add_notes(MyMIDI, track, notes, channel=0, volume=100, cfg=config):
+    """写入音符列表 [(pitch, 起始步, 持续步数), ...]"""
+    # 如果 STEPS_PER_BEAT=4, duration=0.25 (16分音符)
+    # 如果 STEPS_PER_BEAT=2, duration=0.5 (8分音符)
+    step_duration = 1.0 / cfg.STEPS_PER_BEAT
+    for pitch, start, length in notes:
+        MyMIDI.addNote(track, channel, pitch, start * step_duration, length * step_duration, volume)
+
+def _add_melody(MyMIDI, track, melody, channel=0, volume=100, cfg=config):
+    _add_notes(MyMIDI, track, melody_notes(melody), channel, volume, cfg)
 
+def _add_chords(MyMIDI, track, n_steps=None, channel=1, key=None, chords=None, cfg=config):
+    """和弦伴奏：至少一整轮和弦进行 (key / chords 默认取 cfg.KEY / CHORDS)，长曲子循环铺满 n_steps"""
+    voicings = chord_voicings(key, chords, cfg=cfg)
+    n_chords = len(voicings)
+    if n_steps is not None:
+        beats = n_steps / cfg.STEPS_PER_BEAT
+        n_chords = max(n_chords, -int(-beats // cfg.CHORD_DURATION))
+    for pitch, start_time, duration, volume in _chord_events(voicings, cfg.CHORD_DURATION, n_chords):
+        MyMIDI.addNote(track, channel, pitch, start_time, duration, volume)
+
+def notes_to_midi_bytes(notes, n_steps, tempo=80, key=None, chords=None, cfg=config):
+    """
+    由音符列表 [(pitch, 起始步, 持续步数), ...] 在内存中渲染 MIDI (含和弦伴奏)，返回 bytes。
+    melody_to_midi_bytes 先把逐步基因合并成音符列表 (见 melody_notes) 再调用这里；
+    稀疏表示 (sparse.py) 与长曲子直接走这里，不需要展开成逐步的基因。
+    key / chords 为伴奏的调性与和弦进行 (相对音级)，默认取 cfg.KEY / CHORDS；
+    cfg 还提供每拍步数与和弦时值 (默认 config 模块，也可以是 config.make_config 的副本)。
+    """
+    MyMIDI = MIDIFile(1)
+    MyMIDI.addTempo(0, 0, tempo)
+    _add_notes(MyMIDI, 0, notes, cfg=cfg)      # 旋律通道 0
+    _add_chords(MyMIDI, 0, n_steps, key=key, chords=chords, cfg=cfg)   # 和弦伴奏通道 1
+    buf = io.BytesIO()
+    MyMIDI.writeFile(buf)
+    return buf.getvalue()
+
+def melody_to_midi_bytes(melody, tempo=80, key=None, chords=None, cfg=config):
+    """
+    在内存中渲染 MIDI (包含连音处理 & 和弦伴奏)，返回文件内容 bytes
+    """
+    return notes_to_midi_bytes(melody_notes(melody), len(melody), tempo, key, chords, cfg)
+
+def save_melody_to_midi(melody, filename="output.mid", tempo=80, verbose=True, key=None, chords=None, cfg=config):
+    """
+    保存 MIDI 文件 (包含连音处理 & 和弦伴奏)
+    """
+    data = melody_to_midi_bytes(melody, tempo, key, chords, cfg)
     with open(filename, "wb") as f:
-        MyMIDI.writeFile(f)
-    print(f"Saved MIDI to: {filename}")
\ No newline at end of file
+        f.write(data)
+    if verbose:
+        print(f"Saved MIDI to: {filename}")
+
+def export_melodies(melodies, path, tempo=80, mode='files', names=None, workers=4, key=None, chords=None,
+                    cfg=config):
+    """
+    批量导出 (如名人堂 / 每次训练的前 500 名)，不逐个打印。
+    mode='files':  path 为目录，每条旋律一个文件 (names 给定文件名，默认 0001.mid ...)，
+                   由线程池渲染并写盘，返回文件路径列表。
+    mode='tracks': path 为文件，所有旋律写成同一个多音轨 MIDI (音轨 0 为和弦伴奏，
+                   之后每条旋律一个音轨)，返回 path。
+    key / chords 为伴奏的调性与和弦进行，默认取 cfg.KEY / CHORDS；cfg 默认 config 模块。
+    """
+    if mode == 'tracks':
+        MyMIDI = MIDIFile(len(melodies) + 1)
+        MyMIDI.addTempo(0, 0, tempo)
+        _add_chords(MyMIDI, 0, max((len(m) for m in melodies), default=0), key=key, chords=chords, cfg=cfg)
+        for i, melody in enumerate(melodies):
+            _add_melody(MyMIDI, i + 1, melody, cfg=cfg)
+        with open(path, "wb") as f:
+            MyMIDI.writeFile(f)
+        return path
+    if mode != 'files':
+        raise ValueError(f"未知的导出模式: {mode}")
+
+    os.makedirs(path, exist_ok=True)
+    if names is None:
+        names = [f"{i + 1:04d}.mid" for i in range(len(melodies))]
+    paths = [os.path.join(path, name) for name in names]
+
+    def write(job):
+        melody, filename = job
+        with open(filename, "wb", buffering=1 << 16) as f:
+            f.write(melody_to_midi_bytes(melody, tempo, key, chords, cfg))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(write, zip(melodies, paths)))
+    return paths